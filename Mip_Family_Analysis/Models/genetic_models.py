@@ -60,11 +60,20 @@ from pprint import pprint as pp
 from Mip_Family_Analysis.Utils import pair_generator
 from Mip_Family_Analysis.Variants import genotype
 
-def check_genetic_models(variant_batch, family, verbose = False, phased=False ,proc_name = None):
+def check_genetic_models(variant_batch, family, verbose = False, phased=False ,proc_name = None, compounds=True, 
+                            skip_models=(), compound_checker=None):
     #A variant batch is a dictionary on the form {gene_id: {variant_id:variant_dict}}
+    # If compounds is False the batch may be a part of a gene so we can not look for compound pairs.
+    # The models of the variants in skip_models are not checked, unless they are compound candidates. A compound
+    # candidate needs its own models since its rank score is a part of the compound scores of its partners.
+    # If phased is True the variants have a dictionary with the haploblock of each phased individual
+    # on the form {ind_id:haploblock_id}, see variant_parser.
+    # compound_checker is a function like get_compound_pairs, it is used to check the pairs of the compound
+    # candidates of a gene. The consumers use it to split the pairs of big genes between them.
+    if compound_checker is None:
+        compound_checker = get_compound_pairs
     # Start by getting the genotypes for each variant:
     individuals = list(family.individuals.values())
-    intervals = variant_batch.pop('haploblocks', {})
     for gene in variant_batch:
         for variant_id in variant_batch[gene]:
             
@@ -73,17 +82,28 @@ def check_genetic_models(variant_batch, family, verbose = False, phased=False ,p
             variant_batch[gene][variant_id]['Inheritance_model'] = {'XR': True, 'XR_dn': True, 
                 'XD': True, 'XD_dn': True, 'AD': True, 'AD_dn': True, 'AR_hom': True, 
                 'AR_hom_dn': True, 'AR_comp': False, 'AR_comp_dn': False}
+    # First remove all variants that can't be compounds to reduce the number of lookup's:
+    gene_candidates = {}
+    for gene in variant_batch:
+        gene_candidates[gene] = []
+        # We look at compounds only when variants are in genes:
+        if gene != '-' and compounds:
+            gene_candidates[gene] = check_compound_candidates(variant_batch[gene], family)
+    if skip_models:
+        skip_models = set(skip_models).difference(*[candidates for candidates in gene_candidates.values() 
+                                                        if len(candidates) > 1])
     # Now check the genetic models:
     for gene in variant_batch:
-        compound_candidates = []
+        compound_candidates = gene_candidates[gene]
         compound_pairs = []
-        # We look at compounds only when variants are in genes:
-        if gene != '-':
-            # First remove all variants that can't be compounds to reduce the number of lookup's:
-            compound_candidates = check_compound_candidates(variant_batch[gene], family)
         
         for variant_id in variant_batch[gene]:
             
+            if variant_id in skip_models:
+                for model in variant_batch[gene][variant_id]['Inheritance_model']:
+                    variant_batch[gene][variant_id]['Inheritance_model'][model] = False
+                continue
+            
             # Only check X-linked for the variants in the X-chromosome:
             # For X-linked we do not need to check the other models
             if variant_batch[gene][variant_id]['Chromosome'] == 'X':
@@ -103,16 +123,25 @@ def check_genetic_models(variant_batch, family, verbose = False, phased=False ,p
             
         if len(compound_candidates) > 1:
             
-            compound_pairs = pair_generator.Pair_Generator(compound_candidates)
-            for pair in compound_pairs.generate_pairs():
+            compound_pairs = compound_checker(variant_batch[gene], compound_candidates, family, phased)
+            for pair in compound_pairs:
                 # Add the compound pair id to each variant
-                if check_compounds(variant_batch[gene][pair[0]], variant_batch[gene][pair[1]], family, phased, intervals):
-                    variant_batch[gene][pair[0]]['Compounds'][pair[1]] = 0
-                    variant_batch[gene][pair[1]]['Compounds'][pair[0]] = 0
-                    variant_batch[gene][pair[0]]['Inheritance_model']['AR_comp'] = True
-                    variant_batch[gene][pair[1]]['Inheritance_model']['AR_comp'] = True
+                variant_batch[gene][pair[0]]['Compounds'][pair[1]] = 0
+                variant_batch[gene][pair[1]]['Compounds'][pair[0]] = 0
+                variant_batch[gene][pair[0]]['Inheritance_model']['AR_comp'] = True
+                variant_batch[gene][pair[1]]['Inheritance_model']['AR_comp'] = True
     return
 
+def get_compound_pairs(variants, compound_candidates, family, phased, first_row = 0, last_row = None):
+    """Return a list with the pairs of compound candidates that are compounds, in the order of Pair_Generator.
+    
+    If first_row and last_row are given only the pairs in those rows are checked, see Pair_Generator."""
+    compound_pairs = []
+    for pair in pair_generator.Pair_Generator(compound_candidates).generate_pairs(first_row, last_row):
+        if check_compounds(variants[pair[0]], variants[pair[1]], family, phased):
+            compound_pairs.append(pair)
+    return compound_pairs
+
 def check_compound_candidates(variants, family):
     """Sort out the compound candidates, this function is used to reduce the number of potential candidates."""
     #Make a copy of the dictionary to not change the original one. {variant_id:variant_dict}
@@ -143,21 +172,27 @@ def check_compound_candidates(variants, family):
                 comp_candidates = {}
     return list(comp_candidates.keys())
 
-def check_compounds(variant_1, variant_2, family, phased, intervals):
+def check_compounds(variant_1, variant_2, family, phased):
     """Check which variants in the list that follow the compound heterozygous model. At this stage we\
         know that none of the individuals are homozygote alternative for the variants."""
     
+    if phased:
+        haploblocks_1 = variant_1.get('Haploblocks', {})
+        haploblocks_2 = variant_2.get('Haploblocks', {})
     # Check in all individuals what genotypes that are in the trio based of the individual picked.
     for individual in family.individuals:
         genotype_1 = variant_1['Genotypes'].get(individual, genotype.Genotype())
         genotype_2 = variant_2['Genotypes'].get(individual, genotype.Genotype())
+        if phased:
+            # The variants are in the same haploblock if both are phased in the same block
+            haploblock = haploblocks_1.get(individual)
+            same_haploblock = haploblock is not None and haploblock == haploblocks_2.get(individual)
         if family.individuals[individual].phenotype != 2:
         # If the individual is not sick and have both variants it can not be compound
             if genotype_1.has_variant and genotype_2.has_variant:
                 if phased:
                 # If the family is phased we need to check if a healthy individual have both variants on same allele
-                    if len(set(intervals[individual].find_range([int(variant_1['POS']),int(variant_1['POS'])])
-                                ).intersection(intervals[individual].find_range([int(variant_2['POS']),int(variant_2['POS'])]))) > 0:
+                    if same_haploblock:
                         # If the variants are on different alleles it can not be a compound pair:
                         if genotype_1.allele_1 == '0' and genotype_2.allele_1 != '0':
                             return False
@@ -170,8 +205,7 @@ def check_compounds(variant_1, variant_2, family, phased, intervals):
         else:# The case where the individual is affected
             if phased:
                 #If the individual is sick and phased it has to have one variant on each allele
-                if len(set(intervals[individual].find_range([int(variant_1['POS']),int(variant_1['POS'])])
-                            ).intersection(intervals[individual].find_range([int(variant_2['POS']),int(variant_2['POS'])]))) > 0:
+                if same_haploblock:
                     if genotype_1.allele_1 == '0' and genotype_2.allele_1 == '0':
                         return False
                     
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+rank_model.py
+
+A rank model holds all thresholds and scores that are used when scoring the variants.
+
+The default model is the one described in score_variants.py. Other models can be read from a config
+file, see rank_model.ini for the format. When a config is read it is compiled to dictionaries and
+lists of (cutoff, score) tuples so nothing has to be interpreted when the variants are scored.
+
+Run as a script to compare the time it takes to score variants with the default model and with a
+model from a config file:
+
+    python rank_model.py rank_model.ini
+"""
+
+import sys
+import os
+import gc
+import argparse
+import hashlib
+
+from datetime import datetime
+
+try:
+    import configparser
+except ImportError:
+    import ConfigParser as configparser
+
+consequence_severity = {}
+# This is the rank scores for the different consequences that VEP uses:
+consequence_severity['transcript_ablation'] = 5
+consequence_severity['splice_donor_variant'] = 5
+consequence_severity['splice_acceptor_variant'] = 5
+consequence_severity['stop_gained'] = 5
+consequence_severity['frameshift_variant'] = 5
+consequence_severity['stop_lost'] = 5
+consequence_severity['initiator_codon_variant'] = 5
+consequence_severity['inframe_insertion'] = 3
+consequence_severity['inframe_deletion'] = 3
+consequence_severity['missense_variant'] = 3
+consequence_severity['transcript_amplification'] = 3
+consequence_severity['splice_region_variant'] = 3
+consequence_severity['incomplete_terminal_codon_variant'] = 3
+consequence_severity['synonymous_variant'] = 1
+consequence_severity['stop_retained_variant'] = 1
+consequence_severity['coding_sequence_variant'] = 1
+consequence_severity['mature_miRNA_variant'] = 1
+consequence_severity['5_prime_UTR_variant'] = 1
+consequence_severity['3_prime_UTR_variant'] = 1
+consequence_severity['non_coding_exon_variant'] = 1
+consequence_severity['nc_transcript_variant'] = 1
+consequence_severity['intron_variant'] = 1
+consequence_severity['NMD_transcript_variant'] = 1
+consequence_severity['upstream_gene_variant'] = 1
+consequence_severity['downstream_gene_variant'] = 1
+consequence_severity['TFBS_ablation'] = 1
+consequence_severity['TFBS_amplification'] = 1
+consequence_severity['TF_binding_site_variant'] = 1
+consequence_severity['regulatory_region_variant'] = 1
+consequence_severity['regulatory_region_ablation'] = 1
+consequence_severity['regulatory_region_amplification'] = 1
+consequence_severity['feature_elongation'] = 1
+consequence_severity['feature_truncation'] = 1
+consequence_severity['intergenic_variant'] = 0
+
+
+class RankModel(object):
+    """Holds the compiled thresholds and scores of a rank model.
+
+    Cutoffs are lists of (cutoff, score) tuples. Frequencies get the score of the first cutoff that they
+    are lower than or equal to, all other cutoffs gives the score of the first cutoff that the value is
+    greater than or equal to.
+    """
+    def __init__(self, name = 'default'):
+        super(RankModel, self).__init__()
+        self.name = name
+        # Models of inheritance
+        self.prefered_model_score = 3
+        self.followed_model_score = 1
+        self.no_model_score = -12
+        # Predictors, (cutoff, score)
+        self.sift = (0.05, 1)
+        self.mutation_taster = (0.05, 1)
+        self.poly_phen = (0.85, 1)
+        # Functional annotation
+        self.consequence_severity = dict(consequence_severity)
+        # Frequency in databases
+        self.frequency_cutoffs = [(0.005, 2), (0.02, 1)]
+        self.common_score = -12
+        self.missing_frequency_score = 3
+        self.novel_score = 1
+        # Filter
+        self.filter_scores = {'PASS':3, 'PRES':1}
+        # Conservation
+        self.region_conservation_scores = (2, 1)
+        self.gerp_cutoffs = [(4.0, 2), (2.0, 1)]
+        self.phylop_cutoffs = [(0.9984188612, 2), (0.95, 1)]
+        # Other annotations
+        self.segmental_duplication_score = -2
+        self.hgmd_score = 1
+        self.version = self.get_version()
+
+    def get_version(self):
+        """Return a string that identifies the scores and thresholds of the model."""
+        tables = [(key, self.__dict__[key]) for key in sorted(self.__dict__) if key not in ['name', 'version']]
+        return self.name + ':' + hashlib.sha1(repr(tables).encode('utf-8')).hexdigest()[:10]
+
+    @classmethod
+    def from_config(cls, config_file):
+        """Compile a rank model from a config file."""
+        config = configparser.RawConfigParser()
+        # The option names are consequences and filters so they are case sensitive
+        config.optionxform = str
+        if not config.read(config_file):
+            raise IOError("Could not read the rank model config: %s" % config_file)
+
+        rank_model = cls(name = config.get('Model', 'name'))
+
+        def get_score(section, option):
+            return config.getint(section, option)
+
+        def get_cutoffs(section, option):
+            """Cutoffs are written like <cutoff>:<score>, <cutoff>:<score>"""
+            cutoffs = []
+            for cutoff_string in config.get(section, option).split(','):
+                cutoff, score = cutoff_string.split(':')
+                cutoffs.append((float(cutoff), int(score)))
+            return cutoffs
+
+        rank_model.prefered_model_score = get_score('Inheritance', 'prefered_model')
+        rank_model.followed_model_score = get_score('Inheritance', 'followed_model')
+        rank_model.no_model_score = get_score('Inheritance', 'no_model')
+
+        rank_model.sift = get_cutoffs('Predictions', 'sift')[0]
+        rank_model.mutation_taster = get_cutoffs('Predictions', 'mutation_taster')[0]
+        rank_model.poly_phen = get_cutoffs('Predictions', 'poly_phen')[0]
+
+        rank_model.consequence_severity = dict((consequence, get_score('Consequence', consequence))
+                                                for consequence in config.options('Consequence'))
+
+        rank_model.frequency_cutoffs = sorted(get_cutoffs('Frequency', 'cutoffs'))
+        rank_model.common_score = get_score('Frequency', 'common')
+        rank_model.missing_frequency_score = get_score('Frequency', 'missing')
+        rank_model.novel_score = get_score('Frequency', 'novel')
+
+        rank_model.filter_scores = dict((filt, get_score('Filter', filt)) for filt in config.options('Filter'))
+
+        rank_model.region_conservation_scores = (get_score('Conservation', 'region_both'),
+                                                    get_score('Conservation', 'region_one'))
+        rank_model.gerp_cutoffs = sorted(get_cutoffs('Conservation', 'gerp'), reverse=True)
+        rank_model.phylop_cutoffs = sorted(get_cutoffs('Conservation', 'phylop'), reverse=True)
+
+        rank_model.segmental_duplication_score = get_score('Annotation', 'segmental_duplication')
+        rank_model.hgmd_score = get_score('Annotation', 'hgmd')
+
+        rank_model.version = rank_model.get_version()
+        return rank_model
+
+
+default_rank_model = RankModel()
+
+def get_benchmark_variants(nr_of_variants):
+    """Return a dictionary with variants that have values for all scores."""
+    variants = {}
+    values = ['-', '0.001', '0.01', '0.5', '0.96', '0.999', '3', '5']
+    for i in range(nr_of_variants):
+        value = values[i % len(values)]
+        variants[i] = {'SIFT':value, 'Mutation_taster':value, 'Poly_phen':value, '1000G':value,
+                        'Dbsnp129':value, 'HBVDB':value, 'Dbsnp_nonflagged':'-', 'GT_call_filter':'PASS',
+                        'GERP':value, 'Phylo_p':value, 'Phast_cons_lements':'-', 'GERP_elements':value,
+                        'Genomic_super_dups':'-', 'HGMD':'-', 'Inheritance_model':{'AD':True},
+                        'Functional_annotation':'ADK:missense_variant,POT1:intron_variant'}
+    return variants
+
+def main():
+    from Mip_Family_Analysis.Models import score_variants
+    parser = argparse.ArgumentParser(description="Time the scoring with the default and a compiled rank model.")
+    parser.add_argument('config_file', type=str, nargs=1 , help='A rank model config file.')
+    parser.add_argument('-n', '--nr_of_variants', type=int, nargs=1 , default=[200000],
+                            help='Number of variants to score.')
+    args = parser.parse_args()
+    compiled_model = RankModel.from_config(args.config_file[0])
+    nr_of_variants = args.nr_of_variants[0]
+    for name, rank_model in [('default', default_rank_model), ('compiled', compiled_model)]:
+        variants = get_benchmark_variants(nr_of_variants)
+        gc.collect()
+        start = datetime.now()
+        score_variants.score_variant(variants, ['AD'], rank_model)
+        print(('Time to score %s variants with the %s model: %s' % (nr_of_variants, name, str(datetime.now() - start))))
+
+
+if __name__ == '__main__':
+    main()
@@ -5,6 +5,9 @@ score_variant.py
 
 Script that takes a variant as input and modify it with a score depending on its different values.
 
+The thresholds and scores are taken from a rank model, see rank_model.py. If no model is given the 
+default model is used.
+
 Possible names for the list of genetic models are:
 
 AD, AD_denovo, AR, AR_denovo, AR_compound, X, X_denovo
@@ -17,48 +20,31 @@ Copyright (c) 2013 __MyCompanyName__. All rights reserved.
 import sys
 import os
 
+from functools import lru_cache
 from pprint import pprint as pp
 
+# numpy takes long to import, it is imported by get_numpy the first time a big batch is scored.
+# It is False if numpy is not installed.
+numpy = None
+
 from Mip_Family_Analysis.Utils import is_number
+from Mip_Family_Analysis.Models.rank_model import default_rank_model
+
+# Batches with fewer variants than this are faster to score one variant at a time
+NUMPY_BATCH_SIZE = 50
+
+# The same functional annotations are seen over and over so the parsing and scoring of them are cached:
+ANNOTATION_CACHE_SIZE = 16384
+
 
+# The consequence severity of the default rank model:
+consequence_severity = default_rank_model.consequence_severity
 
-consequence_severity = {}
-# This is the rank scores for the different consequences that VEP uses:
-consequence_severity['transcript_ablation'] = 5
-consequence_severity['splice_donor_variant'] = 5
-consequence_severity['splice_acceptor_variant'] = 5
-consequence_severity['stop_gained'] = 5
-consequence_severity['frameshift_variant'] = 5
-consequence_severity['stop_lost'] = 5
-consequence_severity['initiator_codon_variant'] = 5
-consequence_severity['inframe_insertion'] = 3
-consequence_severity['inframe_deletion'] = 3
-consequence_severity['missense_variant'] = 3
-consequence_severity['transcript_amplification'] = 3
-consequence_severity['splice_region_variant'] = 3
-consequence_severity['incomplete_terminal_codon_variant'] = 3
-consequence_severity['synonymous_variant'] = 1
-consequence_severity['stop_retained_variant'] = 1
-consequence_severity['coding_sequence_variant'] = 1
-consequence_severity['mature_miRNA_variant'] = 1
-consequence_severity['5_prime_UTR_variant'] = 1
-consequence_severity['3_prime_UTR_variant'] = 1
-consequence_severity['non_coding_exon_variant'] = 1
-consequence_severity['nc_transcript_variant'] = 1
-consequence_severity['intron_variant'] = 1
-consequence_severity['NMD_transcript_variant'] = 1
-consequence_severity['upstream_gene_variant'] = 1
-consequence_severity['downstream_gene_variant'] = 1
-consequence_severity['TFBS_ablation'] = 1
-consequence_severity['TFBS_amplification'] = 1
-consequence_severity['TF_binding_site_variant'] = 1
-consequence_severity['regulatory_region_variant'] = 1
-consequence_severity['regulatory_region_ablation'] = 1
-consequence_severity['regulatory_region_amplification'] = 1
-consequence_severity['feature_elongation'] = 1
-consequence_severity['feature_truncation'] = 1
-consequence_severity['intergenic_variant'] = 0
 
+# These are the columns of a variant that are used by the scoring:
+scoring_columns = ['Mutation_taster', 'SIFT', 'Poly_phen_hdiv', 'Poly_phen', 'Functional_annotation', '1000G', 
+                    'Dbsnp129', 'Dbsnp_nonflagged', 'HBVDB', 'GT_call_filter', 'GERP', 'Phast_cons_lements', 
+                    'GERP_elements', 'Phylo_p', 'Genomic_super_dups', 'HGMD']
 
 def get_genetic_models(model_dict):
     """return a list with the genetic models followed"""
@@ -68,115 +54,279 @@ def get_genetic_models(model_dict):
             models_followed.append(model)
     return models_followed
 
-def score_variant(variants, prefered_models = []):
-    """Score a variant object according to Henriks score model. Input: A variant object and a list of genetic models."""
+def score_variant(variants, prefered_models = [], rank_model = default_rank_model, annotation_scores = None):
+    """Score a variant object according to Henriks score model. Input: A variant object and a list of genetic models.
+    
+    The score is the sum of the inheritance score and the annotation score. The annotation score does not depend on
+    the family, annotation_scores is a dictionary on the form {variant_id:annotation_score} with known annotation 
+    scores. The annotation scores that are missing are computed and added to annotation_scores."""
     
     if  prefered_models == ['NA']:
         prefered_models = []
     
+    if annotation_scores is None:
+        annotation_scores = {}
+    
     for variant_id in variants:
         variant = variants[variant_id]
-        score = 0
         # Models of inheritance
         variant_models = get_genetic_models(variant.get('Inheritance_model', {}))
         
-        # Predictors
-        mutation_taster = variant.get('Mutation_taster', None)
-        avsift = variant.get('SIFT', None)
-        
-        if 'Poly_phen_hdiv' in variant:
-            poly_phen = variant.get('Poly_phen_hdiv', None)
-        else:
-            poly_phen = variant.get('Poly_phen', None)
-        
-        # Annotations:
-        functional_annotation = variant.get('Functional_annotation', None)
-        if functional_annotation:
-            try:
-                functional_annotation = {gene_info.split(':')[0]:gene_info.split(':')[1] for gene_info in functional_annotation.split(',')}
-            except IndexError:
-                functional_annotation = None
+        if variant_id not in annotation_scores:
+            annotation_scores[variant_id] = get_annotation_score(variant, rank_model)
         
-        # Frequency in databases:
-        thousand_genomes_frequency = variant.get('1000G', None)
-        dbsnp_frequency = variant.get('Dbsnp129', None)
-        dbsnp_id = variant.get('Dbsnp_nonflagged', None)
-        hbvdb = variant.get('HBVDB', None)
-        
-        # Filter
-        
-        filt = variant.get('GT_call_filter', None)
-        
-        # Conservation scores:
-            # Base
-        gerp_base = variant.get('GERP', None)
-            # Region
-        mce64way = variant.get('Phast_cons_lements', None)
-        gerp_region = variant.get('GERP_elements', None)
-            
-            
-        phylop = variant.get('Phylo_p', None)
-        
-        segdup = variant.get('Genomic_super_dups', None)
-        
-        hgmd = variant.get('HGMD', None)
+        score = check_inheritance(variant_models, prefered_models, rank_model)
+        score += annotation_scores[variant_id]
+        variant['Individual_rank_score'] = score
         
+    return
+    
+def get_annotation_score(variant, rank_model = default_rank_model):
+    """Return the part of the score that only depends on the annotations of a variant."""
+    score = 0
+    
+    # Predictors
+    mutation_taster = variant.get('Mutation_taster', None)
+    avsift = variant.get('SIFT', None)
+    
+    if 'Poly_phen_hdiv' in variant:
+        poly_phen = variant.get('Poly_phen_hdiv', None)
+    else:
+        poly_phen = variant.get('Poly_phen', None)
+    
+    # Annotations:
+    functional_annotation = variant.get('Functional_annotation', None)
+    
+    # Filter
+    
+    filt = variant.get('GT_call_filter', None)
+    
+    # Conservation scores:
+        # Base
+    gerp_base = variant.get('GERP', None)
+        # Region
+    mce64way = variant.get('Phast_cons_lements', None)
+    gerp_region = variant.get('GERP_elements', None)
         
         
-        score += check_inheritance(variant_models, prefered_models)
-        score += check_predictions(mutation_taster, avsift, poly_phen)
-        score += check_functional_annotation(functional_annotation)
-        score += check_frequency_score(thousand_genomes_frequency, dbsnp_frequency, hbvdb, dbsnp_id)
-        score += check_filter(filt)
-        score += check_region_conservation(mce64way, gerp_region)
-        score += check_base_conservation(gerp_base)
-        score += check_phylop_score(phylop)
-        score += check_segmental_duplication(segdup)
-        score += check_hgmd(hgmd)
+    phylop = variant.get('Phylo_p', None)
+    
+    segdup = variant.get('Genomic_super_dups', None)
+    
+    hgmd = variant.get('HGMD', None)
+    
+    
+    
+    score += check_predictions(mutation_taster, avsift, poly_phen, rank_model)
+    score += get_functional_annotation_score(functional_annotation, rank_model)
+    score += get_frequency_score(variant, rank_model)
+    score += check_filter(filt, rank_model)
+    score += check_region_conservation(mce64way, gerp_region, rank_model)
+    score += check_base_conservation(gerp_base, rank_model)
+    score += check_phylop_score(phylop, rank_model)
+    score += check_segmental_duplication(segdup, rank_model)
+    score += check_hgmd(hgmd, rank_model)
+    return score
+    
+def get_frequency_score(variant, rank_model = default_rank_model):
+    """Return the frequency part of the annotation score of a variant."""
+    return check_frequency_score(variant.get('1000G', None), variant.get('Dbsnp129', None), 
+                                    variant.get('HBVDB', None), variant.get('Dbsnp_nonflagged', None), rank_model)
+
+def score_batch(variants, prefered_models = [], rank_model = default_rank_model, annotation_scores = None):
+    """Score all variants of a batch at once, gives the same scores as score_variant.
+    
+    The annotation scores that are missing in annotation_scores are computed with get_batch_annotation_scores
+    and added to annotation_scores. For small batches, or without numpy, get_annotation_score is used.
+    """
+    if  prefered_models == ['NA']:
+        prefered_models = []
+    
+    if annotation_scores is None:
+        annotation_scores = {}
+    
+    add_annotation_scores(variants, rank_model, annotation_scores)
+    
+    for variant_id in variants:
+        variant = variants[variant_id]
+        variant_models = get_genetic_models(variant.get('Inheritance_model', {}))
+        score = check_inheritance(variant_models, prefered_models, rank_model)
+        score += annotation_scores[variant_id]
         variant['Individual_rank_score'] = score
-        
+    
     return
+
+def add_annotation_scores(variants, rank_model = default_rank_model, annotation_scores = None):
+    """Add the annotation scores of the variants, {variant_id:variant_dict}, that are missing in annotation_scores.
+    
+    For small batches, or without numpy, get_annotation_score is used. Returns annotation_scores.
+    """
+    if annotation_scores is None:
+        annotation_scores = {}
+    missing_ids = [variant_id for variant_id in variants if variant_id not in annotation_scores]
+    if len(missing_ids) < NUMPY_BATCH_SIZE or not get_numpy():
+        for variant_id in missing_ids:
+            annotation_scores[variant_id] = get_annotation_score(variants[variant_id], rank_model)
+    else:
+        annotation_scores.update(zip(missing_ids, 
+                get_batch_annotation_scores([variants[variant_id] for variant_id in missing_ids], rank_model)))
+    return annotation_scores
+
+def get_numpy():
+    """Return the numpy module, it is imported the first time. Returns False if numpy is not installed."""
+    global numpy
+    if numpy is None:
+        try:
+            import numpy as numpy_module
+        except ImportError:
+            numpy_module = False
+        numpy = numpy_module
+    return numpy
+
+def get_batch_annotation_scores(batch, rank_model = default_rank_model):
+    """Return a list with the annotation scores for a list of variants, computed with numpy.
+    
+    The numerical columns are converted to numpy arrays once, with NaN for missing values, and the
+    score of each numerical check is computed for the whole batch.
+    A value of 'nan' is a number but compares as False, just as in the single variant checks.
+    """
+    get_numpy()
+    def get_floats(column):
+        """Return a float array with the values of a column."""
+        return numpy.array([get_number(variant.get(column, None)) for variant in batch], dtype=float)
+    
+    def get_scores(values):
+        """Return an int array from a list with scores."""
+        return numpy.array(values, dtype=int)
+    
+    # Predictors
+    avsift = get_floats('SIFT')
+    mutation_taster = get_floats('Mutation_taster')
+    poly_phen = numpy.array([get_number(variant.get('Poly_phen_hdiv', None)) if 'Poly_phen_hdiv' in variant 
+                                else get_number(variant.get('Poly_phen', None)) for variant in batch], dtype=float)
     
-def check_inheritance(variant_models, prefered_models):
+    score = numpy.where(avsift <= rank_model.sift[0], rank_model.sift[1], 0)
+    score += numpy.where(mutation_taster >= rank_model.mutation_taster[0], rank_model.mutation_taster[1], 0)
+    score += numpy.where(poly_phen >= rank_model.poly_phen[0], rank_model.poly_phen[1], 0)
+    
+    # Frequency in databases:
+    freq_scores = []
+    for column in ['1000G', 'Dbsnp129', 'HBVDB']:
+        numbers = [get_number(variant.get(column, None)) for variant in batch]
+        missing = numpy.array([number is None for number in numbers])
+        frequency = numpy.array(numbers, dtype=float)
+        freq_scores.append(numpy.select([missing] + [frequency <= cutoff for cutoff, freq_score in rank_model.frequency_cutoffs],
+                            [rank_model.missing_frequency_score] + [freq_score for cutoff, freq_score in rank_model.frequency_cutoffs], 
+                            rank_model.common_score))
+    common = (freq_scores[0] < 0) | (freq_scores[1] < 0) | (freq_scores[2] < 0)
+    novel = get_scores([variant.get('Dbsnp_nonflagged', None) == '-' for variant in batch]) * rank_model.novel_score
+    score += numpy.where(common, rank_model.common_score, sum(freq_scores) // 2 + novel)
+    
+    # Conservation scores:
+    gerp_base = get_floats('GERP')
+    score += numpy.select([gerp_base >= cutoff for cutoff, gerp_score in rank_model.gerp_cutoffs], 
+                            [gerp_score for cutoff, gerp_score in rank_model.gerp_cutoffs], 0)
+    phylop = get_floats('Phylo_p')
+    score += numpy.select([phylop >= cutoff for cutoff, phylop_score in rank_model.phylop_cutoffs], 
+                            [phylop_score for cutoff, phylop_score in rank_model.phylop_cutoffs], 0)
+    
+    # The checks on strings are done one variant at the time:
+    score += get_scores([get_functional_annotation_score(variant.get('Functional_annotation', None), rank_model) 
+                            for variant in batch])
+    score += get_scores([check_filter(variant.get('GT_call_filter', None), rank_model) for variant in batch])
+    score += get_scores([check_region_conservation(variant.get('Phast_cons_lements', None), 
+                            variant.get('GERP_elements', None), rank_model) for variant in batch])
+    score += get_scores([check_segmental_duplication(variant.get('Genomic_super_dups', None), rank_model) 
+                            for variant in batch])
+    score += get_scores([check_hgmd(variant.get('HGMD', None), rank_model) for variant in batch])
+    
+    return score.tolist()
+
+def get_number(value):
+    """Return the value as a float, or None if it is not a number. Works like is_number followed by float."""
+    if type(value) in (int, float, str):
+        try:
+            return float(value)
+        except ValueError:
+            pass
+    return None
+
+def get_functional_annotation(variant):
+    """Return the functional annotation of a variant as a dictionary on the form {<gene>:<consequence>}."""
+    functional_annotation = parse_functional_annotation(variant.get('Functional_annotation', None))
+    if functional_annotation is not None:
+        functional_annotation = dict(functional_annotation)
+    return functional_annotation
+
+@lru_cache(maxsize=ANNOTATION_CACHE_SIZE)
+def parse_functional_annotation(functional_annotation):
+    """Parse a functional annotation string like 'gene_1:consequence,gene_2:consequence'.
+    
+    Returns a tuple with (<gene>, <consequence>) pairs or None if the annotation is missing or malformed.
+    The result is cached, use parse_functional_annotation.cache_info() to get the hit rate."""
+    if functional_annotation:
+        try:
+            return tuple({gene_info.split(':')[0]:gene_info.split(':')[1] 
+                            for gene_info in functional_annotation.split(',')}.items())
+        except IndexError:
+            pass
+    return None
+
+@lru_cache(maxsize=ANNOTATION_CACHE_SIZE)
+def get_functional_annotation_score(functional_annotation, rank_model = default_rank_model):
+    """Return the score of the most severe consequence in a functional annotation string.
+    
+    The result is cached, use get_functional_annotation_score.cache_info() to get the hit rate."""
+    return check_functional_annotation(parse_functional_annotation(functional_annotation), rank_model)
+
+def annotation_cache_info():
+    """Return the hits and misses of the functional annotation caches in this process."""
+    cache_info = {}
+    for name, cached_function in [('parse', parse_functional_annotation), ('score', get_functional_annotation_score)]:
+        info = cached_function.cache_info()
+        cache_info[name] = {'hits':info.hits, 'misses':info.misses, 'size':info.currsize}
+    return cache_info
+
+def check_inheritance(variant_models, prefered_models, rank_model = default_rank_model):
     """Check if the models of inheritance are followed for the variant."""
-    model_score = 0
     #If any of the prefered models are followed:
     for model_followed in variant_models:
         if model_followed in prefered_models:
-            model_score = 3
+            return rank_model.prefered_model_score
     #Else if any model is followed
-    if model_score != 3:
-        if len(variant_models) > 0:
-            model_score = 1
-        else:
-            model_score = -12
-    return model_score
-    
-def check_predictions(mutation_taster = None, avsift = None, poly_phen = None):
+    if len(variant_models) > 0:
+        return rank_model.followed_model_score
+    return rank_model.no_model_score
+    
+def check_predictions(mutation_taster = None, avsift = None, poly_phen = None, rank_model = default_rank_model):
     """Score the variant based on the scores from prediction databases."""
     prediction_score = 0
     if is_number.is_number(avsift):
-        if float(avsift) <= 0.05:
-            prediction_score += 1
+        if float(avsift) <= rank_model.sift[0]:
+            prediction_score += rank_model.sift[1]
     if is_number.is_number(mutation_taster):
-        if float(mutation_taster) >= 0.05:
-            prediction_score += 1
+        if float(mutation_taster) >= rank_model.mutation_taster[0]:
+            prediction_score += rank_model.mutation_taster[1]
     if is_number.is_number(poly_phen):
-        if float(poly_phen) >= 0.85:
-            prediction_score += 1
+        if float(poly_phen) >= rank_model.poly_phen[0]:
+            prediction_score += rank_model.poly_phen[1]
     return prediction_score
     
-def check_functional_annotation(functional_annotation = None):
+def check_functional_annotation(functional_annotation = None, rank_model = default_rank_model):
     """Score the variant based on its functional annotation"""
     functional_annotation_score = 0
     if functional_annotation:
-        for gene in functional_annotation:
-            score = consequence_severity.get(functional_annotation[gene],0)
+        # The annotation is either a dictionary or the pairs from parse_functional_annotation
+        if isinstance(functional_annotation, dict):
+            functional_annotation = functional_annotation.items()
+        for gene, consequence in functional_annotation:
+            score = rank_model.consequence_severity.get(consequence,0)
             if score > functional_annotation_score:
                 functional_annotation_score = score
     return functional_annotation_score
     
-def check_frequency_score(thousand_genomes_frequency = None, dbsnp_frequency = None, hbvdb_frequency = None, dbsnp_id = None):
+def check_frequency_score(thousand_genomes_frequency = None, dbsnp_frequency = None, hbvdb_frequency = None, 
+                            dbsnp_id = None, rank_model = default_rank_model):
     """Score the variant based on the frequency in population."""
 
     frequency_score = 0
@@ -185,15 +335,14 @@ def check_frequency_score(thousand_genomes_frequency = None, dbsnp_frequency = N
     def get_freq_score(frequency):
         """Returns a score depending on the frequency"""
         if is_number.is_number(frequency):
-            if float(frequency) <= 0.005:
-                return 2
-            elif float(frequency) <= 0.02:
-                return 1
+            frequency = float(frequency)
+            for cutoff, score in rank_model.frequency_cutoffs:
+                if frequency <= cutoff:
+                    return score
             #If common variant:
-            else:
-                    return -12
+            return rank_model.common_score
         else:# If not existing in database
-            return 3
+            return rank_model.missing_frequency_score
     
     freq_scores.append(get_freq_score(thousand_genomes_frequency))
     freq_scores.append(get_freq_score(dbsnp_frequency))
@@ -204,64 +353,58 @@ def check_frequency_score(thousand_genomes_frequency = None, dbsnp_frequency = N
         if freq_score < 0:
             common = True
     if common:
-        frequency_score = -12
+        frequency_score = rank_model.common_score
     else:
-        frequency_score += sum(freq_scores) / 2
+        # Integer division, the rank scores are parsed with int when the compound scores are printed
+        frequency_score += sum(freq_scores) // 2
     # If variant has no ID in dbSNP it get an extra score
         if dbsnp_id == '-':
-            frequency_score += 1
+            frequency_score += rank_model.novel_score
     return frequency_score
     
-def check_filter(filt):
+def check_filter(filt, rank_model = default_rank_model):
     """Check if variant has passed the filter process."""
-    filter_score = 0
-    if filt == 'PASS':
-        filter_score = 3
-    elif filt == 'PRES':
-        filter_score = 1
-    return filter_score
-    
-def check_region_conservation(mce64way = None, gerp_region = None):
+    return rank_model.filter_scores.get(filt, 0)
+    
+def check_region_conservation(mce64way = None, gerp_region = None, rank_model = default_rank_model):
     """Score the variant based on what annotations it has for the region conservations"""
     region_conservation_score = 0
     if mce64way != '-' and gerp_region != '-':
-        region_conservation_score += 2
+        region_conservation_score += rank_model.region_conservation_scores[0]
     elif mce64way != '-' or gerp_region != '-':
-        region_conservation_score += 1
+        region_conservation_score += rank_model.region_conservation_scores[1]
     return region_conservation_score
     
-def check_base_conservation(gerp_base_score = None):
+def check_base_conservation(gerp_base_score = None, rank_model = default_rank_model):
     """Score the variant based on the base level conservation."""
-    base_conservation_score = 0
     if is_number.is_number(gerp_base_score):
-        if float(gerp_base_score) >= 4:
-            base_conservation_score += 2
-        elif float(gerp_base_score) >= 2:
-            base_conservation_score += 1
-    return base_conservation_score
+        gerp_base_score = float(gerp_base_score)
+        for cutoff, score in rank_model.gerp_cutoffs:
+            if gerp_base_score >= cutoff:
+                return score
+    return 0
     
-def check_phylop_score(phylop = None):
+def check_phylop_score(phylop = None, rank_model = default_rank_model):
     """Score the variant based on the Phylop score."""
-    phylop_score = 0
     if is_number.is_number(phylop):
-        if float(phylop) >= 0.9984188612:
-            phylop_score += 2
-        elif float(phylop) >= 0.95:
-            phylop_score += 1
-    return phylop_score
+        phylop = float(phylop)
+        for cutoff, score in rank_model.phylop_cutoffs:
+            if phylop >= cutoff:
+                return score
+    return 0
     
-def check_segmental_duplication(segdup):
+def check_segmental_duplication(segdup, rank_model = default_rank_model):
     """Check if there are any annotations for segmental duplication"""
     segdup_score = 0
     if segdup != '-':
-        segdup_score -= 2
+        segdup_score += rank_model.segmental_duplication_score
     return segdup_score
     
-def check_hgmd(hgmd):
+def check_hgmd(hgmd, rank_model = default_rank_model):
     """Check if the variant have any annotation from hgmd"""
     hgmd_score = 0
     if hgmd != '-':
-        hgmd_score += 1
+        hgmd_score += rank_model.hgmd_score
     return hgmd_score
     
     
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+analysis.py
+
+Functions that sets up an analysis: the families, the header of the variant file and the results files.
+
+They are used by the scripts and by the batch runner so that all analyses are set up in the same way.
+
+analyze runs the whole analysis for one family on the lines of a variant file and yields the variants
+as they are checked, without temporary files:
+
+    for variant in analyze(family, open('variants.vcf'), workers = 0):
+        print(variant['Inheritance_model'], variant['Rank_score'])
+"""
+
+import sys
+import os
+import copy
+import queue
+import itertools
+import threading
+import multiprocessing
+from codecs import open
+
+from Mip_Family_Analysis.Models import rank_model
+from Mip_Family_Analysis.Variants import variant_parser
+from Mip_Family_Analysis.Utils import header_parser, variant_consumer
+
+def get_families(family_file, family_type = 'mip'):
+    """Return a list with all families of the pedigree file, sorted on family id."""
+    # ped_parser is only needed when a pedigree file is read
+    from ped_parser import parser
+    my_family_parser = parser.FamilyParser(family_file, family_type)
+    return [my_family_parser.families[family_id] for family_id in sorted(my_family_parser.families)]
+
+def check_individuals(families, head, verbose = False):
+    """Check if the individuals from pedfile is present in varfile"""
+    for family in families:
+        for individual in list(family.individuals.keys()):
+            if individual not in head.individuals:
+                family.individuals.pop(individual, 0)
+                if verbose:
+                    print(('Warning! Individual %s is in .ped file but not in variant file! Removing individual from analysis.'
+                            % individual))
+    return
+
+def add_cmms_metadata(header_object):
+    """Add the necessary metadata and header columns that this software operates on."""
+
+    header_object.add_metadata('Inheritance_model', data_type='String',
+        description='Variant inheritance pattern.',
+        dbname='Inheritance Model', delimiter='\t'
+    )
+    header_object.add_metadata('Individual_rank_score', data_type='Integer',
+        description='Rank score of disease casuing potential. Higher the more likely disease casuing.',
+        dbname='Individual Rank Score', delimiter='\t'
+    )
+    header_object.add_metadata('Compounds', data_type='String',
+        description='List of the compound pairs(if any).',
+        dbname='Compounds', delimiter='\t'
+    )
+    header_object.add_metadata('Rank_score', data_type='Integer',
+        description='This is the correct rank score if the variant only follows the AR_comp model.',
+        dbname='Rank Score', delimiter='\t'
+    )
+
+    header_object.add_header('Inheritance_model')
+    header_object.add_header('Individual_rank_score')
+    header_object.add_header('Compounds')
+    header_object.add_header('Rank_score')
+    return
+
+def get_outfile(outfile, family_id, nr_of_families):
+    """Return the name of the results file of a family, with several families the family id is added."""
+    if not outfile or nr_of_families == 1:
+        return outfile
+    file_name, file_extension = os.path.splitext(outfile)
+    return '%s_%s%s' % (file_name, family_id, file_extension)
+
+def print_headers(header_object, outfile = None, silent = False):
+    """Print the headers to a results file, or to screen if there is no results file."""
+    lines_to_print = header_object.get_headers_for_print()
+    if outfile:
+        with open(outfile, 'w', encoding='utf-8') as f:
+            for line in lines_to_print:
+                f.write(line + '\n')
+    elif not silent:
+        for line in lines_to_print:
+            print(line)
+    return
+
+def analyze(family, records, models = None, workers = 0, rank_model = rank_model.default_rank_model,
+                compounds = True, treshold = None, prefilter = False, phased = False, annotations = None,
+                score_cache_file = None, max_batch_size = None, envelope_size = 100, verbosity = False):
+    """Check and score the variants of a family. Yields the variants as dictionaries ready for printing.
+
+    records is an iterable with the lines of a variant file, header lines included. If models is given it
+    replaces the models of inheritance of the family when the variants are scored. The family is not changed.
+
+    With workers = 0 everything is done in the calling process and the variants are yielded in the order of
+    the file. With more workers the envelopes are checked by that many processes and the variants are
+    yielded in the order the envelopes are finished.
+    """
+    records = iter(records)
+    header_lines = []
+    for line in records:
+        if not line.startswith('#'):
+            records = itertools.chain([line], records)
+            break
+        header_lines.append(line)
+    head = header_parser.HeaderParser(lines = header_lines)
+    # The individuals that are not in the variant file are removed from a copy of the family:
+    family = copy.copy(family)
+    family.individuals = dict(family.individuals)
+    if models is not None:
+        family.models_of_inheritance = models
+    check_individuals([family], head, verbosity)
+    add_cmms_metadata(head)
+    var_parser = variant_parser.VariantFileParser(records, None, head, verbosity, max_batch_size = max_batch_size,
+                        split_genes = not compounds, envelope_size = envelope_size, reader = 'lines',
+                        annotations = annotations, phased = phased)
+    consumer_options = {'compounds':compounds, 'rank_model':rank_model, 'score_cache_file':score_cache_file,
+                            'treshold':treshold, 'prefilter':prefilter, 'phased':phased}
+    if workers:
+        checked_envelopes = check_with_workers(var_parser, family, workers, verbosity, consumer_options)
+    else:
+        checked_envelopes = check_inline(var_parser, family, verbosity, consumer_options)
+    for envelope_variants in checked_envelopes:
+        family_variants = envelope_variants[family.family_id]
+        for variant_id in sorted(family_variants):
+            yield family_variants[variant_id]
+
+def check_inline(var_parser, family, verbosity, consumer_options):
+    """Check the envelopes in this process as they are parsed."""
+    consumer = variant_consumer.VariantConsumer(None, None, family, verbosity, **consumer_options)
+    try:
+        for envelope in var_parser.get_envelopes():
+            yield consumer.process_envelope(envelope)
+    finally:
+        if consumer.score_cache:
+            consumer.score_cache.close()
+
+def check_with_workers(var_parser, family, workers, verbosity, consumer_options):
+    """Check the envelopes with a pool of consumers, the parsing is done by a thread in this process."""
+    task_queue = multiprocessing.JoinableQueue(maxsize = 2 * workers)
+    results = multiprocessing.Queue()
+    tile_queue = multiprocessing.Queue()
+    consumers = [variant_consumer.VariantConsumer(task_queue, results, family, verbosity, tile_queue = tile_queue,
+                    **consumer_options) for i in range(workers)]
+    for consumer in consumers:
+        consumer.start()
+    stop = threading.Event()
+    parsing = {'sent':0, 'done':False, 'error':None}
+
+    def feed():
+        try:
+            for envelope in var_parser.get_envelopes():
+                while not stop.is_set():
+                    try:
+                        task_queue.put(envelope, timeout = 0.1)
+                        break
+                    except queue.Full:
+                        pass
+                if stop.is_set():
+                    return
+                parsing['sent'] += 1
+        except Exception as e:
+            parsing['error'] = e
+        finally:
+            parsing['done'] = True
+
+    feeder = threading.Thread(target=feed)
+    feeder.daemon = True
+    feeder.start()
+    received = 0
+    finished = False
+    try:
+        while not (parsing['done'] and received == parsing['sent']):
+            if parsing['error']:
+                raise parsing['error']
+            try:
+                envelope_variants = results.get(timeout = 0.1)
+            except queue.Empty:
+                if not all(consumer.is_alive() for consumer in consumers):
+                    raise RuntimeError('A worker stopped before all variants were checked')
+                continue
+            received += 1
+            yield envelope_variants
+        if parsing['error']:
+            raise parsing['error']
+        finished = True
+    finally:
+        stop.set()
+        feeder.join()
+        if finished:
+            for consumer in consumers:
+                task_queue.put(None)
+        for consumer in consumers:
+            if not finished:
+                consumer.terminate()
+            consumer.join()
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+analysis_server.py
+
+A server that keeps a batch runner with warm workers and takes jobs over a unix domain socket.
+
+The annotations are loaded and the workers are started once, the headers of the variant files are kept by
+the parsers between the jobs. This makes it fast to analyse a variant file again, for example when the
+affected status in the pedigree has been changed.
+
+Each request is one line of json. The server answers with one or more lines of json:
+
+    {"command": "submit", "family_file": ..., "variant_file": ..., "outfile": ..., "stream": false}
+        {"job_id": 0, "status": "queued"}
+        {"family_id": "1", "line": ...}     If stream is true, one message for each line of the results
+        {"job_id": 0, "status": "done", "error": null, "seconds": 1.2, "outfiles": {"1": ...}}
+
+    {"command": "stats"}
+    {"command": "shutdown"}
+
+If a job has no outfile the results are written to temporary files that are removed when they have been
+streamed to the client.
+"""
+
+import sys
+import os
+import json
+import time
+import queue
+import socket
+import threading
+import socketserver
+from collections import deque
+from tempfile import NamedTemporaryFile
+
+# The number of finished jobs that are used for the latency statistics
+LATENCY_WINDOW = 1000
+
+class AnalysisRequestHandler(socketserver.StreamRequestHandler):
+    """Handle the requests from one connection."""
+
+    def send(self, message):
+        """Send one message to the client"""
+        self.wfile.write((json.dumps(message) + '\n').encode('utf-8'))
+        self.wfile.flush()
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        try:
+            request = json.loads(line.decode('utf-8'))
+            command = request['command']
+        except (ValueError, KeyError) as e:
+            self.send({'error':'Malformed request: %s' % e})
+            return
+        if command == 'submit':
+            self.submit(request)
+        elif command == 'stats':
+            self.send(self.server.get_stats())
+        elif command == 'shutdown':
+            self.send({'status':'shutting down'})
+            # shutdown waits for serve_forever so it can not be called from the thread of the request
+            threading.Thread(target=self.server.shutdown).start()
+        else:
+            self.send({'error':'Unknown command: %s' % command})
+
+    def submit(self, request):
+        """Run a job and send the results back when it is finished."""
+        outfile = request.get('outfile')
+        temporary = not outfile
+        if temporary:
+            with NamedTemporaryFile(suffix='.txt', delete=False) as f:
+                outfile = f.name
+        job = None
+        try:
+            try:
+                job_id = self.server.submit(request['family_file'], request['variant_file'], outfile)
+            except RuntimeError as e:
+                self.send({'error':str(e)})
+                return
+            self.send({'job_id':job_id, 'status':'queued'})
+            job = self.server.wait(job_id)
+            if request.get('stream') and not job['error']:
+                for family_id in sorted(job['outfiles']):
+                    with open(job['outfiles'][family_id], 'r') as f:
+                        for line in f:
+                            self.send({'family_id':family_id, 'line':line.rstrip('\n')})
+            self.send({'job_id':job_id, 'status':job['error'] and 'failed' or 'done', 'error':job['error'],
+                        'seconds':job['seconds'], 'outfiles':not temporary and job['outfiles'] or {}})
+        finally:
+            if temporary:
+                outfiles = [outfile]
+                if job:
+                    outfiles += list(job['outfiles'].values())
+                for path in set(outfiles):
+                    if os.path.exists(path):
+                        os.remove(path)
+
+class AnalysisServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Take jobs over a unix domain socket and run them with a batch runner.
+
+    The runner should not be started, it is started and shut down by serve.
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path, runner, verbosity = False):
+        if os.path.exists(socket_path):
+            if is_listening(socket_path):
+                raise IOError('A server is already listening on %s' % socket_path)
+            # A socket that is left from a server that did not shut down
+            os.remove(socket_path)
+        socketserver.UnixStreamServer.__init__(self, socket_path, AnalysisRequestHandler)
+        self.socket_path = socket_path
+        self.runner = runner
+        self.verbosity = verbosity
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.started = time.time()
+        self.submitted = 0
+        self.finished = 0
+        self.failed = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.collecting = False
+        # The error if a worker of the runner has stopped, then no more jobs can be run
+        self.runner_error = None
+
+    def submit(self, family_file, variant_file, outfile):
+        """Submit a job to the runner and return its id."""
+        with self.lock:
+            if self.runner_error:
+                raise RuntimeError(self.runner_error)
+            job_id = self.runner.submit(family_file, variant_file, outfile)
+            self.jobs[job_id] = {'submitted':time.time(), 'event':threading.Event(), 'error':None,
+                                    'outfiles':{}, 'seconds':None}
+            self.submitted += 1
+        if self.verbosity:
+            print(('Job %s submitted: %s' % (job_id, variant_file)))
+        return job_id
+
+    def wait(self, job_id):
+        """Wait for a job to finish, returns the information about the job."""
+        job = self.jobs[job_id]
+        job['event'].wait()
+        with self.lock:
+            self.jobs.pop(job_id, None)
+        return job
+
+    def collect(self):
+        """Take the finished jobs from the runner and wake up the requests that are waiting for them."""
+        while self.collecting:
+            try:
+                job_id, error, outfiles = self.runner.get_finished(timeout = 0.5)
+            except queue.Empty:
+                continue
+            except RuntimeError as e:
+                self.fail_jobs(str(e))
+                threading.Thread(target=self.shutdown).start()
+                break
+            with self.lock:
+                job = self.jobs[job_id]
+                job['seconds'] = time.time() - job['submitted']
+                job['error'] = error
+                job['outfiles'] = outfiles
+                self.finished += 1
+                if error:
+                    self.failed += 1
+                self.latencies.append(job['seconds'])
+            if self.verbosity:
+                print(('Job %s finished in %.2f seconds' % (job_id, job['seconds'])))
+            job['event'].set()
+
+    def fail_jobs(self, error):
+        """Fail all jobs that are running and refuse new jobs, used when the runner can not finish them."""
+        with self.lock:
+            self.runner_error = error
+            for job in self.jobs.values():
+                if not job['event'].is_set():
+                    job['seconds'] = time.time() - job['submitted']
+                    job['error'] = error
+                    self.finished += 1
+                    self.failed += 1
+                    job['event'].set()
+        if self.verbosity:
+            print(('The server stops: %s' % error))
+
+    def get_stats(self):
+        """Return the statistics of the server."""
+        with self.lock:
+            latencies = sorted(self.latencies)
+            stats = {'uptime':time.time() - self.started, 'submitted':self.submitted,
+                        'running':self.submitted - self.finished, 'finished':self.finished, 'failed':self.failed}
+        stats['queues'] = self.runner.get_queue_sizes()
+        stats['latency'] = {'count':len(latencies)}
+        if latencies:
+            stats['latency'].update({'mean':sum(latencies) / len(latencies),
+                                        'median':latencies[len(latencies) // 2], 'max':latencies[-1]})
+        return stats
+
+    def serve(self):
+        """Start the runner and serve until a shutdown request."""
+        self.runner.start()
+        self.collecting = True
+        collector = threading.Thread(target=self.collect)
+        collector.daemon = True
+        collector.start()
+        if self.verbosity:
+            print(('Listening on %s' % self.socket_path))
+        try:
+            self.serve_forever()
+        finally:
+            self.server_close()
+            os.remove(self.socket_path)
+            # The jobs that are submitted are finished before the workers stop, unless a worker has stopped:
+            if not self.runner_error:
+                self.runner.shutdown()
+            while self.jobs and any(not job['event'].is_set() for job in list(self.jobs.values())):
+                time.sleep(0.1)
+            self.collecting = False
+            collector.join()
+            if self.runner_error:
+                self.runner.terminate()
+
+def is_listening(socket_path):
+    """Return True if a server is accepting connections on the socket."""
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+    except socket.error:
+        return False
+    finally:
+        client.close()
+    return True
+
+def send_request(socket_path, request):
+    """Send a request to the server and yield the messages of the answer."""
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(socket_path)
+    try:
+        client.sendall((json.dumps(request) + '\n').encode('utf-8'))
+        with client.makefile('rb') as answer:
+            for line in answer:
+                yield json.loads(line.decode('utf-8'))
+    finally:
+        client.close()
+
+def submit_job(socket_path, family_file, variant_file, outfile = None, stream = False):
+    """Submit a job and yield the messages from the server until the job is finished."""
+    request = {'command':'submit', 'family_file':os.path.abspath(family_file),
+                'variant_file':os.path.abspath(variant_file), 'stream':stream,
+                'outfile':outfile and os.path.abspath(outfile)}
+    return send_request(socket_path, request)
+
+def get_stats(socket_path):
+    """Return the statistics of the server."""
+    return next(send_request(socket_path, {'command':'stats'}))
+
+def stop_server(socket_path):
+    """Ask the server to shut down"""
+    return next(send_request(socket_path, {'command':'shutdown'}))
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
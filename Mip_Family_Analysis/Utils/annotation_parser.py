@@ -4,10 +4,22 @@
 annotation_parser.py
 
 This script will parse a file with intervals in .ccds or .bed format and build one interval tree for each chromosome.
-So self.chromosomes will look like:
+So self.interval_trees will look like:
 
 {'1':intervalTree, '2':intervalTree, ..., 'X':intervalTree}
 
+If numpy is installed the trees are array backed interval indexes, see interval_index.py. They give the same
+features and can look up all positions of a batch in one call with get_features.
+
+The file is read in blocks that can be parsed by a pool of processes, gzipped files are decompressed
+by the main process while the blocks are parsed. Each format has a function that only picks the
+chromosome, start, stop and id of a feature from a line.
+
+The parsed features can be stored in an index file(.npz) so the annotation file only has to be parsed once.
+The index holds, for each chromosome, the starts, stops and ids of the features sorted on start position.
+It is only used if the size, modification time and hash of the annotation file are the same as when it was built.
+If only the modification time has changed the hash of the file is checked.
+
 Create a family object and its family members from different types of input file
 Created by Måns Magnusson on 2013-01-17.
 Copyright (c) 2013 __MyCompanyName__. All rights reserved.
@@ -17,127 +29,268 @@ import sys
 import os
 import argparse
 import gzip
+import hashlib
+import collections
+import multiprocessing
 
+from datetime import datetime
 from pprint import pprint as pp
 
-from Mip_Family_Analysis.Utils import interval_tree, is_number
+try:
+    import numpy
+    from Mip_Family_Analysis.Utils import interval_index
+except ImportError:
+    numpy = None
+
+import interval_tree
+
+from Mip_Family_Analysis.Utils import is_number
+
+# Change this when the layout of the index files changes:
+INDEX_VERSION = '1'
+# The annotation file is read and parsed in blocks of this size:
+BLOCK_SIZE = 4 * 1024 * 1024
 
 class AnnotationParser(object):
     """Parses a file with family info and creates a family object with individuals."""
-    def __init__(self, infile, annotation_type, zipped = False):
+    def __init__(self, infile, annotation_type, zipped = False, index_file = None, processes = 1):
         super(AnnotationParser, self).__init__()
+        self.infile = infile
         self.annotation_type = annotation_type
+        self.processes = processes
                 
         self.interval_trees = {}# A dictionary with {<chr>:<intervalTree>}
         
-        chromosomes = {} # A dictionary with {<chr>: [feature_1, feature_2, ...]} 
-        chromosome_stops = {}# A dictionary with information about the last positions on each chromosome:
+        # A dictionary with {<chr>: (starts, stops, feature_ids)} where the features are sorted on start
+        self.features = None
         
-        if zipped:
-            f = gzip.open(infile, 'r')
-        else: 
-            f = open(infile, 'r')
-        line_count = 0
-        for line in f:
-            if line[0] != '#' and len(line) > 1:
-                line = line.rstrip()
-                info = {'chrom':'Na', 'start':0, 'stop':0, 'transcript_id':'0', 'gene_id':'0', 'feature_id':str(line_count)}
-                
-                if self.annotation_type == 'ccds':
-                    info = self.ccds_parser(line, info, line_count)
-                elif self.annotation_type == 'bed':
-                    info = self.bed_parser(line, info, line_count)
-                elif self.annotation_type == 'gtf':
-                    info = self.gtf_parser(line, info, line_count)
-                elif self.annotation_type == 'ref_gene':
-                    info = self.ref_gene_parser(line, info, line_count)
-                #Feature is a list with [start, stop, id]
-                feature = [info['start'], info['stop'], info['feature_id']]
-                
-                if info['chrom'] in chromosomes:
-                    chromosomes[info['chrom']].append(feature)
-                else:
-                    chromosomes[info['chrom']] = [feature]
-                # Update the last end position, is it is bigger than before:
-                if info['stop'] > chromosome_stops.get(info['chrom'], 0):
-                    chromosome_stops[info['chrom']] = info['stop'] + 1
-            line_count += 1
+        if index_file and numpy is not None and os.path.exists(index_file):
+            self.features = self.load_index(index_file)
         
-        number_of_intervals = 0
-        # for chrom, stop in self.chromosome_stops.items():
-        #     print chrom, stop, len(self.chromosomes[chrom])
-        #     number_of_intervals += len(self.chromosomes[chrom])
+        if self.features is None:
+            self.features = self.parse_annotations(infile, zipped)
+            if index_file and numpy is not None:
+                self.save_index(index_file)
         
-        #Build one interval tree for each chromosome:
-        for chrom in chromosomes:
-            self.interval_trees[chrom] = interval_tree.intervalTree(chromosomes[chrom], 
-                                        0, 1, 1, chromosome_stops[chrom])
-                    
-    def bed_parser(self, line, info, line_count):
-        """Parse a .bed."""
-        line = line.split()
-        if 'hr' in line[0]:
-            info['chrom'] = line[0][3:]
-        else:
-            info['chrom'] = line[0]
-        info['start'] = int(line[1])
-        info['stop'] = int(line[2])
-        if len(line) > 3:
-            info['gene_id'] = line [3]
-            info['feature_id'] = line [3]
-        return info
-    
-    def ccds_parser(self, line, info, line_count):
-        """Parse a ccds line"""
-        line = line.split('\t')
-        if 'hr' in line[0]:
-            info['chrom'] = line[0][3:]
-        else:
-            info['chrom'] = line[0]
-        info['transcript_id'] = line[1]
-        info['gene_id'] = line[2]
-        info['feature_id'] = info['gene_id']
-        if is_number.is_number(line[7]) and is_number.is_number(line[8]):
-            info['start'] = int(line[7])
-            info['stop'] = int(line[8])
-        return info
-    
-    def gtf_parser(self, line, info, line_count):
-        """Parse a gtf line"""
-        line = line.split('\t')
-        if 'hr' in line[0]:
-            info['chrom'] = line[0][3:]
-        else:
-            info['chrom'] = line[0]
-        if is_number.is_number(line[3]) and is_number.is_number(line[4]):
-            info['start'] = int(line[3])
-            info['stop'] = int(line[4])
-        info_field = line[8].split(';')[:-1]
-        for information in info_field:
-            entry = information.split()
-            if entry[0] == 'transcript_id':
-                info['transcript_id'] = entry[1][1:-1]
-            if entry[0] == 'gene_id':
-                info['gene_id'] = entry[1][1:-1]
-        info['feature_id'] = info['gene_id']
-        return info
+        #Build one interval tree for each chromosome, with numpy the trees are array backed:
+        for chrom in self.features:
+            starts, stops, feature_ids = self.features[chrom]
+            if numpy is not None:
+                self.interval_trees[chrom] = interval_index.IntervalIndex(starts, stops, feature_ids)
+                continue
+            features = [[int(start), int(stop), str(feature_id)] for start, stop, feature_id in 
+                            zip(starts, stops, feature_ids)]
+            # The last position on the chromosome:
+            chromosome_stop = max(stops) + 1
+            self.interval_trees[chrom] = interval_tree.IntervalTree(features, 1, chromosome_stop)
     
-    def ref_gene_parser(self, line, info, line_count):
-        """Parse a file in the refGene format"""
-        line = line.split('\t')
-        if 'hr' in line[2]:
-            info['chrom'] = line[2][3:]
+    def parse_annotations(self, infile, zipped = False):
+        """Parse the annotation file and return the features of each chromosome, sorted on start.
+        
+        The file is read in blocks of lines that are parsed by a pool of processes if processes > 1.
+        The blocks are parsed in order so features with the same start and stop keep the order of the file.
+        """
+        chromosomes = {} # A dictionary with {<chr>: [(starts, stops, feature_ids), ...]} with one entry per block
+        
+        tasks = ((self.annotation_type, first_line, block) for first_line, block in read_blocks(infile, zipped))
+        if self.processes > 1:
+            pool = multiprocessing.Pool(self.processes)
+            try:
+                block_features = list(imap_bounded(pool, parse_block, tasks, 2 * self.processes))
+            finally:
+                pool.close()
+                pool.join()
         else:
-            info['chrom'] = line[2]
-        if is_number.is_number(line[4]) and is_number.is_number(line[5]):
-            info['start'] = int(line[4])
-            info['stop'] = int(line[5])
-        info['transcript_id'] = line[1] #???
-        info['gene_id'] = line[12]
-        info['feature_id'] = info['gene_id']
-        return info
+            block_features = map(parse_block, tasks)
         
+        for block in block_features:
+            for chrom in block:
+                chromosomes.setdefault(chrom, []).append(block[chrom])
         
+        features = {}
+        for chrom in chromosomes:
+            if numpy is not None:
+                starts = numpy.concatenate([block[0] for block in chromosomes[chrom]])
+                stops = numpy.concatenate([block[1] for block in chromosomes[chrom]])
+                feature_ids = numpy.concatenate([block[2] for block in chromosomes[chrom]])
+                # lexsort is stable, just like sorting the list of features
+                order = numpy.lexsort((stops, starts))
+                features[chrom] = (starts[order], stops[order], feature_ids[order])
+            else:
+                chromosome_features = []
+                for starts, stops, feature_ids in chromosomes[chrom]:
+                    chromosome_features.extend(zip(starts, stops, feature_ids))
+                chromosome_features.sort(key=lambda feature: (feature[0], feature[1]))
+                features[chrom] = ([feature[0] for feature in chromosome_features], 
+                                    [feature[1] for feature in chromosome_features],
+                                    [feature[2] for feature in chromosome_features])
+        return features
+    
+    def get_features(self, chrom, positions, stops = None):
+        """Return a list with a set of feature ids for each position on a chromosome, or interval if stops are given."""
+        if chrom not in self.interval_trees:
+            return [set() for position in positions]
+        if numpy is not None:
+            return self.interval_trees[chrom].query(positions, stops)
+        if stops is None:
+            stops = positions
+        return [set(self.interval_trees[chrom].find_range([position, stop])) for position, stop in zip(positions, stops)]
+    
+    def get_source_info(self):
+        """Return the size and modification time of the annotation file."""
+        stat = os.stat(self.infile)
+        return str(stat.st_size), str(stat.st_mtime_ns)
+    
+    def get_source_hash(self):
+        """Return the sha1 of the annotation file."""
+        source_hash = hashlib.sha1()
+        with open(self.infile, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                source_hash.update(block)
+        return source_hash.hexdigest()
+    
+    def save_index(self, index_file):
+        """Save the features to an index file."""
+        size, mtime = self.get_source_info()
+        arrays = {'metadata':numpy.array([INDEX_VERSION, self.annotation_type, size, mtime, self.get_source_hash()])}
+        arrays['chromosomes'] = numpy.array(sorted(self.features), dtype=str)
+        for i, chrom in enumerate(arrays['chromosomes']):
+            starts, stops, feature_ids = self.features[chrom]
+            arrays['starts_%s' % i] = starts
+            arrays['stops_%s' % i] = stops
+            arrays['ids_%s' % i] = feature_ids
+        # Write to a temporary file first so no one reads a half written index
+        temp_file = index_file + '.%s.tmp' % os.getpid()
+        with open(temp_file, 'wb') as f:
+            numpy.savez(f, **arrays)
+        os.replace(temp_file, index_file)
+    
+    def load_index(self, index_file):
+        """Return the features from an index file, or None if the index does not belong to the annotation file."""
+        with numpy.load(index_file, allow_pickle=False) as index:
+            version, annotation_type, size, mtime, source_hash = index['metadata']
+            if version != INDEX_VERSION or annotation_type != self.annotation_type:
+                return None
+            source_size, source_mtime = self.get_source_info()
+            if size != source_size:
+                return None
+            if mtime != source_mtime and source_hash != self.get_source_hash():
+                return None
+            features = {}
+            for i, chrom in enumerate(index['chromosomes']):
+                features[str(chrom)] = (index['starts_%s' % i], index['stops_%s' % i], index['ids_%s' % i])
+        return features
+
+def read_blocks(infile, zipped = False, block_size = BLOCK_SIZE):
+    """Yield tuples like (first_line_number, block) where a block is bytes with complete lines."""
+    if zipped:
+        f = gzip.open(infile, 'rb')
+    else:
+        f = open(infile, 'rb')
+    with f:
+        line_count = 0
+        rest = b''
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            block = rest + block
+            last_newline = block.rfind(b'\n')
+            if last_newline == -1:
+                rest = block
+                continue
+            rest = block[last_newline + 1:]
+            block = block[:last_newline + 1]
+            yield line_count, block
+            line_count += block.count(b'\n')
+        if rest:
+            yield line_count, rest
+
+def imap_bounded(pool, function, tasks, max_tasks):
+    """Like pool.imap but with at most max_tasks tasks in the pool, so the whole file is not read at once."""
+    running = collections.deque()
+    for task in tasks:
+        running.append(pool.apply_async(function, (task,)))
+        if len(running) >= max_tasks:
+            yield running.popleft().get()
+    while running:
+        yield running.popleft().get()
+
+def get_chrom(chrom):
+    """Remove chr from the chromosome name."""
+    if 'hr' in chrom:
+        return chrom[3:]
+    return chrom
+
+def get_positions(start, stop):
+    """Return start and stop as integers, 0 if they are not numbers."""
+    if is_number.is_number(start) and is_number.is_number(stop):
+        return int(start), int(stop)
+    return 0, 0
+
+def bed_feature(line, line_count):
+    """Return (chrom, start, stop, feature_id) from a bed line."""
+    line = line.split()
+    feature_id = str(line_count)
+    if len(line) > 3:
+        feature_id = line[3]
+    return get_chrom(line[0]), int(line[1]), int(line[2]), feature_id
+
+def ccds_feature(line, line_count):
+    """Return (chrom, start, stop, feature_id) from a ccds line."""
+    line = line.split('\t')
+    start, stop = get_positions(line[7], line[8])
+    return get_chrom(line[0]), start, stop, line[2]
+
+def gtf_feature(line, line_count):
+    """Return (chrom, start, stop, feature_id) from a gtf line, only the gene_id is taken from the attributes."""
+    line = line.split('\t')
+    start, stop = get_positions(line[3], line[4])
+    gene_id = '0'
+    for information in line[8].split(';')[:-1]:
+        entry = information.split()
+        if entry and entry[0] == 'gene_id':
+            gene_id = entry[1][1:-1]
+    return get_chrom(line[0]), start, stop, gene_id
+
+def ref_gene_feature(line, line_count):
+    """Return (chrom, start, stop, feature_id) from a refGene line."""
+    line = line.split('\t')
+    start, stop = get_positions(line[4], line[5])
+    return get_chrom(line[2]), start, stop, line[12]
+
+def unknown_feature(line, line_count):
+    """Features of unknown annotation types has no position."""
+    return 'Na', 0, 0, str(line_count)
+
+feature_parsers = {'bed':bed_feature, 'ccds':ccds_feature, 'gtf':gtf_feature, 'ref_gene':ref_gene_feature}
+
+def parse_block(task):
+    """Parse a block of lines and return {<chr>: (starts, stops, feature_ids)} with the features in file order.
+    
+    task is a tuple like (annotation_type, first_line_number, block). With numpy the features are returned
+    as arrays, they are much smaller to send between processes.
+    """
+    annotation_type, line_count, block = task
+    get_feature = feature_parsers.get(annotation_type, unknown_feature)
+    chromosomes = {}
+    for line in block.decode('utf-8').split('\n'):
+        if line and line[0] != '#':
+            chrom, start, stop, feature_id = get_feature(line.rstrip(), line_count)
+            if chrom not in chromosomes:
+                chromosomes[chrom] = ([], [], [])
+            chromosome = chromosomes[chrom]
+            chromosome[0].append(start)
+            chromosome[1].append(stop)
+            chromosome[2].append(feature_id)
+        line_count += 1
+    if numpy is not None:
+        for chrom in chromosomes:
+            starts, stops, feature_ids = chromosomes[chrom]
+            chromosomes[chrom] = (numpy.array(starts, dtype=numpy.int64), numpy.array(stops, dtype=numpy.int64),
+                                    numpy.array(feature_ids, dtype=str))
+    return chromosomes
+
 
 def main():
     parser = argparse.ArgumentParser(description="Parse different kind of annotation files.")
@@ -146,9 +299,10 @@ def main():
     parser.add_argument('-ccds', '--ccds', action="store_true", help='Annotation file is in ccds format.')
     parser.add_argument('-gtf', '--gtf', action="store_true", help='Annotation file is in gtf format.')
     parser.add_argument('-ref_gene', '--ref_gene', action="store_true", help='Annotation file is in gtf format.')
+    parser.add_argument('-i', '--index', type=str, nargs=1, default=[None], help='Use or build an index file(.npz).')
+    parser.add_argument('-p', '--processes', type=int, nargs=1, default=[1], help='Number of processes that parse the file.')
     args = parser.parse_args()
     infile = args.annotation_file[0]
-    # TODO write a check for zipped files
     file_type = 'ccds'
     if args.bed:
         file_type = 'bed'
@@ -159,7 +313,10 @@ def main():
     if args.ref_gene:
         file_type = 'ref_gene'
         
-    my_parser = AnnotationParser(infile, file_type)
+    start = datetime.now()
+    my_parser = AnnotationParser(infile, file_type, zipped = infile.endswith('.gz'), index_file = args.index[0], 
+                                    processes = args.processes[0])
+    print(('Time to load annotations: %s' % str(datetime.now() - start)))
     pp(my_parser.interval_trees)
 
 
@@ -0,0 +1,426 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+batch_runner.py
+
+Analyse many variant files with one pool of workers.
+
+A job is a pedigree file, a variant file and a results file. The parsers, the consumers and the printer
+are started once and stay alive between the jobs. Each envelope is sent together with the id of its job
+and the families of its job, so the consumers can check envelopes from different jobs at the same time.
+
+The messages on the results queue are:
+
+    ('start', job_id, header_object, outfiles)
+    ('variants', job_id, {family_id:{variant_id:variant_dict}})
+    ('done', job_id, number_of_envelopes)
+    ('failed', job_id, error_message)
+
+When a job is finished (job_id, error_message, outfiles) is put on the finished queue, error_message is
+None if the job was successful and outfiles is a dictionary on the form {family_id:results_file}. A job
+also fails if the printer can not write its results, for example if the results file is in a directory
+that does not exist.
+"""
+
+import sys
+import os
+import time
+import queue
+import argparse
+import multiprocessing
+from multiprocessing import Manager, JoinableQueue
+from collections import OrderedDict
+from tempfile import NamedTemporaryFile
+
+from Mip_Family_Analysis.Variants import variant_parser
+from Mip_Family_Analysis.Utils import variant_consumer, variant_sorter, header_parser, variant_printer, worker_pool
+from Mip_Family_Analysis.Utils.analysis import (get_families, check_individuals, add_cmms_metadata, get_outfile,
+                                                    print_headers)
+
+HEADER_CACHE_SIZE = 128
+# Seconds between the checks that the workers are alive while waiting for a job to finish
+WORKER_CHECK_INTERVAL = 0.5
+
+def read_manifest(manifest_file):
+    """Return a list with the jobs of a manifest file.
+
+    Each line of the manifest has a pedigree file, a variant file and a results file separated by tabs.
+    Empty lines and lines that starts with '#' are skipped.
+    """
+    jobs = []
+    with open(manifest_file, 'r') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.rstrip()
+            if not line or line.startswith('#'):
+                continue
+            job = line.split('\t')
+            if len(job) != 3:
+                raise SyntaxError('Line %s of the manifest should have three columns: %s' % (line_number, line))
+            jobs.append(tuple(job))
+    return jobs
+
+class JobQueue(object):
+    """Put the envelopes of a job on the variant queue together with the job id and the families."""
+    def __init__(self, task_queue, job_id, families):
+        super(JobQueue, self).__init__()
+        self.task_queue = task_queue
+        self.job_id = job_id
+        self.families = families
+        self.envelopes = 0
+
+    def put(self, envelope):
+        """Put an envelope on the variant queue"""
+        self.task_queue.put((self.job_id, self.families, envelope))
+        self.envelopes += 1
+
+class JobParser(multiprocessing.Process):
+    """Parse the jobs from the job queue and put their envelopes on the variant queue.
+
+    The jobs are tuples on the form (job_id, family_file, variant_file, outfile).
+    """
+    def __init__(self, job_queue, task_queue, results_queue, family_type = 'mip', verbosity = False,
+                    max_batch_size = None, split_genes = False, envelope_size = 100, reader = 'text',
+                    annotations = None, phased = False):
+        multiprocessing.Process.__init__(self)
+        self.job_queue = job_queue
+        self.task_queue = task_queue
+        self.results_queue = results_queue
+        self.family_type = family_type
+        self.verbosity = verbosity
+        self.max_batch_size = max_batch_size
+        self.split_genes = split_genes
+        self.envelope_size = envelope_size
+        self.reader = reader
+        self.annotations = annotations
+        self.phased = phased
+        # Headers of variant files that has been parsed before, the same file is often analysed again:
+        self.headers = OrderedDict()
+
+    def get_header(self, variant_file):
+        """Return the header of a variant file with the metadata of the analysis added."""
+        file_info = os.stat(variant_file)
+        key = (os.path.abspath(variant_file), file_info.st_size, file_info.st_mtime_ns)
+        if key in self.headers:
+            self.headers.move_to_end(key)
+            return self.headers[key]
+        head = header_parser.HeaderParser(variant_file)
+        add_cmms_metadata(head)
+        self.headers[key] = head
+        if len(self.headers) > HEADER_CACHE_SIZE:
+            self.headers.popitem(last=False)
+        return head
+
+    def parse_job(self, job_id, family_file, variant_file, outfile):
+        """Parse one job, returns the number of envelopes."""
+        families = get_families(family_file, self.family_type)
+        head = self.get_header(variant_file)
+        check_individuals(families, head, self.verbosity)
+        outfiles = dict((family.family_id, get_outfile(outfile, family.family_id, len(families)))
+                            for family in families)
+        self.results_queue.put(('start', job_id, head, outfiles))
+        job_queue = JobQueue(self.task_queue, job_id, families)
+        var_parser = variant_parser.VariantFileParser(variant_file, job_queue, head, self.verbosity,
+                            max_batch_size = self.max_batch_size, split_genes = self.split_genes,
+                            envelope_size = self.envelope_size, reader = self.reader,
+                            annotations = self.annotations, phased = self.phased)
+        var_parser.parse()
+        return job_queue.envelopes
+
+    def run(self):
+        """Parse jobs until a None is found on the job queue"""
+        proc_name = self.name
+        if self.verbosity:
+            print(('%s Starting!' % proc_name))
+        while True:
+            next_job = self.job_queue.get()
+            if next_job is None:
+                if self.verbosity:
+                    print(('%s: Exiting' % proc_name))
+                break
+            job_id = next_job[0]
+            try:
+                number_of_envelopes = self.parse_job(*next_job)
+            except Exception as e:
+                self.results_queue.put(('failed', job_id, '%s: %s' % (type(e).__name__, e)))
+            else:
+                self.results_queue.put(('done', job_id, number_of_envelopes))
+        return
+
+class JobConsumer(variant_consumer.VariantConsumer):
+    """Check the envelopes of the variant queue with the families of their job."""
+
+    def run(self):
+        """Run the consuming"""
+        proc_name = self.name
+        if self.verbosity:
+            print(('%s Starting!' % proc_name))
+        while True:
+            next_task = self.get_task()
+            if next_task is None:
+                self.task_queue.task_done()
+                if self.verbosity:
+                    print(('%s: Exiting' % proc_name))
+                if self.score_cache:
+                    self.score_cache.close()
+                break
+            job_id, families, envelope = next_task
+            self.family = families[0]
+            self.families = families
+            try:
+                self.results_queue.put(('variants', job_id, self.process_envelope(envelope, proc_name)))
+            except Exception as e:
+                self.results_queue.put(('failed', job_id, '%s: %s' % (type(e).__name__, e)))
+            self.task_queue.task_done()
+        return
+
+class JobPrinter(variant_printer.VariantPrinter):
+    """Print the results of the jobs to temporary files and sort them when a job is finished.
+
+    The results of a job can come before the job is started, they are kept until the start message arrives.
+    """
+    def __init__(self, task_queue, finished_queue, verbosity = False):
+        multiprocessing.Process.__init__(self)
+        self.task_queue = task_queue
+        self.finished_queue = finished_queue
+        self.verbosity = verbosity
+        self.jobs = {}
+        self.waiting = {}
+        self.failed = set()
+
+    def start_job(self, job_id, head, outfiles):
+        """Create the temporary files of a job and print the results that has been waiting."""
+        self.jobs[job_id] = {'header':head, 'outfiles':outfiles, 'received':0, 'expected':None,
+                                'temp_files':dict((family_id, NamedTemporaryFile(delete=False))
+                                                    for family_id in outfiles)}
+        for results in self.waiting.pop(job_id, []):
+            self.add_results(job_id, results)
+
+    def add_results(self, job_id, results):
+        """Print the variants of an envelope to the temporary files of the job."""
+        job = self.jobs[job_id]
+        self.header = job['header'].header
+        self.outfiles = job['temp_files']
+        self.print_results(results)
+        job['received'] += 1
+
+    def finish_job(self, job_id):
+        """Sort the temporary files into the results files."""
+        job = self.jobs[job_id]
+        for family_id, temp_file in job['temp_files'].items():
+            temp_file.close()
+            outfile = job['outfiles'][family_id]
+            print_headers(job['header'], outfile, silent = True)
+            var_sorter = variant_sorter.FileSort(temp_file, outFile=outfile, silent=True)
+            var_sorter.sort()
+            os.remove(temp_file.name)
+        del self.jobs[job_id]
+        self.finished_queue.put((job_id, None, job['outfiles']))
+
+    def fail_job(self, job_id, error):
+        """Remove everything of a job that failed."""
+        self.failed.add(job_id)
+        self.waiting.pop(job_id, None)
+        job = self.jobs.pop(job_id, None)
+        if job:
+            for temp_file in job['temp_files'].values():
+                temp_file.close()
+                if os.path.exists(temp_file.name):
+                    os.remove(temp_file.name)
+        if self.verbosity:
+            print(('Job %s failed: %s' % (job_id, error)))
+        self.finished_queue.put((job_id, error, {}))
+
+    def handle(self, message):
+        """Handle one message from the results queue."""
+        kind, job_id = message[:2]
+        if job_id in self.failed:
+            return
+        if kind == 'start':
+            self.start_job(job_id, *message[2:])
+        elif kind == 'variants':
+            if job_id in self.jobs:
+                self.add_results(job_id, message[2])
+            else:
+                self.waiting.setdefault(job_id, []).append(message[2])
+        elif kind == 'done':
+            self.jobs[job_id]['expected'] = message[2]
+        elif kind == 'failed':
+            self.fail_job(job_id, message[2])
+            return
+        job = self.jobs.get(job_id)
+        if job and job['received'] == job['expected']:
+            self.finish_job(job_id)
+
+    def run(self):
+        """Starts the printing"""
+        proc_name = self.name
+        if self.verbosity:
+            print(('%s starting!' % proc_name))
+        while True:
+            next_result = self.task_queue.get()
+            if next_result is None:
+                if self.verbosity:
+                    print('All jobs printed!')
+                break
+            try:
+                self.handle(next_result)
+            except Exception as e:
+                self.fail_job(next_result[1], '%s: %s' % (type(e).__name__, e))
+        return
+
+class BatchRunner(object):
+    """Keep the workers alive and run the jobs that are submitted.
+
+    The keyword arguments are passed to the consumers: compounds, rank_model, score_cache_file, treshold
+    and prefilter.
+    """
+    def __init__(self, family_type = 'mip', verbosity = False, consumers = None, parsers = 1,
+                    max_batch_size = None, envelope_size = 100, reader = 'text', annotations = None,
+                    phased = False, queue_size = None, **consumer_options):
+        super(BatchRunner, self).__init__()
+        self.family_type = family_type
+        self.verbosity = verbosity
+        self.number_of_consumers = consumers or worker_pool.get_available_cpus()
+        self.queue_size = worker_pool.get_queue_size(self.number_of_consumers, queue_size)
+        self.number_of_parsers = parsers
+        self.parser_options = {'max_batch_size':max_batch_size, 'envelope_size':envelope_size,
+                                'reader':reader, 'annotations':annotations, 'phased':phased,
+                                'split_genes':not consumer_options.get('compounds', True)}
+        consumer_options['phased'] = phased
+        self.consumer_options = consumer_options
+        self.job_counter = 0
+        self.running = set()
+        self.workers = []
+        self.stopping = False
+
+    def start(self):
+        """Start the parsers, the consumers and the printer."""
+        self.job_queue = multiprocessing.Queue()
+        self.variant_queue = JoinableQueue(maxsize=self.queue_size)
+        self.tile_queue = multiprocessing.Queue()
+        self.manager = Manager()
+        self.results = self.manager.Queue()
+        self.finished_queue = multiprocessing.Queue()
+        self.parsers = [JobParser(self.job_queue, self.variant_queue, self.results, self.family_type,
+                            self.verbosity, **self.parser_options) for i in range(self.number_of_parsers)]
+        self.consumers = [JobConsumer(self.variant_queue, self.results, None, self.verbosity,
+                            tile_queue = self.tile_queue, **self.consumer_options)
+                            for i in range(self.number_of_consumers)]
+        self.printer = JobPrinter(self.results, self.finished_queue, self.verbosity)
+        self.workers = self.parsers + self.consumers + [self.printer]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, family_file, variant_file, outfile):
+        """Add a job to the job queue and return its id."""
+        job_id = self.job_counter
+        self.job_counter += 1
+        self.running.add(job_id)
+        self.job_queue.put((job_id, family_file, variant_file, outfile))
+        return job_id
+
+    def get_finished(self, timeout = None):
+        """Wait for a job to finish and return (job_id, error_message, outfiles).
+
+        Raises queue.Empty if no job is finished within timeout seconds and RuntimeError if a worker has
+        stopped, then the jobs that are running will never finish.
+        """
+        if timeout is not None:
+            stop = time.time() + timeout
+        while True:
+            wait = WORKER_CHECK_INTERVAL
+            if timeout is not None:
+                wait = max(min(wait, stop - time.time()), 0)
+            try:
+                job_id, error, outfiles = self.finished_queue.get(timeout = wait)
+                break
+            except queue.Empty:
+                # The parsers and the consumers stop before the printer when the runner is shut down
+                workers = self.stopping and [self.printer] or self.workers
+                if self.running and not all(worker.is_alive() for worker in workers):
+                    raise RuntimeError('A worker stopped before all jobs were finished')
+                if timeout is not None and time.time() >= stop:
+                    raise
+        self.running.discard(job_id)
+        return job_id, error, outfiles
+
+    def get_queue_sizes(self):
+        """Return the number of items on the queues, None if the platform can not tell."""
+        queue_sizes = {}
+        for name, queue in [('jobs', self.job_queue), ('variants', self.variant_queue), ('results', self.results)]:
+            try:
+                queue_sizes[name] = queue.qsize()
+            except NotImplementedError:
+                queue_sizes[name] = None
+        return queue_sizes
+
+    def shutdown(self):
+        """Stop the workers when all submitted jobs are parsed and printed."""
+        self.stopping = True
+        for parser in self.parsers:
+            self.job_queue.put(None)
+        for parser in self.parsers:
+            parser.join()
+        for consumer in self.consumers:
+            self.variant_queue.put(None)
+        self.variant_queue.join()
+        self.results.put(None)
+        self.printer.join()
+        self.manager.shutdown()
+
+    def terminate(self):
+        """Stop the workers without waiting for the jobs, used when a worker has stopped."""
+        for worker in self.workers:
+            if worker.is_alive():
+                worker.terminate()
+            worker.join()
+        self.manager.shutdown()
+
+def get_job_size(job):
+    """Return the size of the variant file of a job, files that does not exist fails in the parser."""
+    try:
+        return os.path.getsize(job[1])
+    except OSError:
+        return 0
+
+def run_batch(jobs, **kwargs):
+    """Run a list of (family_file, variant_file, outfile) jobs. Returns a dictionary with the jobs that failed
+    on the form {job:error_message}.
+
+    The biggest variant files are started first so that the workers are not waiting for one big job at the end.
+    """
+    jobs = sorted(jobs, key=get_job_size, reverse=True)
+    runner = BatchRunner(**kwargs)
+    runner.start()
+    submitted = {}
+    for job in jobs:
+        submitted[runner.submit(*job)] = job
+    failed = {}
+    try:
+        for i in range(len(submitted)):
+            job_id, error, outfiles = runner.get_finished()
+            if error:
+                failed[submitted[job_id]] = error
+    except BaseException:
+        runner.terminate()
+        raise
+    runner.shutdown()
+    return failed
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the analysis for all jobs of a manifest.")
+    parser.add_argument('manifest',
+        type=str, nargs=1,
+        help='A file with one job per line: pedigree file, variant file and results file separated by tabs.'
+    )
+    parser.add_argument('-v', '--verbose',
+        action="store_true",
+        help='Increase output verbosity.'
+    )
+    args = parser.parse_args()
+    failed = run_batch(read_manifest(args.manifest[0]), verbosity = args.verbose)
+    for job in failed:
+        print(('%s failed: %s' % (job[1], failed[job])))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+checkpoint.py
+
+Keep the results of each finished chromosome in a work directory so that a run that dies can be resumed.
+
+The results of a chromosome are written to a part file for each family. When all variants of the chromosome
+are checked the part files are renamed to <family_id>.<chromosome>.txt and the chromosome is added to the
+state file. The state file also holds the sha1 of the variant file and the pedigree and the settings of the
+run. A resumed run only skips the finished chromosomes if these are the same as in the state file.
+"""
+
+import sys
+import os
+import json
+import shutil
+import hashlib
+import argparse
+
+# Change this if the format of the state file or the results changes
+CHECKPOINT_VERSION = '1'
+STATE_FILE = 'checkpoint.json'
+
+def get_file_hash(file_name):
+    """Return the sha1 of a file."""
+    file_hash = hashlib.sha1()
+    with open(file_name, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+def get_chromosome(envelope):
+    """Return the chromosome of the first variant in an envelope."""
+    for batch in envelope:
+        for gene in batch:
+            for variant_id in batch[gene]:
+                return batch[gene][variant_id]['Chromosome']
+    return None
+
+def checkpoint_envelopes(envelopes, finish_chromosome):
+    """Yield the envelopes and call finish_chromosome with a chromosome when all its envelopes are yielded.
+
+    The envelopes must be split on chromosomes, see the split_chromosomes option of the VariantFileParser.
+    """
+    chromosome = None
+    finished = set()
+    for envelope in envelopes:
+        envelope_chromosome = get_chromosome(envelope)
+        if envelope_chromosome != chromosome:
+            if chromosome is not None:
+                finish_chromosome(chromosome)
+                finished.add(chromosome)
+            if envelope_chromosome in finished:
+                raise ValueError('The variants of chromosome %s are not together in the variant file'
+                                    % envelope_chromosome)
+            chromosome = envelope_chromosome
+        yield envelope
+    if chromosome is not None:
+        finish_chromosome(chromosome)
+
+class Checkpoints(object):
+    """The finished chromosomes of a run and their results.
+
+    If resume is False, or the variant file, the pedigree or the settings has changed, the run starts from
+    the beginning. settings is a dictionary with the options that change the results.
+    """
+    def __init__(self, work_dir, variant_file, family_file, family_ids, settings = None, resume = False,
+                    verbosity = False):
+        super(Checkpoints, self).__init__()
+        self.work_dir = work_dir
+        self.family_ids = list(family_ids)
+        self.verbosity = verbosity
+        if not os.path.isdir(work_dir):
+            os.makedirs(work_dir)
+        old_state = self.read_state()
+        self.state = {'version':CHECKPOINT_VERSION,
+                        'variant_file':self.get_variant_file_info(variant_file, old_state),
+                        'pedigree':get_file_hash(family_file),
+                        'settings':settings or {},
+                        'finished':[]}
+        if old_state is not None:
+            if resume and self.matches(old_state):
+                self.state['finished'] = [chromosome for chromosome in old_state['finished']
+                                            if self.has_results(chromosome)]
+            else:
+                if self.verbosity and resume:
+                    print('The checkpoints are from another variant file, pedigree or settings')
+                self.remove_results(old_state['finished'])
+        self.write_state()
+        if self.verbosity and self.finished:
+            print(('Finished chromosomes: %s' % ', '.join(self.finished)))
+
+    @property
+    def finished(self):
+        """The chromosomes that are finished, in the order they were checked"""
+        return self.state['finished']
+
+    def get_variant_file_info(self, variant_file, old_state):
+        """Return the size, modification time and sha1 of the variant file.
+
+        The file is only hashed if its size or modification time is not the same as in the old state.
+        """
+        stat = os.stat(variant_file)
+        info = {'size':stat.st_size, 'mtime':stat.st_mtime_ns}
+        if old_state is not None:
+            old_info = old_state.get('variant_file', {})
+            if old_info.get('size') == info['size'] and old_info.get('mtime') == info['mtime']:
+                info['sha1'] = old_info['sha1']
+                return info
+        info['sha1'] = get_file_hash(variant_file)
+        return info
+
+    def matches(self, old_state):
+        """Return True if the checkpoints of old_state are from the same input and settings."""
+        return (old_state.get('version') == CHECKPOINT_VERSION and
+                old_state['variant_file']['size'] == self.state['variant_file']['size'] and
+                old_state['variant_file']['sha1'] == self.state['variant_file']['sha1'] and
+                old_state['pedigree'] == self.state['pedigree'] and
+                old_state['settings'] == self.state['settings'])
+
+    def read_state(self):
+        """Return the state in the work directory, None if there is none."""
+        try:
+            with open(os.path.join(self.work_dir, STATE_FILE), 'r') as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def write_state(self):
+        """Write the state to the work directory."""
+        state_file = os.path.join(self.work_dir, STATE_FILE)
+        # Write to a temporary file first so a run that dies never leaves a half written state
+        temp_file = state_file + '.%s.tmp' % os.getpid()
+        with open(temp_file, 'w') as f:
+            json.dump(self.state, f, indent=2, sort_keys=True)
+        os.replace(temp_file, state_file)
+
+    def get_results_file(self, family_id, chromosome):
+        """Return the path to the results of a family on a chromosome."""
+        return os.path.join(self.work_dir, '%s.%s.txt' % (family_id, chromosome))
+
+    def get_part_file(self, family_id):
+        """Return the path to the results of a family on the chromosome that is checked."""
+        return os.path.join(self.work_dir, '%s.part' % family_id)
+
+    def has_results(self, chromosome):
+        """Return True if the results of all families are in the work directory."""
+        return all(os.path.exists(self.get_results_file(family_id, chromosome)) for family_id in self.family_ids)
+
+    def remove_results(self, chromosomes):
+        """Remove the results of the chromosomes."""
+        for chromosome in chromosomes:
+            for family_id in self.family_ids:
+                if os.path.exists(self.get_results_file(family_id, chromosome)):
+                    os.remove(self.get_results_file(family_id, chromosome))
+
+    def open_files(self):
+        """Return a dictionary with a new part file for each family."""
+        return dict((family_id, open(self.get_part_file(family_id), 'wb')) for family_id in self.family_ids)
+
+    def finish(self, chromosome, outfiles):
+        """Close the part files, save them as the results of the chromosome and return new part files."""
+        for family_id in self.family_ids:
+            outfiles[family_id].close()
+            os.replace(self.get_part_file(family_id), self.get_results_file(family_id, chromosome))
+        self.state['finished'].append(chromosome)
+        self.write_state()
+        if self.verbosity:
+            print(('Checkpoint for chromosome %s' % chromosome))
+        return self.open_files()
+
+    def close(self, outfiles):
+        """Close and remove the part files."""
+        for family_id in self.family_ids:
+            outfiles[family_id].close()
+            if os.path.exists(self.get_part_file(family_id)):
+                os.remove(self.get_part_file(family_id))
+
+    def merge(self, family_id):
+        """Write the results of all finished chromosomes of a family to one file and return the closed file.
+
+        The state is read again since the chromosomes may have been finished in another process.
+        """
+        self.state = self.read_state()
+        merged_file = open(os.path.join(self.work_dir, '%s.merged' % family_id), 'wb')
+        with merged_file:
+            for chromosome in self.finished:
+                with open(self.get_results_file(family_id, chromosome), 'rb') as f:
+                    shutil.copyfileobj(f, merged_file)
+        return merged_file
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the finished chromosomes of a work directory.")
+    parser.add_argument('work_dir', type=str, nargs=1, help='A work directory.')
+    args = parser.parse_args()
+    with open(os.path.join(args.work_dir[0], STATE_FILE), 'r') as f:
+        state = json.load(f)
+    print(('Finished chromosomes: %s' % ', '.join(state['finished'])))
+
+if __name__ == '__main__':
+    main()
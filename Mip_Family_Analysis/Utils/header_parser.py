@@ -23,39 +23,57 @@ else:
 
 from pprint import pprint as pp
 
-### TODO make a proper vcf parser ###
-
-
 class HeaderParser(object):
-    """Parses a file with family info and creates a family object with individuals."""
-    def __init__(self, infile):
+    """Parses the header of a variant file in the cmms format or in the vcf format.
+    
+    The file type is 'vcf' if the first line is a ##fileformat=VCF line, otherwise 'cmms'.
+    If lines is given the header is parsed from the lines instead of from infile.
+    """
+    def __init__(self, infile = None, lines = None):
         super(HeaderParser, self).__init__()
         self.metadata=OrderedDict()
+        self.vcf_metadata = []
         self.header=[]
         self.line_counter = 0
         self.individuals = []
+        self.file_type = 'cmms'
         self.metadata_pattern = re.compile(r'''\#\#COLUMNNAME="(?P<colname>[^"]*)"
             (?P<info>.*)''', re.VERBOSE)
-        with open(infile, 'rb') as f:
-            for line in f:
-                self.line_counter += 1
-                line = line.rstrip()
-                if line.startswith('##'):
-                    match = self.metadata_pattern.match(line)
-                    if not match:
-                        raise SyntaxError("One of the metadata lines is malformed: %s" % line)
-                    matches = [match.group('colname'), match.group('info')]
+        if lines is None:
+            with open(infile, 'r') as f:
+                self.parse_lines(f)
+        else:
+            self.parse_lines(lines)
+    
+    def parse_lines(self, lines):
+        """Parse the header lines, stops at the first line that is not a header line."""
+        for line in lines:
+            self.line_counter += 1
+            line = line.rstrip()
+            if line.startswith('##'):
+                if self.line_counter == 1 and line.startswith('##fileformat=VCF'):
+                    self.file_type = 'vcf'
+                match = self.metadata_pattern.match(line)
+                if match:
                     self.metadata[match.group('colname')] = line
-                elif line.startswith('#'):
-                    self.header = line[1:].split('\t')
+                elif self.file_type == 'vcf':
+                    self.vcf_metadata.append(line)
+                else:
+                    raise SyntaxError("One of the metadata lines is malformed: %s" % line)
+            elif line.startswith('#'):
+                self.header = line[1:].split('\t')
+                if self.file_type == 'vcf':
+                    # In a vcf all columns after FORMAT are individuals
+                    self.individuals = self.header[9:]
+                else:
                     for entry in self.header:
                         if entry[:3] == 'IDN':
                             self.individuals.append(entry.split(':')[1])
                         else:
                             self.check_header(entry)
-                else:
-                    break
-        
+            else:
+                break
+    
     def add_metadata(self, column_name, data_type=None, version=None, description=None, dbname=None, delimiter='\t'):
         """Add metadata info to the header."""
         data_line = '##COLUMNNAME='+'"'+ column_name +'"'
@@ -83,7 +101,7 @@ class HeaderParser(object):
     
     def get_headers_for_print(self):
         """Returns a list with the metadata lines on correct format."""
-        lines_for_print = []
+        lines_for_print = list(self.vcf_metadata)
         for header in self.metadata:
             lines_for_print.append(self.metadata[header])
         lines_for_print.append('\t'.join(self.header))
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+interval_index.py
+
+An interval index that is backed by numpy arrays, it gives the same features as an interval tree.
+
+The features are sorted on start and for each feature we keep the largest stop of all features
+that starts before it(a running max). The features that overlap [start, stop] are then found between
+the first feature with a max stop >= start and the last feature with a start <= stop.
+Both positions are found with numpy.searchsorted so many positions can be looked up at once.
+
+Intervals are closed, a feature [100, 200] overlaps both position 100 and 200. Unlike the interval tree
+features with the same start and stop, like [7, 7], are always found.
+"""
+
+import sys
+import os
+import argparse
+
+from datetime import datetime
+
+import numpy
+
+class IntervalIndex(object):
+    """Find the features that overlap positions or intervals."""
+    def __init__(self, starts, stops, feature_ids):
+        super(IntervalIndex, self).__init__()
+        order = numpy.lexsort((stops, starts))
+        self.starts = numpy.asarray(starts, dtype=numpy.int64)[order]
+        self.stops = numpy.asarray(stops, dtype=numpy.int64)[order]
+        self.feature_ids = numpy.asarray(feature_ids, dtype=str)[order]
+        self.max_stops = numpy.maximum.accumulate(self.stops) if len(self.stops) > 0 else self.stops
+
+    def get_ranges(self, starts, stops):
+        """Return the first and last(exclusive) candidate feature for each interval."""
+        first = numpy.searchsorted(self.max_stops, starts, side='left')
+        last = numpy.searchsorted(self.starts, stops, side='right')
+        return first, numpy.maximum(first, last)
+
+    def query(self, positions, stops = None):
+        """Return a list with a set of feature ids for each position, or interval if stops are given."""
+        starts = numpy.asarray(positions, dtype=numpy.int64)
+        if stops is None:
+            stops = starts
+        else:
+            stops = numpy.asarray(stops, dtype=numpy.int64)
+        first, last = self.get_ranges(starts, stops)
+        lengths = last - first
+        # All candidates of all intervals in one array:
+        interval_numbers = numpy.repeat(numpy.arange(len(starts)), lengths)
+        offsets = numpy.arange(lengths.sum()) - numpy.repeat(numpy.cumsum(lengths) - lengths, lengths)
+        candidates = numpy.repeat(first, lengths) + offsets
+        overlapping = self.stops[candidates] >= starts[interval_numbers]
+        interval_numbers = interval_numbers[overlapping]
+        found_ids = self.feature_ids[candidates[overlapping]].tolist()
+        features = [set() for i in range(len(starts))]
+        for interval_number, feature_id in zip(interval_numbers.tolist(), found_ids):
+            features[interval_number].add(feature_id)
+        return features
+
+    def find_range(self, interval):
+        """Return a list with the ids of the features that overlap [start, stop], like an interval tree."""
+        return list(self.query([interval[0]], [interval[1]])[0])
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __repr__(self):
+        return "IntervalIndex(features={0})".format(len(self))
+
+
+def main():
+    import interval_tree
+    parser = argparse.ArgumentParser(description="Compare the interval index with an interval tree.")
+    parser.add_argument('-n', '--nr_of_features', type=int, nargs=1, default=[20000], help='Number of features.')
+    args = parser.parse_args()
+    nr_of_features = args.nr_of_features[0]
+    random_state = numpy.random.RandomState(1)
+    starts = random_state.randint(1, 10000000, nr_of_features)
+    stops = starts + random_state.randint(1, 50000, nr_of_features)
+    feature_ids = ['feature_%s' % i for i in range(nr_of_features)]
+    positions = random_state.randint(1, 10000000, 100000)
+
+    start = datetime.now()
+    tree = interval_tree.IntervalTree([[int(feature_start), int(feature_stop), feature_id] for
+                    feature_start, feature_stop, feature_id in zip(starts, stops, feature_ids)], 1, int(stops.max()) + 1)
+    tree_features = [set(tree.find_range([position, position])) for position in positions.tolist()]
+    print(('Time with the interval tree: %s' % str(datetime.now() - start)))
+
+    start = datetime.now()
+    index = IntervalIndex(starts, stops, feature_ids)
+    index_features = index.query(positions)
+    print(('Time with the interval index: %s' % str(datetime.now() - start)))
+    print(('Same features: %s' % (tree_features == index_features)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+mmap_reader.py
+
+Read the lines of a file as bytes from a memory map.
+
+The file is mapped into memory and splitted on newlines in large blocks, this is faster than
+reading a text file line by line since nothing is decoded.
+
+Run as a script to compare the text reader and the mmap reader of the variant parser:
+
+    python mmap_reader.py variant_file
+"""
+
+import sys
+import os
+import mmap
+import argparse
+
+from datetime import datetime
+
+BLOCK_SIZE = 16 * 1024 * 1024
+
+def mmap_lines(infile, block_size = BLOCK_SIZE):
+    """Yield the lines of a file as bytes, without the newline."""
+    with open(infile, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        memory_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            rest = b''
+            for block_start in range(0, len(memory_map), block_size):
+                lines = memory_map[block_start:block_start + block_size].split(b'\n')
+                lines[0] = rest + lines[0]
+                # The last line of a block is probably not complete:
+                rest = lines.pop()
+                for line in lines:
+                    yield line
+            if rest:
+                yield rest
+        finally:
+            memory_map.close()
+
+class NullQueue(object):
+    """A queue that throws away everything, used to time the parsing only."""
+    def put(self, item):
+        pass
+
+def main():
+    from Mip_Family_Analysis.Utils import header_parser
+    from Mip_Family_Analysis.Variants import variant_parser
+    parser = argparse.ArgumentParser(description="Compare the text and mmap readers of the variant parser.")
+    parser.add_argument('variant_file', type=str, nargs=1 , help='A file with variant information, use a big one(~1 GB).')
+    args = parser.parse_args()
+    infile = args.variant_file[0]
+    head = header_parser.HeaderParser(infile)
+    for reader in ['text', 'mmap']:
+        start = datetime.now()
+        my_parser = variant_parser.VariantFileParser(infile, NullQueue(), head, reader = reader)
+        my_parser.parse()
+        print(('Time to parse %s with the %s reader: %s' % (infile, reader, str(datetime.now() - start))))
+
+
+if __name__ == '__main__':
+    main()
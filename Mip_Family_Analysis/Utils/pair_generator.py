@@ -24,13 +24,37 @@ class Pair_Generator(object):
             sys.exit()
         self.list_of_objects = list_of_objects
     
-    def generate_pairs(self):
-        """Yields all unordered pairs from the list of objects"""
-        for i in range(len(self.list_of_objects)-1):
+    def generate_pairs(self, first_row = 0, last_row = None):
+        """Yields all unordered pairs from the list of objects.
+        
+        The pairs (i, j) with i < j are a triangle with one row for each i. If first_row and last_row are 
+        given only the pairs of the rows first_row <= i < last_row are yielded, see get_row_tiles."""
+        if last_row is None:
+            last_row = len(self.list_of_objects)-1
+        for i in range(first_row, min(last_row, len(self.list_of_objects)-1)):
             for j in range(i+1, len(self.list_of_objects)):
                 yield (self.list_of_objects[i], self.list_of_objects[j])
     
 
+def get_row_tiles(number_of_objects, max_pairs):
+    """Split the pairs of number_of_objects into tiles of rows with at most max_pairs pairs each.
+    
+    Returns a list with (first_row, last_row) tuples. A row with more pairs than max_pairs is a tile 
+    of its own."""
+    tiles = []
+    first_row = 0
+    pairs = 0
+    for row in range(number_of_objects-1):
+        row_pairs = number_of_objects - 1 - row
+        if pairs > 0 and pairs + row_pairs > max_pairs:
+            tiles.append((first_row, row))
+            first_row = row
+            pairs = 0
+        pairs += row_pairs
+    if pairs > 0:
+        tiles.append((first_row, number_of_objects-1))
+    return tiles
+
 def main():
     my_list = ['a', 'b', 'c', 'd']
     for pairs in Pair_Generator(my_list).generate_pairs():
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+score_cache.py
+
+Store the annotation scores of variants in a sqlite database so they can be used in later runs.
+
+Everything in the rank score except the inheritance score depends only on the annotations of a variant,
+not on the family. The annotation scores are stored with a key that is the variant id followed by a hash
+of the rank model version and the columns that are used in the scoring. If the annotations or the rank
+model change the key changes, so old scores are never used.
+
+Several processes can use the same database at the same time.
+"""
+
+import sys
+import os
+import sqlite3
+import hashlib
+import argparse
+
+from Mip_Family_Analysis.Models import score_variants, rank_model
+from Mip_Family_Analysis.Variants import variant_parser
+
+# sqlite has a limit on the number of parameters in a query
+CHUNK_SIZE = 500
+
+class ScoreCache(object):
+    """Get and add annotation scores to a sqlite database."""
+    def __init__(self, database, rank_model_version = rank_model.default_rank_model.version):
+        super(ScoreCache, self).__init__()
+        self.database = database
+        self.rank_model_version = rank_model_version
+        # Other processes may write at the same time, wait for them instead of failing.
+        self.connection = sqlite3.connect(database, timeout = 60)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS annotation_scores (key TEXT PRIMARY KEY, score INTEGER)')
+        self.connection.commit()
+
+    def get_key(self, variant):
+        """Return the key of the annotation score of a variant."""
+        # A column that is missing is not the same as a column with the value None
+        values = [self.rank_model_version] + [repr(variant[column]) if column in variant else '.' 
+                                                for column in score_variants.scoring_columns]
+        annotation_hash = hashlib.sha1('\t'.join(values).encode('utf-8')).hexdigest()
+        return variant_parser.get_variant_id(variant) + ':' + annotation_hash
+
+    def get_keys(self, variants):
+        """Return a dictionary on the form {variant_id:key}."""
+        return dict((variant_id, self.get_key(variants[variant_id])) for variant_id in variants)
+
+    def get_scores(self, keys):
+        """Return a dictionary on the form {variant_id:annotation_score} with the scores that are in the database."""
+        variant_ids = {}
+        for variant_id in keys:
+            variant_ids[keys[variant_id]] = variant_id
+        annotation_scores = {}
+        all_keys = list(variant_ids)
+        for chunk_start in range(0, len(all_keys), CHUNK_SIZE):
+            chunk = all_keys[chunk_start:chunk_start + CHUNK_SIZE]
+            query = 'SELECT key, score FROM annotation_scores WHERE key IN (%s)' % ','.join(['?'] * len(chunk))
+            for key, score in self.connection.execute(query, chunk):
+                annotation_scores[variant_ids[key]] = score
+        return annotation_scores
+
+    def add_scores(self, keys, annotation_scores):
+        """Add the annotation scores on the form {variant_id:annotation_score} to the database."""
+        rows = [(keys[variant_id], int(annotation_scores[variant_id])) for variant_id in annotation_scores]
+        if len(rows) > 0:
+            self.connection.executemany('INSERT OR REPLACE INTO annotation_scores (key, score) VALUES (?, ?)', rows)
+            self.connection.commit()
+
+    def close(self):
+        """Close the connection to the database."""
+        self.connection.close()
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM annotation_scores').fetchone()[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the number of annotation scores in a score cache.")
+    parser.add_argument('database', type=str, nargs=1 , help='A score cache database.')
+    args = parser.parse_args()
+    my_cache = ScoreCache(args.database[0])
+    print(('%s annotation scores in %s' % (len(my_cache), args.database[0])))
+    my_cache.close()
+
+
+if __name__ == '__main__':
+    main()
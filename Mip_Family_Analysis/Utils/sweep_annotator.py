@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+sweep_annotator.py
+
+Find the features that overlap the variants of a file that is sorted on position.
+
+The variants and the features from an AnnotationParser are both sorted, so instead of one lookup
+for each variant we walk along the features. The features that have started are kept in a heap
+sorted on stop, features are removed when a variant has passed their stop. Each feature is added and
+removed once so the total work is proportional to the number of variants plus the number of features.
+
+If a variant comes before the last one on a chromosome the features are looked up in the annotation
+index instead, so unsorted files give the same result but slower.
+"""
+
+import sys
+import os
+import heapq
+import argparse
+
+from datetime import datetime
+
+class SweepAnnotator(object):
+    """Returns the features of the variants in the order they are read."""
+    def __init__(self, annotations):
+        super(SweepAnnotator, self).__init__()
+        self.annotations = annotations
+        self.chrom = None
+        self.starts = []
+        self.stops = []
+        self.feature_ids = []
+        # The position of the next feature that has not been added:
+        self.next_feature = 0
+        # The features that have started, a heap with (stop, start, feature_id):
+        self.active_features = []
+        self.last_position = 0
+
+    def new_chromosome(self, chrom):
+        """Start from the beginning of the features on a chromosome."""
+        self.chrom = chrom
+        self.starts, self.stops, self.feature_ids = self.annotations.features.get(chrom, ([], [], []))
+        if hasattr(self.starts, 'tolist'):
+            self.starts, self.stops, self.feature_ids = (self.starts.tolist(), self.stops.tolist(),
+                                                            self.feature_ids.tolist())
+        self.next_feature = 0
+        self.active_features = []
+        self.last_position = 0
+
+    def get_features(self, chrom, start, stop = None):
+        """Return a sorted list with the ids of the features that overlap [start, stop] on a chromosome."""
+        if stop is None:
+            stop = start
+        if chrom != self.chrom:
+            self.new_chromosome(chrom)
+        if start < self.last_position:
+            return sorted(self.annotations.get_features(chrom, [start], [stop])[0])
+        self.last_position = start
+
+        starts = self.starts
+        active_features = self.active_features
+        # Add the features that starts before the end of the variant:
+        while self.next_feature < len(starts) and starts[self.next_feature] <= stop:
+            feature_number = self.next_feature
+            heapq.heappush(active_features, (self.stops[feature_number], starts[feature_number],
+                                                self.feature_ids[feature_number]))
+            self.next_feature += 1
+        # Remove the features that ends before the variant:
+        while active_features and active_features[0][0] < start:
+            heapq.heappop(active_features)
+        # A longer variant before this one may have added features that starts after this variant:
+        return sorted(set(feature_id for feature_stop, feature_start, feature_id in active_features
+                            if feature_start <= stop))
+
+
+def main():
+    from Mip_Family_Analysis.Utils import annotation_parser
+    parser = argparse.ArgumentParser(description="Compare the sweep with looking up each position.")
+    parser.add_argument('annotation_file', type=str, nargs=1, help='A file with annotations in the refGene format.')
+    parser.add_argument('-n', '--nr_of_positions', type=int, nargs=1, default=[1000000],
+                            help='Number of positions on each chromosome.')
+    args = parser.parse_args()
+    annotations = annotation_parser.AnnotationParser(args.annotation_file[0], 'ref_gene')
+    for name, get_features in [('sweep', SweepAnnotator(annotations).get_features),
+                                ('lookup', lambda chrom, position: annotations.get_features(chrom, [position])[0])]:
+        start = datetime.now()
+        for chrom in sorted(annotations.features):
+            chromosome_stop = int(max(annotations.features[chrom][1]))
+            step = max(1, chromosome_stop // args.nr_of_positions[0])
+            for position in range(1, chromosome_stop, step):
+                get_features(chrom, position)
+        print(('Time with %s: %s' % (name, str(datetime.now() - start))))
+
+
+if __name__ == '__main__':
+    main()
@@ -13,20 +13,52 @@ Copyright (c) 2013 __MyCompanyName__. All rights reserved.
 
 import sys
 import os
+import queue
 import multiprocessing
 from pprint import pprint as pp
 
-from Mip_Family_Analysis.Models import genetic_models, score_variants
+from Mip_Family_Analysis.Models import genetic_models, score_variants, rank_model
+from Mip_Family_Analysis.Variants import variant_parser
+from Mip_Family_Analysis.Utils import score_cache, pair_generator, variant_store
+
+# Genes with more compound pairs than this are split in tiles that the other consumers can check
+COMPOUND_TILE_SIZE = 50000
+# How often, in seconds, a consumer that waits for an envelope looks for tiles
+TILE_POLL_INTERVAL = 0.05
 
 class VariantConsumer(multiprocessing.Process):
-    """Yeilds all unordered pairs from a list of objects as tuples, like (obj_1, obj_2)"""
+    """Check the models and score the variants of the envelopes on the task queue.
+    
+    If families is a list of families each batch is checked for all of them. The results are put on the 
+    results queue as dictionaries on the form {family_id:{variant_id:variant_dict}}.
+    
+    If tile_queue is a queue that is shared by the consumers, the compound pairs of a gene with more than 
+    tile_size pairs are split in tiles. The tiles are put on the tile queue and checked by the consumers that 
+    are free, the consumer that split the gene merge the compound pairs before the variants are scored.
+    """
     
-    def __init__(self, task_queue, results_queue, family, verbosity = False):
+    def __init__(self, task_queue, results_queue, family, verbosity = False, compounds = True, 
+                    rank_model = rank_model.default_rank_model, score_cache_file = None, treshold = None, 
+                    prefilter = False, phased = False, families = None, tile_queue = None):
         multiprocessing.Process.__init__(self)
         self.task_queue = task_queue
         self.family = family
+        self.families = families or [family]
         self.results_queue = results_queue
         self.verbosity = verbosity
+        self.compounds = compounds
+        self.rank_model = rank_model
+        # The database is opened by the process that uses it, a sqlite connection can not be shared
+        self.score_cache_file = score_cache_file
+        self.score_cache = None
+        # Variants with a lower rank score than treshold are not returned
+        self.treshold = treshold
+        self.prefilter = prefilter
+        # If the variants have haploblocks from the parser:
+        self.phased = phased
+        self.tile_queue = tile_queue
+        self.tile_size = COMPOUND_TILE_SIZE
+        self.split_genes = 0
     
     def fix_variants(self, variant_batch):
         """Merge the variants into one dictionary, make shure that the compounds are treated right."""
@@ -60,7 +92,8 @@ class VariantConsumer(multiprocessing.Process):
                     compound_score = (int(variant_dict[variant_id]['Individual_rank_score']) + 
                                          int(variant_dict[compound_id]['Individual_rank_score']))
                     variant_dict[variant_id]['Compounds'][compound_id] = compound_score
-                    compounds_list.append(compound_id+'='+str(compound_score))  
+                    compounds_list.append(variant_parser.get_variant_id(variant_dict[compound_id]) + 
+                                            '=' + str(compound_score))
             
             for model in variant_dict[variant_id]['Inheritance_model']:
                 if variant_dict[variant_id]['Inheritance_model'][model]:
@@ -89,14 +122,135 @@ class VariantConsumer(multiprocessing.Process):
             
         return
     
+    def process_batch(self, variant_batch, proc_name = None, family = None, annotation_scores = None):
+        """Check the models, score and prepare one batch for printing. Returns a dictionary with the variants.
+        
+        The annotation scores does not depend on the family, if a batch is checked for several families 
+        the same annotation_scores dictionary can be used for all of them.
+        """
+        if family is None:
+            family = self.family
+        if annotation_scores is None:
+            annotation_scores = {}
+        keys = {}
+        if self.score_cache_file:
+            if self.score_cache is None:
+                self.score_cache = score_cache.ScoreCache(self.score_cache_file, self.rank_model.version)
+            for gene in variant_batch:
+                keys.update(self.score_cache.get_keys(dict((variant_id, variant_batch[gene][variant_id]) 
+                                for variant_id in variant_batch[gene] if variant_id not in annotation_scores)))
+            annotation_scores.update(self.score_cache.get_scores(keys))
+        cached_ids = set(annotation_scores)
+        skip_models = ()
+        if self.prefilter and self.treshold is not None:
+            skip_models = self.prefilter_batch(variant_batch, annotation_scores)
+        genetic_models.check_genetic_models(variant_batch, family, self.verbosity, phased = self.phased, 
+                                                proc_name = proc_name, compounds = self.compounds, 
+                                                skip_models = skip_models, 
+                                                compound_checker = self.check_compound_pairs)
+        fixed_variants = self.fix_variants(variant_batch)
+        score_variants.score_batch(fixed_variants, family.models_of_inheritance, self.rank_model, 
+                                    annotation_scores)
+        if self.score_cache:
+            self.score_cache.add_scores(keys, dict((variant_id, annotation_scores[variant_id]) 
+                                            for variant_id in keys if variant_id not in cached_ids))
+        self.make_print_version(fixed_variants)
+        if self.treshold is not None:
+            for variant_id in list(fixed_variants):
+                if int(fixed_variants[variant_id]['Rank_score']) < self.treshold:
+                    del fixed_variants[variant_id]
+        return fixed_variants
+    
+    def check_compound_pairs(self, variants, compound_candidates, family, phased):
+        """Return the compound pairs of a gene. The pairs of big genes are split in tiles on the tile queue."""
+        tiles = pair_generator.get_row_tiles(len(compound_candidates), self.tile_size)
+        if self.tile_queue is None or len(tiles) < 2:
+            return genetic_models.get_compound_pairs(variants, compound_candidates, family, phased)
+        self.split_genes += 1
+        split_id = (os.getpid(), self.split_genes)
+        reader, writer = multiprocessing.Pipe(duplex=False)
+        # Only the information that check_compounds needs is sent with the tiles:
+        tile_variants = {}
+        for variant_id in compound_candidates:
+            tile_variants[variant_id] = {'Genotypes':variants[variant_id]['Genotypes']}
+            if 'Haploblocks' in variants[variant_id]:
+                tile_variants[variant_id]['Haploblocks'] = variants[variant_id]['Haploblocks']
+        for tile_number, (first_row, last_row) in enumerate(tiles):
+            self.tile_queue.put((split_id, writer, tile_number, tile_variants, compound_candidates, family, 
+                                    phased, first_row, last_row))
+        tile_pairs = {}
+        while len(tile_pairs) < len(tiles):
+            # We check tiles, our own or from other consumers, as long as there are any:
+            try:
+                tile = self.tile_queue.get_nowait()
+            except queue.Empty:
+                tile = None
+            if tile is not None:
+                if tile[0] == split_id:
+                    tile[1].close()
+                    tile_pairs[tile[2]] = check_tile(tile)
+                else:
+                    self.help_with_tile(tile)
+            while reader.poll(tile is None and TILE_POLL_INTERVAL or 0):
+                tile_number, pairs = reader.recv()
+                tile_pairs[tile_number] = pairs
+        reader.close()
+        writer.close()
+        # The pairs are merged in the same order as if the gene was checked in one piece
+        return [pair for tile_number in range(len(tiles)) for pair in tile_pairs[tile_number]]
+    
+    def help_with_tile(self, tile):
+        """Check a tile from another consumer and send the compound pairs back."""
+        writer = tile[1]
+        writer.send((tile[2], check_tile(tile)))
+        writer.close()
+    
+    def get_task(self):
+        """Return the next envelope from the task queue, the tiles on the tile queue are checked while waiting."""
+        if self.tile_queue is None:
+            return self.task_queue.get()
+        while True:
+            try:
+                self.help_with_tile(self.tile_queue.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            try:
+                return self.task_queue.get(timeout = TILE_POLL_INTERVAL)
+            except queue.Empty:
+                pass
+    
+    def prefilter_batch(self, variant_batch, annotation_scores):
+        """Return the ids of the common variants that can not get a rank score that reach the treshold.
+        
+        The frequency score is checked first, only for the common variants the whole annotation score is 
+        computed and added to annotation_scores. The rank score of a variant is never higher than the 
+        annotation score plus the highest inheritance score.
+        """
+        max_inheritance_score = max(self.rank_model.prefered_model_score, self.rank_model.followed_model_score, 
+                                        self.rank_model.no_model_score)
+        common_score = self.rank_model.common_score
+        low_variants = set()
+        for gene in variant_batch:
+            for variant_id in variant_batch[gene]:
+                variant = variant_batch[gene][variant_id]
+                if score_variants.get_frequency_score(variant, self.rank_model) != common_score:
+                    continue
+                if variant_id not in annotation_scores:
+                    annotation_scores[variant_id] = score_variants.get_annotation_score(variant, self.rank_model)
+                if annotation_scores[variant_id] + max_inheritance_score < self.treshold:
+                    low_variants.add(variant_id)
+        return low_variants
+    
     def run(self):
         """Run the consuming"""
         proc_name = self.name
         if self.verbosity:
             print(('%s Starting!' % proc_name))
         while True:
+            # An envelope is a list of batches.
             # A batch is a dictionary on the form {gene_1:{variant_id:variant_dict}, gene_2:{variant_id:variant_dict}}
-            next_batch = self.task_queue.get()
+            next_batch = self.get_task()
             # if self.verbosity:
             #     if self.results_queue.full():
             #         print('Batch results queue Full! %s' % proc_name)
@@ -105,18 +259,54 @@ class VariantConsumer(multiprocessing.Process):
             if next_batch is None:
                 self.task_queue.task_done()
                 if self.verbosity:
+                    cache_info = score_variants.annotation_cache_info()['score']
+                    print(('%s: Annotation cache hits: %s, misses: %s' % 
+                            (proc_name, cache_info['hits'], cache_info['misses'])))
                     print(('%s: Exiting' % proc_name))
+                if self.score_cache:
+                    self.score_cache.close()
                 break
-            genetic_models.check_genetic_models(next_batch, self.family, self.verbosity, proc_name = proc_name)
-            fixed_variants = self.fix_variants(next_batch)
-            score_variants.score_variant(fixed_variants, self.family.models_of_inheritance)
-            self.make_print_version(fixed_variants)
-            
-            self.results_queue.put(fixed_variants)
+            self.results_queue.put(self.process_envelope(next_batch, proc_name))
             self.task_queue.task_done()
         return
+    
+    def process_envelope(self, envelope, proc_name = None):
+        """Check all batches of an envelope for all families. Returns a dictionary on the form 
+        {family_id:{variant_id:variant_dict}}."""
+        envelope_variants = dict((family.family_id, {}) for family in self.families)
+        # The batches in an envelope are independent so they are checked one by one:
+        for batch in envelope:
+            # Variants from a variant store already have their annotation scores
+            annotation_scores = variant_store.get_annotation_scores(batch)
+            for family in self.families:
+                family_batch = batch
+                if len(self.families) > 1:
+                    family_batch = copy_batch(batch)
+                envelope_variants[family.family_id].update(self.process_batch(family_batch, proc_name, 
+                                                                family, annotation_scores))
+        return envelope_variants
         
     
+def check_tile(tile):
+    """Return the compound pairs of a tile from the tile queue."""
+    split_id, writer, tile_number, variants, compound_candidates, family, phased, first_row, last_row = tile
+    return genetic_models.get_compound_pairs(variants, compound_candidates, family, phased, first_row, last_row)
+
+def copy_batch(variant_batch):
+    """Return a copy of a batch that can be checked for one family without changing the original.
+    
+    The variant dictionaries are copied, a variant that is in several features is still the same 
+    dictionary in all of them. The genotypes are not changed by the checks so they are not copied.
+    """
+    copies = {}
+    batch_copy = {}
+    for feature in variant_batch:
+        batch_copy[feature] = {}
+        for variant_id in variant_batch[feature]:
+            if variant_id not in copies:
+                copies[variant_id] = dict(variant_batch[feature][variant_id])
+            batch_copy[feature][variant_id] = copies[variant_id]
+    return batch_copy
 
 def main():
     pass
@@ -18,11 +18,21 @@ import multiprocessing
 
 
 class VariantPrinter(multiprocessing.Process):
-    """docstring for VariantPrinter"""
-    def __init__(self, task_queue, outfile, head, verbosity=False):
+    """Print the results from the consumers, one file for each family.
+    
+    The results are dictionaries on the form {family_id:{variant_id:variant_dict}} and outfiles is a 
+    dictionary on the form {family_id:file}.
+    
+    If checkpoints is given the variants are printed to the part files of the checkpoints instead of the 
+    outfiles. A chromosome on the queue means that all results of that chromosome has been printed.
+    """
+    def __init__(self, task_queue, outfiles, head, verbosity=False, checkpoints=None):
         multiprocessing.Process.__init__(self)
         self.task_queue = task_queue
-        self.outfile = outfile
+        self.outfiles = outfiles
+        self.checkpoints = checkpoints
+        if checkpoints is not None:
+            self.outfiles = checkpoints.open_files()
         self.verbosity = verbosity
         self.header = head.header
     
@@ -41,16 +51,44 @@ class VariantPrinter(multiprocessing.Process):
             if next_result is None:
                 if self.verbosity:
                     print('All variants printed!')
-                self.outfile.close()
+                self.close()
                 break
+            elif isinstance(next_result, str):
+                self.finish_chromosome(next_result)
             else:
-                for variant_id in next_result:
-                    try:
-                        print_line = [next_result[variant_id].get(entry, '-') for entry in self.header]
-                        self.outfile.write('\t'.join(print_line) + '\n')
-                    except TypeError as e:
-                        print((next_result[variant_id]))
-                        print(e)
+                self.print_results(next_result)
+        return
+    
+    def finish_chromosome(self, chromosome):
+        """Save the results of a chromosome if there are checkpoints."""
+        if self.checkpoints is not None:
+            self.outfiles = self.checkpoints.finish(chromosome, self.outfiles)
+        return
+    
+    def close(self):
+        """Close the outfiles"""
+        if self.checkpoints is not None:
+            self.checkpoints.close(self.outfiles)
+        else:
+            for outfile in self.outfiles.values():
+                outfile.close()
+        return
+    
+    def print_results(self, results):
+        """Write the variants of one result to the files of the families."""
+        for family_id in results:
+            family_variants = results[family_id]
+            outfile = self.outfiles[family_id]
+            for variant_id in family_variants:
+                try:
+                    print_line = [family_variants[variant_id].get(entry, '-') for entry in self.header]
+                    # Columns that are not used by the analysis may still be bytes if the file was mmaped
+                    print_line = [entry.decode('utf-8') if isinstance(entry, bytes) else entry 
+                                    for entry in print_line]
+                    outfile.write(('\t'.join(print_line) + '\n').encode('utf-8'))
+                except TypeError as e:
+                    print((family_variants[variant_id]))
+                    print(e)
         return
 
 def main():
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+variant_store.py
+
+Save the parsed variants of a variant file so that the file can be checked again with a new pedigree.
+
+Parsing, annotating and the annotation part of the rank score do not depend on the pedigree. The store holds
+the header lines of the variant file and the envelopes from the parser, with the genotypes as codes and the
+annotation score of each variant. When a family is checked from the store only the genetic models and the
+inheritance part of the rank score are computed.
+
+The store is a pickle stream, the metadata followed by one pickle for each envelope. The metadata holds the
+size, modification time and sha1 of the variant file and the settings that change the parsing, a store is
+only read if they are the same.
+"""
+
+import sys
+import os
+import pickle
+import argparse
+
+from Mip_Family_Analysis.Variants import genotype
+from Mip_Family_Analysis.Models import score_variants
+from Mip_Family_Analysis.Utils import header_parser, checkpoint
+
+# Change this if the format of the store changes
+STORE_VERSION = '1'
+# The key of the annotation score in the variants from the store
+ANNOTATION_SCORE = 'Annotation_score'
+
+def get_header_lines(variant_file):
+    """Return the header lines of a variant file."""
+    header_lines = []
+    with open(variant_file, 'r') as f:
+        for line in f:
+            if not line.startswith('#'):
+                break
+            header_lines.append(line)
+    return header_lines
+
+def get_annotation_scores(batch):
+    """Return the annotation scores of the variants in a batch that has them: {variant_id:annotation_score}."""
+    annotation_scores = {}
+    for gene in batch:
+        for variant_id in batch[gene]:
+            if ANNOTATION_SCORE in batch[gene][variant_id]:
+                annotation_scores[variant_id] = batch[gene][variant_id][ANNOTATION_SCORE]
+    return annotation_scores
+
+class VariantStoreWriter(object):
+    """Write the envelopes of a variant file to a store.
+
+    The envelopes are written to a temporary file that replaces the store when close is called, so a store
+    from a run that died is never read. abort removes the temporary file.
+    """
+    def __init__(self, store_file, variant_file, individuals, rank_model = score_variants.default_rank_model,
+                    settings = None):
+        super(VariantStoreWriter, self).__init__()
+        self.store_file = store_file
+        self.individuals = list(individuals)
+        self.rank_model = rank_model
+        self.temp_file = store_file + '.%s.tmp' % os.getpid()
+        stat = os.stat(variant_file)
+        metadata = {'version':STORE_VERSION,
+                    'variant_file':{'size':stat.st_size, 'mtime':stat.st_mtime_ns,
+                                    'sha1':checkpoint.get_file_hash(variant_file)},
+                    'header_lines':get_header_lines(variant_file),
+                    'individuals':self.individuals,
+                    'rank_model':rank_model.version,
+                    'settings':settings or {}}
+        self.store = open(self.temp_file, 'wb')
+        pickle.dump(metadata, self.store, pickle.HIGHEST_PROTOCOL)
+
+    def add_envelope(self, envelope):
+        """Add the annotation scores to the variants of an envelope and write it to the store.
+
+        A variant is written as the names and values of its columns, with the annotation score, and a tuple
+        with the genotype code of each individual. The envelope is written as a list of batches on the form
+        {gene:[variant_id]} and a dictionary with the variants.
+        """
+        batches = []
+        variants = {}
+        # Variants with the same columns share the tuple with the names, then it is only pickled once:
+        column_names = {}
+        for batch in envelope:
+            batch_variants = {}
+            for gene in batch:
+                batch_variants.update(batch[gene])
+            annotation_scores = score_variants.add_annotation_scores(batch_variants, self.rank_model,
+                                                    get_annotation_scores(batch))
+            for variant_id in batch_variants:
+                variant = batch_variants[variant_id]
+                variant[ANNOTATION_SCORE] = annotation_scores[variant_id]
+                names = tuple(key for key in variant if key != 'Genotypes')
+                names = column_names.setdefault(names, names)
+                values = tuple(variant[key] for key in names)
+                codes = tuple(variant['Genotypes'][individual].genotype for individual in self.individuals)
+                variants[variant_id] = (names, values, codes)
+            batches.append(dict((gene, list(batch[gene])) for gene in batch))
+        pickle.dump((batches, variants), self.store, pickle.HIGHEST_PROTOCOL)
+
+    def write_envelopes(self, envelopes):
+        """Write the envelopes to the store while they are yielded, the store is closed after the last one.
+
+        If the envelopes are not all written, because of an error or because the rest was not asked for, the
+        temporary file is removed and the store is not changed.
+        """
+        finished = False
+        try:
+            for envelope in envelopes:
+                self.add_envelope(envelope)
+                yield envelope
+            finished = True
+        finally:
+            if finished:
+                self.close()
+            else:
+                self.abort()
+
+    def close(self):
+        """Close the store and put it in place."""
+        self.store.close()
+        os.replace(self.temp_file, self.store_file)
+
+    def abort(self):
+        """Close the store and remove the temporary file."""
+        self.store.close()
+        if os.path.exists(self.temp_file):
+            os.remove(self.temp_file)
+
+class VariantStore(object):
+    """Read the envelopes from a store."""
+    def __init__(self, store_file):
+        super(VariantStore, self).__init__()
+        self.store_file = store_file
+        with open(store_file, 'rb') as f:
+            self.metadata = pickle.load(f)
+        self.head = header_parser.HeaderParser(lines = self.metadata['header_lines'])
+        self.individuals = self.metadata['individuals']
+
+    def matches(self, variant_file, settings = None):
+        """Return True if the store is from the variant file and was written with the same settings.
+
+        The variant file is only hashed if its modification time is not the same as when the store was written.
+        """
+        if self.metadata.get('version') != STORE_VERSION or self.metadata['settings'] != (settings or {}):
+            return False
+        info = self.metadata['variant_file']
+        stat = os.stat(variant_file)
+        if stat.st_size != info['size']:
+            return False
+        return stat.st_mtime_ns == info['mtime'] or checkpoint.get_file_hash(variant_file) == info['sha1']
+
+    def get_envelopes(self, rank_model_version = None, skip_chromosomes = None):
+        """Yield the envelopes of the store.
+
+        The annotation scores are removed if the store was written with another rank model. The envelopes
+        of the chromosomes in skip_chromosomes are not yielded.
+        """
+        skip_chromosomes = set(skip_chromosomes or [])
+        keep_scores = rank_model_version is None or rank_model_version == self.metadata['rank_model']
+        # The genotypes are not changed by the checks so variants with the same genotype code can share it
+        genotypes = {}
+        with open(self.store_file, 'rb') as f:
+            pickle.load(f)
+            while True:
+                try:
+                    batches, variants = pickle.load(f)
+                except EOFError:
+                    break
+                envelope_variants = {}
+                for variant_id in variants:
+                    names, values, codes = variants[variant_id]
+                    columns = dict(zip(names, values))
+                    if not keep_scores:
+                        columns.pop(ANNOTATION_SCORE, None)
+                    columns['Genotypes'] = {}
+                    for individual, code in zip(self.individuals, codes):
+                        if code not in genotypes:
+                            genotypes[code] = genotype.Genotype(GT=code)
+                        columns['Genotypes'][individual] = genotypes[code]
+                    envelope_variants[variant_id] = columns
+                envelope = [dict((gene, dict((variant_id, envelope_variants[variant_id])
+                                    for variant_id in batch[gene])) for gene in batch) for batch in batches]
+                if checkpoint.get_chromosome(envelope) not in skip_chromosomes:
+                    yield envelope
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the metadata of a variant store.")
+    parser.add_argument('store_file', type=str, nargs=1, help='A variant store.')
+    args = parser.parse_args()
+    store = VariantStore(args.store_file[0])
+    for key in ['version', 'variant_file', 'individuals', 'rank_model', 'settings']:
+        print(('%s: %s' % (key, store.metadata[key])))
+
+if __name__ == '__main__':
+    main()
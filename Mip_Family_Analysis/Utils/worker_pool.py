@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+worker_pool.py
+
+Find the number of cpus that the analysis may use and start the workers that check the variants.
+
+The number of cpus is the smallest of the cpus that the process is allowed to run on (sched_getaffinity) and
+the cpu quota of the cgroup, if there is one.
+
+A WorkerPool can be given to the VariantFileParser as the batch queue. If it is adaptive only one worker is
+started, a new worker is started when the queue is filling up, that is when the parser is faster than the
+workers. A run where the parser is the bottleneck does not start workers that would only wait for envelopes.
+"""
+
+import sys
+import os
+import math
+import argparse
+from multiprocessing import cpu_count
+
+# The number of envelopes on the queue for each worker if no queue size is given
+ENVELOPES_PER_WORKER = 8
+
+def get_cgroup_cpu_limit(cgroup_root = '/sys/fs/cgroup'):
+    """Return the number of cpus that the cgroup quota allows, None if there is no quota."""
+    try:
+        # cgroup v2, the file holds '<quota> <period>' or 'max <period>'
+        with open(os.path.join(cgroup_root, 'cpu.max'), 'r') as f:
+            quota, period = f.read().split()[:2]
+        if quota == 'max':
+            return None
+        quota, period = int(quota), int(period)
+    except (IOError, OSError, ValueError):
+        try:
+            # cgroup v1, a quota of -1 means no limit
+            with open(os.path.join(cgroup_root, 'cpu', 'cpu.cfs_quota_us'), 'r') as f:
+                quota = int(f.read())
+            with open(os.path.join(cgroup_root, 'cpu', 'cpu.cfs_period_us'), 'r') as f:
+                period = int(f.read())
+        except (IOError, OSError, ValueError):
+            return None
+    if quota <= 0 or period <= 0:
+        return None
+    return max(1, int(math.ceil(quota / period)))
+
+def get_available_cpus():
+    """Return the number of cpus that this process can use."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        # sched_getaffinity is only on some platforms
+        cpus = cpu_count()
+    cgroup_limit = get_cgroup_cpu_limit()
+    if cgroup_limit:
+        cpus = min(cpus, cgroup_limit)
+    return max(1, cpus)
+
+def get_queue_size(workers, queue_size = None):
+    """Return the size of the variant queue."""
+    return queue_size or ENVELOPES_PER_WORKER * workers
+
+class WorkerPool(object):
+    """Start the workers and put the envelopes on their queue.
+
+    make_worker is a function that returns a new worker that is not started. If adaptive is True the pool
+    starts with one worker and adds workers, up to max_workers, when the queue is at least half full.
+    """
+    def __init__(self, task_queue, make_worker, max_workers, queue_size, adaptive = False, verbosity = False):
+        super(WorkerPool, self).__init__()
+        self.task_queue = task_queue
+        self.make_worker = make_worker
+        self.max_workers = max_workers
+        self.queue_size = queue_size
+        self.adaptive = adaptive
+        self.verbosity = verbosity
+        self.workers = []
+        self.envelopes = 0
+        # A new worker needs some time to start, the queue is not checked again until this many envelopes:
+        self.growth_interval = max(1, queue_size // 4)
+        self.last_growth = 0
+
+    def add_worker(self):
+        """Start one more worker"""
+        worker = self.make_worker()
+        worker.start()
+        self.workers.append(worker)
+        self.last_growth = self.envelopes
+        if self.verbosity:
+            print(('Number of workers: %s' % len(self.workers)))
+
+    def start(self):
+        """Start the workers"""
+        for i in range(self.adaptive and 1 or self.max_workers):
+            self.add_worker()
+
+    def put(self, envelope):
+        """Put an envelope on the queue and add a worker if the workers are not keeping up."""
+        self.task_queue.put(envelope)
+        self.envelopes += 1
+        if (self.adaptive and len(self.workers) < self.max_workers and
+                self.envelopes - self.last_growth >= self.growth_interval):
+            try:
+                queue_depth = self.task_queue.qsize()
+            except NotImplementedError:
+                # qsize does not work on all platforms, then we use all workers
+                queue_depth = self.queue_size
+            if queue_depth >= self.queue_size // 2:
+                self.add_worker()
+
+    def join(self):
+        """Wait until all envelopes on the queue are checked."""
+        self.task_queue.join()
+    
+    def stop(self):
+        """Tell the workers to stop and wait until all envelopes are checked."""
+        for worker in self.workers:
+            self.task_queue.put(None)
+        self.task_queue.join()
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the number of cpus that the analysis can use.")
+    args = parser.parse_args()
+    print(('Cpus: %s, available: %s, cgroup limit: %s' % (cpu_count(), get_available_cpus(), get_cgroup_cpu_limit())))
+
+if __name__ == '__main__':
+    main()
@@ -17,24 +17,112 @@ import sys
 import os
 import argparse
 import re
+import collections
 
 from pprint import pprint as pp
 from datetime import datetime
 
 from Mip_Family_Analysis.Variants import genotype
+from Mip_Family_Analysis.Models import score_variants
+from Mip_Family_Analysis.Utils import mmap_reader, sweep_annotator
+
+# These are the columns that the parser needs to make a variant:
+parser_columns = ['Chromosome', 'Variant_start', 'Reference_allele', 'Alternative_allele', 'HGNC_symbol']
+vcf_columns = ['CHROM', 'POS', 'REF', 'ALT', 'INFO', 'FORMAT']
 
 class VariantFileParser(object):
-    """docstring for VariantParser"""
-    def __init__(self, variant_file, batch_queue, head, verbosity = False):
+    """Parse a variant file and put the variants in batches on the batch queue.
+    
+    A batch holds all variants of a region with overlapping features. If max_batch_size is given
+    batches are split when they reach that number of variants. Intergenic batches are always split,
+    batches with genes are only split if split_genes is True, that is when compounds are not checked.
+    
+    Batches are put on the queue in envelopes, that is lists of independent batches. Small batches 
+    are packed together until the envelope holds at least envelope_size variants.
+    
+    reader is 'text', 'mmap' or 'lines'. With 'mmap' the file is read as bytes and only the columns that 
+    are used by the parser, the genetic models and the scoring are decoded. With 'lines' variant_file 
+    is an iterable with the lines of a variant file.
+    
+    annotations is an AnnotationParser. If given, the variants without a HGNC_symbol, or with '-', get 
+    the genes that they overlap in the annotations.
+    
+    If phased is True each variant gets a dictionary 'Haploblocks' on the form {ind_id:haploblock_id} 
+    with the individuals that have a phased genotype. The haploblock ids are integers, variants with the 
+    same id for an individual are phased together. The phase set is taken from the PS field, phased 
+    genotypes without a PS are in the same phase set as all other on the chromosome.
+    
+    The variants on the chromosomes in skip_chromosomes are not parsed. If split_chromosomes is True the 
+    batches and envelopes never hold variants from more than one chromosome.
+    """
+    def __init__(self, variant_file, batch_queue, head, verbosity = False, max_batch_size = None, 
+                    split_genes = False, envelope_size = 1, reader = 'text', annotations = None, phased = False, 
+                    skip_chromosomes = None, split_chromosomes = False):
         super(VariantFileParser, self).__init__()
         self.variant_file = variant_file
         self.batch_queue = batch_queue
         self.verbosity = verbosity
         self.individuals = head.individuals
         self.header_line = head.header
+        self.file_type = head.file_type
+        # The position of GT for each FORMAT string that we have seen: {<format>:<position>}
+        self.gt_positions = {}
+        self.ps_positions = {}
+        self.phased = phased
+        # The haploblock ids: {(<chrom>, <ind_id>, <phase_set>):<haploblock_id>}
+        self.haploblock_ids = {}
+        self.max_batch_size = max_batch_size
+        self.split_genes = split_genes
+        self.envelope_size = envelope_size
+        self.envelope = []
+        self.envelope_variants = 0
+        # The envelopes that are full but not yet sent
+        self.envelopes = collections.deque()
+        self.variant_count = 0
+        self.reader = reader
+        self.skip_chromosomes = set(skip_chromosomes or [])
+        self.split_chromosomes = split_chromosomes
+        self.annotator = None
+        if annotations is not None:
+            self.annotator = sweep_annotator.SweepAnnotator(annotations)
+        # These are the positions of the columns that must be strings when we parse a variant:
+        used_columns = set(parser_columns) | set(vcf_columns) | set(score_variants.scoring_columns)
+        used_columns |= set(self.individuals)
+        self.decode_positions = [position for position, column in enumerate(self.header_line) 
+                                    if column in used_columns or column.startswith('IDN:')]
+    
+    def get_variant_lines(self):
+        """Yield the variant lines of the file splitted on tabs."""
+        if self.reader == 'mmap':
+            decode_positions = self.decode_positions
+            for line in mmap_reader.mmap_lines(self.variant_file):
+                if not line.startswith(b'#'):
+                    variant_line = line.rstrip().split(b'\t')
+                    try:
+                        for position in decode_positions:
+                            variant_line[position] = variant_line[position].decode()
+                    except IndexError:
+                        # A short line, the missing columns are left out just as with the text reader
+                        pass
+                    yield variant_line
+        elif self.reader == 'lines':
+            for line in self.variant_file:
+                if not line.startswith('#'):
+                    yield line.rstrip().split('\t')
+        else:
+            with open(self.variant_file, 'r') as f:
+                for line in f:
+                    if not line.startswith('#'):
+                        yield line.rstrip().split('\t')
     
     def parse(self):
-        """Start the parsing"""        
+        """Start the parsing"""
+        for envelope in self.get_envelopes():
+            self.batch_queue.put(envelope)
+        return
+    
+    def get_envelopes(self):
+        """Parse the variants and yield the envelopes as soon as they are full."""
         start_parsing = datetime.now()
         start_chrom = start_parsing
         start_twenty = start_parsing
@@ -43,69 +131,128 @@ class VariantFileParser(object):
         new_chrom = None
         current_chrom = None
         current_features = []
+        last_chrom = None
         nr_of_variants = 0
+        batch_size = 0
         if self.verbosity:
             print('Start parsing the variants ...\n')
-        with open(self.variant_file, 'rb') as f:
-            for line in f:
-                if not line.startswith('#'):
-                    variant_line = line.rstrip().split('\t')
-                    variant, new_features = self.cmms_variant(variant_line, self.individuals)
-                    if self.verbosity:
-                        nr_of_variants += 1
-                        new_chrom = variant['Chromosome']
-                        if nr_of_variants % 20000 == 0:
-                            print(('%s variants parsed!' % str(nr_of_variants)))
-                            print(('Last 20.000 took %s to parse. \n' % str(datetime.now() - start_twenty)))
-                            start_twenty = datetime.now()
-                    # If we look at the first variant, setup boundary conditions:
-                    if beginning:
-                        current_features = new_features
-                        beginning = False
-                        # Add the variant to each of its features in a batch
-                        batch = self.add_variant(batch, variant, new_features)
-                        if self.verbosity:
-                            current_chrom = new_chrom
-                    else:
-                        send = True
-                    
-                    # Check if we are in a space between features:
-                        if len(new_features) == 0:
-                            if len(current_features) == 0:
-                                send = False
-                    #If not check if we are in a consecutive region
-                        elif len(set.intersection(set(new_features),set(current_features))) > 0:
-                            send = False
-                        
-                        if send:
-                            # If there is an intergenetic region we do not look at the compounds.
-                            # The tasks are tuples like (variant_list, bool(if compounds))
-                            self.batch_queue.put(batch)
-                            current_features = new_features
-                            batch = self.add_variant({}, variant, new_features)
-                        else:
-                            current_features = list(set(current_features) | set(new_features))
-                            batch = self.add_variant(batch, variant, new_features) # Add variant batch
-                    
-                    if self.verbosity:
-                        if new_chrom != current_chrom:
-                            print(('Chromosome %s parsed!' % current_chrom))
-                            print(('Time to parse chromosome %s' % str(datetime.now()-start_chrom)))
-                            current_chrom = new_chrom
-                            start_chrom = datetime.now()
-                        
+        if self.file_type == 'vcf':
+            get_variant = self.vcf_variant
+        else:
+            get_variant = self.cmms_variant
+        for variant_line in self.get_variant_lines():
+            variant, new_features = get_variant(variant_line, self.individuals)
+            if variant['Chromosome'] in self.skip_chromosomes:
+                continue
+            # Send what we have before the first variant of a new chromosome:
+            if self.split_chromosomes and variant['Chromosome'] != last_chrom:
+                if len(batch) > 0:
+                    self.send_batch(batch, batch_size)
+                self.send_envelope()
+                batch = {}
+                batch_size = 0
+                beginning = True
+                last_chrom = variant['Chromosome']
+            if self.annotator and variant.get('HGNC_symbol', '-') in ['-', '']:
+                new_features = self.annotate_variant(variant)
+            if self.verbosity:
+                nr_of_variants += 1
+                new_chrom = variant['Chromosome']
+                if nr_of_variants % 20000 == 0:
+                    print(('%s variants parsed!' % str(nr_of_variants)))
+                    print(('Last 20.000 took %s to parse. \n' % str(datetime.now() - start_twenty)))
+                    start_twenty = datetime.now()
+            # If we look at the first variant, setup boundary conditions:
+            if beginning:
+                current_features = new_features
+                beginning = False
+                # Add the variant to each of its features in a batch
+                batch = self.add_variant(batch, variant, new_features)
+                batch_size = 1
+                if self.verbosity and current_chrom is None:
+                    current_chrom = new_chrom
+            else:
+                send = True
+            
+            # Check if we are in a space between features:
+                if len(new_features) == 0:
+                    if len(current_features) == 0:
+                        send = False
+            #If not check if we are in a consecutive region
+                elif len(set.intersection(set(new_features),set(current_features))) > 0:
+                    send = False
+                
+                if send:
+                    # If there is an intergenetic region we do not look at the compounds.
+                    # The tasks are tuples like (variant_list, bool(if compounds))
+                    self.send_batch(batch, batch_size)
+                    current_features = new_features
+                    batch = self.add_variant({}, variant, new_features)
+                    batch_size = 1
+                else:
+                    current_features = list(set(current_features) | set(new_features))
+                    batch = self.add_variant(batch, variant, new_features) # Add variant batch
+                    batch_size += 1
+            
+            # Split the batch if it has grown too big and it is safe to do so:
+            if self.max_batch_size and batch_size >= self.max_batch_size:
+                if len(current_features) == 0 or self.split_genes:
+                    self.send_batch(batch, batch_size)
+                    batch = {}
+                    batch_size = 0
+                    beginning = True
+            
+            if self.verbosity:
+                if new_chrom != current_chrom:
+                    print(('Chromosome %s parsed!' % current_chrom))
+                    print(('Time to parse chromosome %s' % str(datetime.now()-start_chrom)))
+                    current_chrom = new_chrom
+                    start_chrom = datetime.now()
+            
+            while self.envelopes:
+                yield self.envelopes.popleft()
+                
         if self.verbosity:
             print(('Chromosome %s parsed!' % current_chrom))
             print(('Time to parse chromosome %s \n' % str(datetime.now()-start_chrom)))
             print(('Variants done!. Time to parse variants: %s \n' % str(datetime.now() - start_parsing)))
-        self.batch_queue.put(batch)
-        
+        if len(batch) > 0:
+            self.send_batch(batch, batch_size)
+        self.send_envelope()
+        while self.envelopes:
+            yield self.envelopes.popleft()
+    
+    def annotate_variant(self, variant):
+        """Return the genes that a variant overlaps in the annotations and add them to the variant."""
+        start = int(variant['Variant_start'])
+        stop = start + max(len(variant['Reference_allele']) - 1, 0)
+        features = self.annotator.get_features(variant['Chromosome'], start, stop)
+        if len(features) > 0:
+            variant['HGNC_symbol'] = ','.join(features)
+        return features
+    
+    def send_batch(self, batch, batch_size):
+        """Add a batch to the envelope and put the envelope on the queue if it is full."""
+        self.envelope.append(batch)
+        self.envelope_variants += batch_size
+        if self.envelope_variants >= self.envelope_size:
+            self.send_envelope()
+        return
+    
+    def send_envelope(self):
+        """Add the envelope to the envelopes that are ready and start a new one."""
+        if len(self.envelope) > 0:
+            self.envelopes.append(self.envelope)
+        self.envelope = []
+        self.envelope_variants = 0
         return
     
     def add_variant(self, batch, variant, features):
-        """Adds the variant to the proper gene(s) in the batch."""
-        variant_id = [variant['Chromosome'], variant['Variant_start'], variant['Reference_allele'], variant['Alternative_allele']]
-        variant_id = '_'.join(variant_id)
+        """Adds the variant to the proper gene(s) in the batch.
+        
+        Internally variants are identified by their number in the file, use get_variant_id for the printed id."""
+        variant_id = self.variant_count
+        self.variant_count += 1
         if len(features) == 0:
             if len(batch) == 0:
                 batch['-'] = {variant_id:variant}
@@ -143,6 +290,8 @@ class VariantFileParser(object):
         features_overlapped = self.get_genes(variant['HGNC_symbol'], 'HGNC')
         
         variant['Genotypes'] = {}
+        if self.phased:
+            variant['Haploblocks'] = {}
         
         for individual in individuals:
             try:
@@ -151,9 +300,114 @@ class VariantFileParser(object):
                 gt_info = './.'
             
             variant['Genotypes'][individual] = genotype.Genotype(GT=gt_info)
+            if self.phased and '|' in gt_info:
+                variant['Haploblocks'][individual] = self.get_haploblock(variant['Chromosome'], individual)
         
         return variant, features_overlapped
     
+    def vcf_variant(self, splitted_variant_line, individuals):
+        """Returns a variant object from a vcf line, with the same keys as a variant in the cmms format."""
+        
+        variant = dict(list(zip(self.header_line, splitted_variant_line)))
+        
+        if variant['CHROM'].startswith('chr'):
+            variant['Chromosome'] = variant['CHROM'][3:]
+        else:
+            variant['Chromosome'] = variant['CHROM']
+        variant['Variant_start'] = variant['POS']
+        variant['Reference_allele'] = variant['REF']
+        variant['Alternative_allele'] = variant['ALT']
+        
+        # The annotations in the INFO field are used like the columns of a cmms file:
+        for info_entry in variant.get('INFO', '.').split(';'):
+            info_key, separator, info_value = info_entry.partition('=')
+            if info_key not in variant:
+                variant[info_key] = info_value
+        
+        # Get the genes:
+        features_overlapped = []
+        if 'HGNC_symbol' in variant:
+            features_overlapped = self.get_genes(variant['HGNC_symbol'], 'HGNC')
+        
+        variant['Genotypes'] = {}
+        
+        gt_position = self.get_gt_position(variant.get('FORMAT', ''))
+        if self.phased:
+            variant['Haploblocks'] = {}
+            ps_position = self.get_ps_position(variant.get('FORMAT', ''))
+        
+        for individual in individuals:
+            gt_info = None
+            if gt_position is not None:
+                gt_info = get_format_value(variant.get(individual, ''), gt_position)
+            if not gt_info:
+                gt_info = './.'
+            
+            variant['Genotypes'][individual] = genotype.Genotype(GT=gt_info)
+            if self.phased and '|' in gt_info:
+                phase_set = None
+                if ps_position is not None:
+                    phase_set = get_format_value(variant.get(individual, ''), ps_position)
+                variant['Haploblocks'][individual] = self.get_haploblock(variant['Chromosome'], individual, phase_set)
+        
+        return variant, features_overlapped
+    
+    def get_haploblock(self, chrom, individual, phase_set = None):
+        """Return the haploblock id of a phased genotype."""
+        if not phase_set or phase_set == '.':
+            phase_set = '.'
+        key = (chrom, individual, phase_set)
+        try:
+            return self.haploblock_ids[key]
+        except KeyError:
+            haploblock_id = len(self.haploblock_ids)
+            self.haploblock_ids[key] = haploblock_id
+            return haploblock_id
+    
+    def get_ps_position(self, format_string):
+        """Return the position of PS in a FORMAT string or None if PS is missing."""
+        try:
+            return self.ps_positions[format_string]
+        except KeyError:
+            format_keys = format_string.split(':')
+            ps_position = None
+            if 'PS' in format_keys:
+                ps_position = format_keys.index('PS')
+            self.ps_positions[format_string] = ps_position
+            return ps_position
+    
+    def get_gt_position(self, format_string):
+        """Return the position of GT in a FORMAT string or None if GT is missing."""
+        try:
+            return self.gt_positions[format_string]
+        except KeyError:
+            format_keys = format_string.split(':')
+            gt_position = None
+            if 'GT' in format_keys:
+                gt_position = format_keys.index('GT')
+            self.gt_positions[format_string] = gt_position
+            return gt_position
+    
+
+def get_variant_id(variant):
+    """Return the id that is printed for a variant, on the form chrom_start_ref_alt.
+
+    The chromosome is the printed one, the 'chr' prefix of a vcf is only removed from 'Chromosome'."""
+    return '_'.join([variant.get('CHROM', variant['Chromosome']), variant['Variant_start'], variant['Reference_allele'], 
+                        variant['Alternative_allele']])
+
+def get_format_value(sample_string, position):
+    """Return the value at a position of a sample field in a vcf, without splitting the whole field."""
+    start = 0
+    for i in range(position):
+        start = sample_string.find(':', start) + 1
+        if start == 0:
+            return None
+    end = sample_string.find(':', start)
+    if end == -1:
+        return sample_string[start:]
+    return sample_string[start:end]
+    
 
 
 def main():
@@ -168,17 +422,17 @@ def main():
     
     infile = args.variant_file[0]
     
-    annotation_trees = {}
+    annotations = None
     if args.annotation:
         print('Parsing annotation:')
-        annotation_trees = annotation_parser.AnnotationParser(args.annotation[0], 'ref_gene')
+        annotations = annotation_parser.AnnotationParser(args.annotation[0], 'ref_gene')
         print('Annotation parsed.')
         
     head = header_parser.HeaderParser(infile)
     file_type = 'cmms'
     variant_queue = JoinableQueue()
     start_time = datetime.now()
-    my_parser = VariantFileParser(infile, variant_queue, head, annotation_trees, args.verbose)
+    my_parser = VariantFileParser(infile, variant_queue, head, args.verbose, annotations = annotations)
     my_parser.parse()
     # print(('Time to parse variants: %s' % (datetime.now()-start_time)))
 
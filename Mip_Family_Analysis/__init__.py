@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+__init__.py
+
+Package version lookup.
+"""
+
+from functools import lru_cache
+
+@lru_cache(maxsize=None)
+def get_version():
+    """Return the version of the installed package, 'unknown' if it is not installed.
+    
+    importlib.metadata is much faster to import than pkg_resources, the version is only looked up once."""
+    try:
+        from importlib import metadata
+    except ImportError:
+        # Before python 3.8
+        import pkg_resources
+        try:
+            return pkg_resources.require('Mip_Family_Analysis')[0].version
+        except pkg_resources.DistributionNotFound:
+            return 'unknown'
+    try:
+        return metadata.version('Mip_Family_Analysis')
+    except metadata.PackageNotFoundError:
+        return 'unknown'
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+mip_family_analysis_client.py
+
+Submit a job to a server started with run_mip_family_analysis_server.py and wait until it is finished.
+"""
+
+import sys
+import os
+import argparse
+import json
+
+from Mip_Family_Analysis.Utils import analysis_server
+
+def main():
+    parser = argparse.ArgumentParser(description="Submit a job to an analysis server.")
+
+    parser.add_argument('socket',
+        type=str, nargs=1,
+        help='The path to the unix domain socket of the server.'
+    )
+    parser.add_argument('family_file',
+        type=str, nargs='?',
+        help='A pedigree file.'
+    )
+    parser.add_argument('variant_file',
+        type=str, nargs='?',
+        help='A variant file.'
+    )
+    parser.add_argument('-o', '--outfile',
+        type=str, nargs=1, default=[None],
+        help='Specify the path to output, if no file specified the output will be printed to screen. With several families the family id is added to the file name.'
+    )
+    parser.add_argument('-stats', '--stats',
+        action="store_true",
+        help='Print the queue and latency statistics of the server.'
+    )
+    parser.add_argument('-stop', '--shutdown',
+        action="store_true",
+        help='Stop the server when the jobs that are submitted are finished.'
+    )
+
+    args = parser.parse_args()
+    socket_path = args.socket[0]
+
+    if args.stats:
+        print(json.dumps(analysis_server.get_stats(socket_path), indent=2, sort_keys=True))
+        return
+    if args.shutdown:
+        analysis_server.stop_server(socket_path)
+        return
+    if not (args.family_file and args.variant_file):
+        parser.error('A family file and a variant file are needed to submit a job')
+
+    outfile = args.outfile[0]
+    for message in analysis_server.submit_job(socket_path, args.family_file, args.variant_file, outfile,
+                                                stream = not outfile):
+        if 'line' in message:
+            print(message['line'])
+        elif message.get('status') == 'failed':
+            sys.stderr.write('Job failed: %s\n' % message['error'])
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
+
@@ -12,89 +12,29 @@ Copyright (c) 2013 __MyCompanyName__. All rights reserved.
 import sys
 import os
 import argparse
-import shelve
-from multiprocessing import Manager, JoinableQueue, cpu_count, Lock
+from multiprocessing import Manager, JoinableQueue, Queue, cpu_count
 from codecs import open
 
 from tempfile import NamedTemporaryFile
 
 from datetime import datetime
-import pkg_resources
-from pprint import pprint as pp
-
-from ped_parser import parser
 
+from Mip_Family_Analysis import get_version
 from Mip_Family_Analysis.Variants import variant_parser
-from Mip_Family_Analysis.Models import genetic_models, score_variants
-from Mip_Family_Analysis.Utils import variant_consumer, variant_sorter, header_parser, variant_printer
+from Mip_Family_Analysis.Models import rank_model
+from Mip_Family_Analysis.Utils import (variant_consumer, variant_sorter, header_parser, variant_printer, worker_pool, 
+                                        checkpoint, variant_store)
+from Mip_Family_Analysis.Utils.analysis import (get_families, check_individuals, add_cmms_metadata, get_outfile, 
+                                                    print_headers)
 
-def get_family(args):
-    """Return the family"""
-    
-    family_type = 'mip'
-    
-    if args.cmms:
-        family_type = 'cmms'
-    
-    family_file = args.family_file[0]
-    
-    my_family_parser = parser.FamilyParser(family_file, family_type)
-    # Stupid thing but for now when we only look at one family
-    return my_family_parser.families.popitem()[1]
+# Variant files smaller than this, in bytes, are checked in one process if the number of workers is not given
+INLINE_FILE_SIZE = 1000000
 
 def get_header(variant_file):
     """Return a fixed header parser"""
     head = header_parser.HeaderParser(variant_file)
     return head
 
-def add_cmms_metadata(header_object):
-    """Add the necessary metadata and header columns that this software operates on."""
-
-    header_object.add_metadata('Inheritance_model', data_type='String', 
-        description='Variant inheritance pattern.', 
-        dbname='Inheritance Model', delimiter='\t'
-    )
-    header_object.add_metadata('Individual_rank_score', data_type='Integer', 
-        description='Rank score of disease casuing potential. Higher the more likely disease casuing.', 
-        dbname='Individual Rank Score', delimiter='\t'
-    )
-    header_object.add_metadata('Compounds', data_type='String', 
-        description='List of the compound pairs(if any).', 
-        dbname='Compounds', delimiter='\t'
-    )
-    header_object.add_metadata('Rank_score', data_type='Integer', 
-        description='This is the correct rank score if the variant only follows the AR_comp model.', 
-        dbname='Rank Score', delimiter='\t'
-    )
-    
-    header_object.add_header('Inheritance_model')
-    header_object.add_header('Individual_rank_score')
-    header_object.add_header('Compounds')
-    header_object.add_header('Rank_score')
-    return
-
-def print_headers(args, header_object):
-    """Print the headers to a results file."""
-    lines_to_print = header_object.get_headers_for_print()
-    if args.outfile[0]:
-        with open(args.outfile[0], 'w', encoding='utf-8') as f: 
-            for line in lines_to_print:
-                f.write(line + '\n')
-    elif not args.silent:
-        for line in lines_to_print:
-            print(line)
-    return
-
-def check_individuals(family, head, args):
-    """Check if the individuals from pedfile is present in varfile"""
-    for individual in list(family.individuals.keys()):
-        if individual not in head.individuals:
-            family.individuals.pop(individual, 0)
-            if args.verbose:
-                print(('Warning! Individual %s is in .ped file but not in variant file! Removing individual from analysis.' 
-                        % individual))
-    return
-
 def main():
     parser = argparse.ArgumentParser(description="Parse different kind of ped files.")
     
@@ -108,10 +48,10 @@ def main():
     )
     parser.add_argument('-o', '--outfile', 
         type=str, nargs=1, default=[None], 
-        help='Specify the path to output, if no file specified the output will be printed to screen.'
+        help='Specify the path to output, if no file specified the output will be printed to screen. With several families the family id is added to the file name.'
     )
     parser.add_argument('--version', 
-        action="version", version=pkg_resources.require("Mip_Family_Analysis")[0].version
+        action="version", version=get_version()
     )
     parser.add_argument('-v', '--verbose', 
         action="store_true", 
@@ -133,75 +73,260 @@ def main():
         type=int, nargs=1, 
         help='Specify the lowest rank score to be outputted.'
     )
+    parser.add_argument('-b', '--batch_size', 
+        type=int, nargs=1, default=[None], 
+        help='Specify the maximum number of variants in a batch. Batches with genes are only split if run with --no_compounds.'
+    )
+    parser.add_argument('-e', '--envelope_size', 
+        type=int, nargs=1, default=[100], 
+        help='Pack small batches together until they hold this number of variants. Default is 100.'
+    )
+    parser.add_argument('-mmap', '--mmap', 
+        action="store_true", 
+        help='Read the variant file from a memory map and only decode the columns that are used.'
+    )
+    parser.add_argument('-rank', '--rank_model', 
+        type=str, nargs=1, default=[None], 
+        help='A config file with a rank model. Default is the model in Mip_Family_Analysis/Models/rank_model.ini.'
+    )
+    parser.add_argument('-nocomp', '--no_compounds', 
+        action="store_true", 
+        help='Do not check for compound heterozygotes.'
+    )
+    parser.add_argument('-cache', '--score_cache', 
+        type=str, nargs=1, default=[None], 
+        help='A sqlite database where the annotation scores are stored between runs. It is created if it does not exist.'
+    )
+    parser.add_argument('-pre', '--prefilter', 
+        action="store_true", 
+        help='Do not check the models for common variants that can not reach the treshold. Needs --treshold.'
+    )
+    parser.add_argument('-phased', '--phased', 
+        action="store_true", 
+        help='Use the phasing of the genotypes(| and the PS field) when checking compounds.'
+    )
+    parser.add_argument('-ann', '--annotation_file', 
+        type=str, nargs=1, default=[None], 
+        help='A file with gene annotations. Variants without a HGNC_symbol get the genes that they overlap.'
+    )
+    parser.add_argument('-at', '--annotation_type', 
+        type=str, nargs=1, default=['ref_gene'], choices=['bed', 'ccds', 'gtf', 'ref_gene'], 
+        help='The format of the annotation file. Default is ref_gene.'
+    )
+    parser.add_argument('-ai', '--annotation_index', 
+        type=str, nargs=1, default=[None], 
+        help='An index file(.npz) for the annotation file. It is built if it does not exist or is out of date.'
+    )
+    parser.add_argument('-w', '--workers', 
+        type=int, nargs=1, default=[None], 
+        help='The number of processes that check the variants. Default is the number of cpus that are available.'
+    )
+    parser.add_argument('-q', '--queue_size', 
+        type=int, nargs=1, default=[None], 
+        help='The maximum number of envelopes that are waiting to be checked. Default is %s for each worker.' 
+                % worker_pool.ENVELOPES_PER_WORKER
+    )
+    parser.add_argument('-inline', '--inline', 
+        action="store_true", 
+        help='Parse, check and print the variants in one process. Files smaller than %s bytes are always checked in one process if --workers is not given.' 
+                % INLINE_FILE_SIZE
+    )
+    parser.add_argument('-adapt', '--adaptive', 
+        action="store_true", 
+        help='Start with one worker and add workers, up to --workers, when the parser is faster than the workers.'
+    )
+    parser.add_argument('-wd', '--work_dir', 
+        type=str, nargs=1, default=[None], 
+        help='A directory where the results of each chromosome are saved when the chromosome is finished.'
+    )
+    parser.add_argument('-resume', '--resume', 
+        action="store_true", 
+        help='Skip the chromosomes that are finished in --work_dir, if the variant file, pedigree and settings are the same.'
+    )
+    parser.add_argument('-store', '--variant_store', 
+        type=str, nargs=1, default=[None], 
+        help='A file where the parsed variants are saved. If it is from the same variant file the variants are read from it and only the models and the inheritance scores are checked, use this to check a family again with a new pedigree.'
+    )
     
     args = parser.parse_args()
     
+    if args.prefilter and not args.treshold:
+        parser.error('--prefilter needs a --treshold')
+    treshold = None
+    if args.treshold:
+        treshold = args.treshold[0]
+    if args.resume and not args.work_dir[0]:
+        parser.error('--resume needs a --work_dir')
+    
     var_file = args.variant_file[0]
     file_name, file_extension = os.path.splitext(var_file)
     
     # Print program version to std err:
     
-    sys.stderr.write('Version: %s \n' % str(pkg_resources.require("Mip_Family_Analysis")[0].version))
+    sys.stderr.write('Version: %s \n' % get_version())
         
     start_time_analysis = datetime.now()
     
     # Start by parsing at the pedigree file:
-    my_family = get_family(args)
-    preferred_models = my_family.models_of_inheritance
-    
-    # Take care of the headers from the variant file:
-    head = get_header(var_file)
+    # All families are checked in the same pass over the variant file:
+    family_type = 'mip'
+    if args.cmms:
+        family_type = 'cmms'
+    families = get_families(args.family_file[0], family_type)
     
-    check_individuals(my_family, head, args)
+    # Compile the rank model before we start:
+    my_rank_model = rank_model.default_rank_model
+    if args.rank_model[0]:
+        my_rank_model = rank_model.RankModel.from_config(args.rank_model[0])
+        if args.verbose:
+            print(('Using rank model %s' % my_rank_model.version))
     
-    add_cmms_metadata(head)
+    # These are the options that change the parsing:
+    parse_settings = {'annotation_file':args.annotation_file[0], 'annotation_type':args.annotation_type[0],
+                        'phased':args.phased, 'max_batch_size':args.batch_size[0], 'split_genes':args.no_compounds}
+    store = None
+    if args.variant_store[0] and os.path.exists(args.variant_store[0]):
+        store = variant_store.VariantStore(args.variant_store[0])
+        if store.matches(var_file, parse_settings):
+            if args.verbose:
+                print(('Reading the variants from %s' % args.variant_store[0]))
+        else:
+            if args.verbose:
+                print(('The variant store %s is from another variant file or settings' % args.variant_store[0]))
+            store = None
     
-    # The variant queue is just a queue with splitted variant lines:
-    variant_queue = JoinableQueue(maxsize=1000)
-    # The consumers will put their results in the results queue
-    results = Manager().Queue()
-    # Create a temporary file for the variants:
-    temp_file = NamedTemporaryFile(delete=False)
+    annotations = None
+    if args.annotation_file[0] and store is None:
+        # The annotation parser needs numpy and interval_tree so it is only imported when it is used
+        from Mip_Family_Analysis.Utils import annotation_parser
+        annotations = annotation_parser.AnnotationParser(args.annotation_file[0], args.annotation_type[0], 
+                            zipped = args.annotation_file[0].endswith('.gz'), index_file = args.annotation_index[0], 
+                            processes = worker_pool.get_available_cpus())
+        if args.verbose:
+            print(('Annotations loaded from %s' % args.annotation_file[0]))
     
-    if args.verbose:
-        print(('Temp files: %s' % temp_file.name))
+    # Take care of the headers from the variant file:
+    if store:
+        head = store.head
+    else:
+        head = get_header(var_file)
     
-    num_model_checkers = (cpu_count()*2-1)
-
-    if args.verbose:
-        print(('Number of cpus: %s' % str(cpu_count())))
+    check_individuals(families, head, args.verbose)
     
-    model_checkers = [variant_consumer.VariantConsumer(variant_queue, results, my_family, args.verbose) 
-                        for i in range(num_model_checkers)]
+    add_cmms_metadata(head)
     
-    for w in model_checkers:
-        w.start()
+    checkpoints = None
+    temp_files = None
+    if args.work_dir[0]:
+        # These are the options that change the results:
+        settings = {'family_type':family_type, 'rank_model':my_rank_model.version, 'treshold':treshold, 
+                    'compounds':not args.no_compounds, 'prefilter':args.prefilter, 'phased':args.phased, 
+                    'annotation_file':args.annotation_file[0], 'annotation_type':args.annotation_type[0]}
+        checkpoints = checkpoint.Checkpoints(args.work_dir[0], var_file, args.family_file[0], 
+                            [family.family_id for family in families], settings, args.resume, args.verbose)
+    else:
+        # Create a temporary file for the variants of each family:
+        temp_files = dict((family.family_id, NamedTemporaryFile(delete=False)) for family in families)
+        
+        if args.verbose:
+            print(('Temp files: %s' % ', '.join(temp_file.name for temp_file in temp_files.values())))
     
-    var_printer = variant_printer.VariantPrinter(results, temp_file, head, args.verbose)
-    var_printer.start()
+    if store:
+        envelopes = store.get_envelopes(my_rank_model.version, checkpoints and checkpoints.finished)
+    else:
+        var_parser = variant_parser.VariantFileParser(var_file, None, head, args.verbose, 
+                            max_batch_size = args.batch_size[0], split_genes = args.no_compounds, 
+                            envelope_size = args.envelope_size[0], reader = args.mmap and 'mmap' or 'text', 
+                            annotations = annotations, phased = args.phased, 
+                            skip_chromosomes = checkpoints and checkpoints.finished, 
+                            split_chromosomes = checkpoints is not None or args.variant_store[0] is not None)
+        envelopes = var_parser.get_envelopes()
+        if args.variant_store[0]:
+            if checkpoints and checkpoints.finished:
+                if args.verbose:
+                    print('The variant store is not written since some chromosomes are skipped')
+            else:
+                store_writer = variant_store.VariantStoreWriter(args.variant_store[0], var_file, head.individuals, 
+                                    my_rank_model, parse_settings)
+                envelopes = store_writer.write_envelopes(envelopes)
     
-        
-    var_parser = variant_parser.VariantFileParser(var_file, variant_queue, head, args.verbose)
-    var_parser.parse()            
+    def make_model_checker(variant_queue = None, results = None, tile_queue = None):
+        return variant_consumer.VariantConsumer(variant_queue, results, families[0], args.verbose, 
+                        compounds = not args.no_compounds, rank_model = my_rank_model, 
+                        score_cache_file = args.score_cache[0], treshold = treshold, 
+                        prefilter = args.prefilter, phased = args.phased, families = families, 
+                        tile_queue = tile_queue)
     
-    for i in range(num_model_checkers):
-        variant_queue.put(None)
+    # Small files are faster to check in this process than to start the workers for:
+    inline = args.inline or (not args.workers[0] and os.path.getsize(var_file) < INLINE_FILE_SIZE)
     
-    variant_queue.join()
-    results.put(None)
-    var_printer.join()
+    if inline:
+        if args.verbose:
+            print('Checking the variants in one process')
+        model_checker = make_model_checker()
+        var_printer = variant_printer.VariantPrinter(None, temp_files, head, args.verbose, checkpoints)
+        if checkpoints:
+            envelopes = checkpoint.checkpoint_envelopes(envelopes, var_printer.finish_chromosome)
+        for envelope in envelopes:
+            var_printer.print_results(model_checker.process_envelope(envelope))
+        if model_checker.score_cache:
+            model_checker.score_cache.close()
+        var_printer.close()
+    else:
+        available_cpus = worker_pool.get_available_cpus()
+        num_model_checkers = args.workers[0] or available_cpus
+        queue_size = worker_pool.get_queue_size(num_model_checkers, args.queue_size[0])
+        
+        if args.verbose:
+            print(('Number of cpus: %s, available: %s' % (cpu_count(), available_cpus)))
+        
+        # The variant queue is just a queue with splitted variant lines:
+        variant_queue = JoinableQueue(maxsize=queue_size)
+        # The consumers will put their results in the results queue
+        results = Manager().Queue()
+        # The compound pairs of big genes are split between the consumers on the tile queue
+        tile_queue = Queue()
+        
+        model_checkers = worker_pool.WorkerPool(variant_queue, 
+                            lambda: make_model_checker(variant_queue, results, tile_queue), num_model_checkers, 
+                            queue_size, adaptive = args.adaptive, verbosity = args.verbose)
+        model_checkers.start()
+        
+        var_printer = variant_printer.VariantPrinter(results, temp_files, head, args.verbose, checkpoints)
+        var_printer.start()
+        
+        if checkpoints:
+            def finish_chromosome(chromosome):
+                # All results of the chromosome are on the results queue when the workers are done:
+                model_checkers.join()
+                results.put(chromosome)
+            
+            envelopes = checkpoint.checkpoint_envelopes(envelopes, finish_chromosome)
+        
+        for envelope in envelopes:
+            model_checkers.put(envelope)
+        
+        model_checkers.stop()
+        results.put(None)
+        var_printer.join()
     
     if args.verbose:
         print('Models checked!')
         print('Start sorting the variants: \n')
         start_time_variant_sorting = datetime.now()
     
-    print_headers(args, head)
-    
-    var_sorter = variant_sorter.FileSort(temp_file, outFile=args.outfile[0], silent=args.silent)
-    var_sorter.sort()
-    
-    os.remove(temp_file.name)
+    for family in families:
+        outfile = get_outfile(args.outfile[0], family.family_id, len(families))
+        if checkpoints:
+            temp_file = checkpoints.merge(family.family_id)
+        else:
+            temp_file = temp_files[family.family_id]
+        print_headers(head, outfile, args.silent)
+        
+        var_sorter = variant_sorter.FileSort(temp_file, outFile=outfile, silent=args.silent)
+        var_sorter.sort()
+        
+        os.remove(temp_file.name)
     
     if args.verbose:
         print(('Variants sorted!. Time to sort variants: %s \n' % str(datetime.now() - start_time_variant_sorting)))
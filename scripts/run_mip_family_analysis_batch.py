@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+run_mip_family_analysis_batch.py
+
+Script for running the analysis on all jobs of a manifest file with one pool of workers.
+
+Each line of the manifest has a pedigree file, a variant file and a results file separated by tabs.
+"""
+
+import sys
+import os
+import argparse
+
+from datetime import datetime
+
+from Mip_Family_Analysis import get_version
+
+from Mip_Family_Analysis.Models import rank_model
+from Mip_Family_Analysis.Utils import batch_runner, worker_pool
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the analysis for all jobs of a manifest file.")
+
+    parser.add_argument('manifest',
+        type=str, nargs=1,
+        help='A file with one job per line: pedigree file, variant file and results file separated by tabs.'
+    )
+    parser.add_argument('--version',
+        action="version", version=get_version()
+    )
+    parser.add_argument('-v', '--verbose',
+        action="store_true",
+        help='Increase output verbosity.'
+    )
+    parser.add_argument('-cmms', '--cmms',
+        action="store_true",
+        help='If run with cmms specific structure.'
+    )
+    parser.add_argument('-tres', '--treshold',
+        type=int, nargs=1,
+        help='Specify the lowest rank score to be outputted.'
+    )
+    parser.add_argument('-b', '--batch_size',
+        type=int, nargs=1, default=[None],
+        help='Specify the maximum number of variants in a batch. Batches with genes are only split if run with --no_compounds.'
+    )
+    parser.add_argument('-e', '--envelope_size',
+        type=int, nargs=1, default=[100],
+        help='Pack small batches together until they hold this number of variants. Default is 100.'
+    )
+    parser.add_argument('-mmap', '--mmap',
+        action="store_true",
+        help='Read the variant files from a memory map and only decode the columns that are used.'
+    )
+    parser.add_argument('-rank', '--rank_model',
+        type=str, nargs=1, default=[None],
+        help='A config file with a rank model. Default is the model in Mip_Family_Analysis/Models/rank_model.ini.'
+    )
+    parser.add_argument('-nocomp', '--no_compounds',
+        action="store_true",
+        help='Do not check for compound heterozygotes.'
+    )
+    parser.add_argument('-cache', '--score_cache',
+        type=str, nargs=1, default=[None],
+        help='A sqlite database where the annotation scores are stored between runs. It is created if it does not exist.'
+    )
+    parser.add_argument('-pre', '--prefilter',
+        action="store_true",
+        help='Do not check the models for common variants that can not reach the treshold. Needs --treshold.'
+    )
+    parser.add_argument('-phased', '--phased',
+        action="store_true",
+        help='Use the phasing of the genotypes(| and the PS field) when checking compounds.'
+    )
+    parser.add_argument('-ann', '--annotation_file',
+        type=str, nargs=1, default=[None],
+        help='A file with gene annotations. Variants without a HGNC_symbol get the genes that they overlap.'
+    )
+    parser.add_argument('-at', '--annotation_type',
+        type=str, nargs=1, default=['ref_gene'], choices=['bed', 'ccds', 'gtf', 'ref_gene'],
+        help='The format of the annotation file. Default is ref_gene.'
+    )
+    parser.add_argument('-ai', '--annotation_index',
+        type=str, nargs=1, default=[None],
+        help='An index file(.npz) for the annotation file. It is built if it does not exist or is out of date.'
+    )
+    parser.add_argument('-w', '--workers',
+        type=int, nargs=1, default=[None],
+        help='The number of processes that check the variants. Default is the number of cpus that are available.'
+    )
+    parser.add_argument('-q', '--queue_size',
+        type=int, nargs=1, default=[None],
+        help='The maximum number of envelopes that are waiting to be checked. Default is %s for each worker.'
+                % worker_pool.ENVELOPES_PER_WORKER
+    )
+    parser.add_argument('-p', '--parsers',
+        type=int, nargs=1, default=[None],
+        help='The number of variant files that are parsed at the same time. Default is the number of available cpus, at most the number of jobs.'
+    )
+
+    args = parser.parse_args()
+
+    if args.prefilter and not args.treshold:
+        parser.error('--prefilter needs a --treshold')
+    treshold = None
+    if args.treshold:
+        treshold = args.treshold[0]
+
+    sys.stderr.write('Version: %s \n' % get_version())
+
+    start_time_analysis = datetime.now()
+
+    jobs = batch_runner.read_manifest(args.manifest[0])
+    if args.verbose:
+        print(('Number of jobs: %s' % len(jobs)))
+    if not jobs:
+        return
+
+    my_rank_model = rank_model.default_rank_model
+    if args.rank_model[0]:
+        my_rank_model = rank_model.RankModel.from_config(args.rank_model[0])
+        if args.verbose:
+            print(('Using rank model %s' % my_rank_model.version))
+
+    # The annotations are loaded once and shared by all parsers:
+    annotations = None
+    if args.annotation_file[0]:
+        # The annotation parser needs numpy and interval_tree so it is only imported when it is used
+        from Mip_Family_Analysis.Utils import annotation_parser
+        annotations = annotation_parser.AnnotationParser(args.annotation_file[0], args.annotation_type[0],
+                            zipped = args.annotation_file[0].endswith('.gz'), index_file = args.annotation_index[0],
+                            processes = worker_pool.get_available_cpus())
+
+    number_of_parsers = args.parsers[0] or min(len(jobs), worker_pool.get_available_cpus())
+
+    failed = batch_runner.run_batch(jobs, family_type = args.cmms and 'cmms' or 'mip', verbosity = args.verbose,
+                    consumers = args.workers[0], queue_size = args.queue_size[0], parsers = number_of_parsers,
+                    max_batch_size = args.batch_size[0],
+                    envelope_size = args.envelope_size[0], reader = args.mmap and 'mmap' or 'text',
+                    annotations = annotations, phased = args.phased, compounds = not args.no_compounds,
+                    rank_model = my_rank_model, score_cache_file = args.score_cache[0], treshold = treshold,
+                    prefilter = args.prefilter)
+
+    for job in failed:
+        sys.stderr.write('Job with variant file %s failed: %s\n' % (job[1], failed[job]))
+
+    if args.verbose:
+        print(('Total time for %s jobs: %s' % (len(jobs), str(datetime.now() - start_time_analysis))))
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
+
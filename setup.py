@@ -14,8 +14,11 @@ setup(name="mip_family_analysis",
 	author_email="mans.magnusson@scilifelab.se",
 	description=("A new tool for doing inheritance analysis and scoring in the mip pipeline."),
     install_requires=['ped_parser', 'interval_tree'],
+    extras_require={'numpy': ['numpy']},
 	long_description = long_description,
     packages={'Mip_Family_Analysis', 'Mip_Family_Analysis.Utils', 'Mip_Family_Analysis.Variants', 'Mip_Family_Analysis.Models'},
+    package_data={'Mip_Family_Analysis.Models': ['rank_model.ini']},
     url='https://github.com/moonso/Mip_Family_Analysis',
-    scripts=['scripts/run_mip_family_analysis.py'],
+    scripts=['scripts/run_mip_family_analysis.py', 'scripts/run_mip_family_analysis_batch.py',
+                'scripts/run_mip_family_analysis_server.py', 'scripts/mip_family_analysis_client.py'],
 )
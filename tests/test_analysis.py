@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_analysis.py
+
+Test that analyze checks the lines of a variant file in the same way inline and with workers.
+"""
+
+import sys
+import os
+
+from ped_parser import individual
+
+from Mip_Family_Analysis.Utils import analysis
+from tests.test_variant_consumer import get_family
+from tests.test_variant_file_parser import make_variant_file
+
+def get_lines(extra_variants = []):
+    """Return the lines of a file with a compound pair in ADK and a homozygote intergenic variant."""
+    variant_file = make_variant_file([('1', 10, 'ADK', ['0/1', '0/1', '0/0']), ('1', 20, 'ADK', ['0/1', '0/0', '0/1']),
+                                        ('1', 500, '-', ['1/1', '0/1', '0/1'])] + extra_variants)
+    with open(variant_file) as f:
+        lines = f.readlines()
+    os.remove(variant_file)
+    return lines
+
+def test_inline():
+    """The variants are yielded in the order of the file."""
+    variants = list(analysis.analyze(get_family(), get_lines()))
+    assert [variant['Variant_start'] for variant in variants] == ['10', '20', '500']
+    assert [variant['Inheritance_model'] for variant in variants] == ['AR_comp', 'AR_comp', 'AR_hom']
+    assert variants[0]['Compounds'].startswith('1_20_A_T=')
+    assert 'Genotypes' not in variants[0]
+
+def test_lazy():
+    """The first variants are yielded before all lines are read."""
+    lines = get_lines([('2', pos, 'POT1', ['0/1', '0/1', '0/0']) for pos in range(10, 20)])
+    read_lines = []
+    def get_line():
+        for line in lines:
+            read_lines.append(line)
+            yield line
+    variants = analysis.analyze(get_family(), get_line(), envelope_size = 1)
+    assert next(variants)['Variant_start'] == '10'
+    assert len(read_lines) < len(lines)
+
+def test_workers():
+    """The workers gives the same variants as the inline analysis."""
+    inline_variants = list(analysis.analyze(get_family(), get_lines()))
+    variants = list(analysis.analyze(get_family(), get_lines(), workers = 2, envelope_size = 1))
+    assert (sorted(variants, key=lambda variant: int(variant['Variant_start'])) == inline_variants)
+
+def test_models():
+    """The models replaces the prefered models of the family when scoring."""
+    my_family = get_family()
+    rank_scores = [variant['Rank_score'] for variant in analysis.analyze(my_family, get_lines())]
+    other_scores = [variant['Rank_score'] for variant in analysis.analyze(my_family, get_lines(), models = ['AR_hom'])]
+    assert rank_scores[:2] != other_scores[:2]
+    assert my_family.models_of_inheritance == ['AR_comp']
+
+def test_family_not_changed():
+    """Individuals that are not in the variant file are only removed from the analysis."""
+    my_family = get_family()
+    my_family.add_individual(individual.Individual(ind='4', family='1', mother='3', father='2', sex=2, phenotype=1))
+    list(analysis.analyze(my_family, get_lines()))
+    assert '4' in my_family.individuals
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_analysis_server.py
+
+Test that jobs are submitted, streamed back and counted by the analysis server.
+"""
+
+import sys
+import os
+import time
+import queue
+import threading
+
+from Mip_Family_Analysis.Utils import analysis_server
+
+class SimpleRunner(object):
+    """A runner that finishes the jobs in the order they are submitted by copying the variant file."""
+    def __init__(self):
+        self.jobs = queue.Queue()
+        self.job_counter = 0
+        self.stopped = False
+
+    def start(self):
+        pass
+
+    def submit(self, family_file, variant_file, outfile):
+        job_id = self.job_counter
+        self.job_counter += 1
+        self.jobs.put((job_id, variant_file, outfile))
+        return job_id
+
+    def get_finished(self, timeout = None):
+        job_id, variant_file, outfile = self.jobs.get(timeout = timeout)
+        if not os.path.exists(variant_file):
+            return job_id, 'IOError: %s' % variant_file, {}
+        with open(variant_file) as f, open(outfile, 'w') as g:
+            g.write(f.read())
+        return job_id, None, {'1':outfile}
+
+    def get_queue_sizes(self):
+        return {'jobs':self.jobs.qsize()}
+
+    def shutdown(self):
+        self.stopped = True
+
+class StoppedRunner(SimpleRunner):
+    """A runner where a worker has stopped, so the jobs that are submitted never finish."""
+    def get_finished(self, timeout = None):
+        if self.job_counter:
+            raise RuntimeError('A worker stopped before all jobs were finished')
+        time.sleep(timeout)
+        raise queue.Empty
+
+    def terminate(self):
+        self.terminated = True
+
+class TestAnalysisServer(object):
+    """Run a server in a thread and send requests to it."""
+
+    def setup_class(self):
+        """Start the server"""
+        self.socket_path = '/tmp/mip_family_analysis_%s.sock' % os.getpid()
+        self.runner = SimpleRunner()
+        self.server = analysis_server.AnalysisServer(self.socket_path, self.runner)
+        self.thread = threading.Thread(target=self.server.serve)
+        self.thread.start()
+
+    def test_stream(self, tmpdir):
+        """The lines of the results are streamed back and the temporary results file is removed."""
+        variant_file = tmpdir.join('variants.txt')
+        variant_file.write('first\nsecond\n')
+        messages = list(analysis_server.submit_job(self.socket_path, 'family.ped', str(variant_file), stream = True))
+        assert messages[0]['status'] == 'queued'
+        assert [message['line'] for message in messages[1:-1]] == ['first', 'second']
+        assert messages[-1]['status'] == 'done'
+        assert messages[-1]['outfiles'] == {}
+
+    def test_outfile(self, tmpdir):
+        """The results are written to the outfile."""
+        variant_file = tmpdir.join('variants.txt')
+        variant_file.write('first\n')
+        outfile = str(tmpdir.join('results.txt'))
+        messages = list(analysis_server.submit_job(self.socket_path, 'family.ped', str(variant_file), outfile))
+        assert messages[-1]['outfiles'] == {'1':outfile}
+        assert open(outfile).read() == 'first\n'
+
+    def test_failed(self, tmpdir):
+        """A failed job is reported to the client."""
+        messages = list(analysis_server.submit_job(self.socket_path, 'family.ped', str(tmpdir.join('missing.txt'))))
+        assert messages[-1]['status'] == 'failed'
+        assert messages[-1]['error'].startswith('IOError')
+
+    def test_stats(self):
+        """The statistics counts the jobs that has been finished."""
+        stats = analysis_server.get_stats(self.socket_path)
+        assert stats['running'] == 0
+        assert stats['finished'] == stats['submitted'] == stats['latency']['count']
+        assert stats['queues'] == {'jobs':0}
+
+    def test_already_listening(self):
+        """Only one server can listen on a socket."""
+        try:
+            analysis_server.AnalysisServer(self.socket_path, SimpleRunner())
+        except IOError:
+            pass
+        else:
+            assert False
+
+    def teardown_class(self):
+        """Stop the server"""
+        analysis_server.stop_server(self.socket_path)
+        self.thread.join()
+        assert self.runner.stopped
+        assert not os.path.exists(self.socket_path)
+
+def test_stopped_worker(tmpdir):
+    """The jobs fail and the server stops if a worker of the runner has stopped."""
+    socket_path = str(tmpdir.join('server.sock'))
+    runner = StoppedRunner()
+    server = analysis_server.AnalysisServer(socket_path, runner)
+    thread = threading.Thread(target=server.serve)
+    thread.start()
+    messages = list(analysis_server.submit_job(socket_path, 'family.ped', str(tmpdir.join('variants.txt'))))
+    assert messages[-1]['status'] == 'failed'
+    assert messages[-1]['error'].startswith('A worker stopped')
+    thread.join()
+    assert runner.terminated
+    assert not runner.stopped
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_annotation_parser.py
+
+Test that the annotation parser builds the same intervals from an annotation file and from an index file.
+"""
+
+import sys
+import os
+import gzip
+import random
+
+import interval_tree
+
+from Mip_Family_Analysis.Utils import annotation_parser, interval_index, sweep_annotator
+
+BED_LINES = ['chr1\t100\t200\tADK\n', 'chr1\t150\t400\tPOT1\n', 'chr1\t1000\t1200\tOR4F5\n',
+                'chr2\t50\t80\tTTN\n', 'chrX\t10\t20\tDMD\n']
+
+def make_annotation_file(tmpdir, lines = BED_LINES):
+    """Write a bed file and return the path."""
+    annotation_file = tmpdir.join('genes.bed')
+    annotation_file.write(''.join(lines))
+    return str(annotation_file)
+
+def get_genes(my_parser, chrom, position):
+    """Return the sorted ids of the features that overlap a position."""
+    return sorted(my_parser.interval_trees[chrom].find_range([position, position]))
+
+class TestIndex(object):
+    """Test the index file of an annotation file."""
+
+    def test_features(self, tmpdir):
+        """The features should be sorted on start."""
+        my_parser = annotation_parser.AnnotationParser(make_annotation_file(tmpdir), 'bed')
+        starts, stops, feature_ids = my_parser.features['1']
+        assert list(starts) == [100, 150, 1000]
+        assert list(feature_ids) == ['ADK', 'POT1', 'OR4F5']
+        assert get_genes(my_parser, '1', 160) == ['ADK', 'POT1']
+
+    def test_load_index(self, tmpdir, monkeypatch):
+        """The second time the features should be read from the index."""
+        annotation_file = make_annotation_file(tmpdir)
+        index_file = str(tmpdir.join('genes.npz'))
+        first_parser = annotation_parser.AnnotationParser(annotation_file, 'bed', index_file = index_file)
+        assert os.path.exists(index_file)
+        def fail(*args):
+            raise AssertionError('The annotation file should not be parsed')
+        monkeypatch.setattr(annotation_parser.AnnotationParser, 'parse_annotations', fail)
+        second_parser = annotation_parser.AnnotationParser(annotation_file, 'bed', index_file = index_file)
+        assert sorted(second_parser.features) == ['1', '2', 'X']
+        for chrom, position in [('1', 160), ('1', 1100), ('2', 50), ('X', 21)]:
+            assert get_genes(first_parser, chrom, position) == get_genes(second_parser, chrom, position)
+
+    def test_changed_file(self, tmpdir):
+        """If the annotation file changes the index should be rebuilt."""
+        annotation_file = make_annotation_file(tmpdir)
+        index_file = str(tmpdir.join('genes.npz'))
+        annotation_parser.AnnotationParser(annotation_file, 'bed', index_file = index_file)
+        make_annotation_file(tmpdir, BED_LINES + ['chr3\t1\t2\tNEW\n'])
+        my_parser = annotation_parser.AnnotationParser(annotation_file, 'bed', index_file = index_file)
+        assert '3' in my_parser.features
+        assert '3' in annotation_parser.AnnotationParser(annotation_file, 'bed', index_file = index_file).features
+
+    def test_touched_file(self, tmpdir):
+        """If only the modification time has changed the hash decides."""
+        annotation_file = make_annotation_file(tmpdir)
+        index_file = str(tmpdir.join('genes.npz'))
+        annotation_parser.AnnotationParser(annotation_file, 'bed', index_file = index_file)
+        os.utime(annotation_file, (0, 0))
+        my_parser = annotation_parser.AnnotationParser(annotation_file, 'bed')
+        assert my_parser.load_index(index_file) is not None
+        make_annotation_file(tmpdir, [line.replace('ADK', 'ADL') for line in BED_LINES])
+        os.utime(annotation_file, (0, 0))
+        assert my_parser.load_index(index_file) is None
+
+def test_get_features(tmpdir):
+    """All positions of a chromosome are looked up at once."""
+    my_parser = annotation_parser.AnnotationParser(make_annotation_file(tmpdir), 'bed')
+    assert my_parser.get_features('1', [99, 100, 200, 201, 1200]) == [set(), {'ADK'}, {'ADK', 'POT1'}, {'POT1'}, 
+                                                                        {'OR4F5'}]
+    assert my_parser.get_features('22', [100]) == [set()]
+
+def test_same_as_tree():
+    """The interval index should give the same features as an interval tree."""
+    random.seed(1)
+    features = []
+    for i in range(300):
+        start = random.randint(1, 5000)
+        features.append([start, start + random.choice([1, 10, 100, 2000]), 'feature_%s' % (i % 250)])
+    tree = interval_tree.IntervalTree(features, 1, 7002)
+    index = interval_index.IntervalIndex([feature[0] for feature in features], [feature[1] for feature in features], 
+                                            [feature[2] for feature in features])
+    positions = list(range(0, 7002, 7))
+    assert index.query(positions) == [set(tree.find_range([position, position])) for position in positions]
+    for interval in [[1, 10], [100, 400], [4000, 7001]]:
+        assert sorted(index.find_range(interval)) == sorted(tree.find_range(interval))
+
+def test_single_position():
+    """Features with the same start and stop are found, the interval tree does not always find them."""
+    index = interval_index.IntervalIndex([7, 5], [7, 100], ['point', 'gene'])
+    assert index.query([6, 7, 8]) == [{'gene'}, {'gene', 'point'}, {'gene'}]
+
+def test_empty_index():
+    """An empty index does not find anything."""
+    index = interval_index.IntervalIndex([], [], [])
+    assert index.query([1, 2]) == [set(), set()]
+
+def test_sweep(tmpdir):
+    """The sweep should give the same features as the lookups, also when the positions are not sorted."""
+    my_parser = annotation_parser.AnnotationParser(make_annotation_file(tmpdir), 'bed')
+    annotator = sweep_annotator.SweepAnnotator(my_parser)
+    positions = [('1', position) for position in range(0, 1300, 10)] + [('1', 150), ('1', 1100), ('2', 60), 
+                    ('3', 10), ('X', 15), ('1', 120)]
+    for chrom, position in positions:
+        assert annotator.get_features(chrom, position) == sorted(my_parser.get_features(chrom, [position])[0])
+    assert annotator.get_features('1', 90, 160) == ['ADK', 'POT1']
+    assert annotator.get_features('1', 170) == ['ADK', 'POT1']
+
+GTF_LINES = ['#!genome-build GRCh37\n', 
+    'chr1\tHAVANA\tgene\t100\t200\t.\t+\t.\tgene_id "ENSG01"; transcript_id "ENST01"; gene_name "ADK";\n',
+    'chr1\tHAVANA\texon\t100\t200\t.\t+\t.\tgene_id "ENSG01"; transcript_id "ENST01";\n',
+    '2\tHAVANA\tgene\t50\t80\t.\t+\t.\ttranscript_id "ENST02"; gene_id "ENSG02";\n']
+REF_GENE_LINES = ['585\tNM_01\tchr1\t+\t100\t200\t100\t200\t1\t100,\t200,\t0\tADK\tcmpl\tcmpl\t0,\n',
+    '585\tNM_02\tchr1\t+\t150\t400\t150\t400\t1\t150,\t400,\t0\tPOT1\tcmpl\tcmpl\t0,\n']
+CCDS_LINES = ['#chromosome\tnc_accession\tgene\tgene_id\tccds_id\tccds_status\tcds_strand\tcds_from\tcds_to\n',
+    '1\tNC_01\tADK\t1\tCCDS1\tPublic\t+\t100\t200\t[100-200]\n',
+    '1\tNC_01\tPOT1\t2\tCCDS2\tWithdrawn\t+\t-\t-\t[]\n']
+
+def get_line_features(annotation_file, annotation_type):
+    """Parse the file one line at the time with the feature parsers."""
+    features = {}
+    for line_count, line in enumerate(open(annotation_file)):
+        if line[0] != '#' and len(line) > 1:
+            chrom, start, stop, feature_id = annotation_parser.feature_parsers[annotation_type](line.rstrip(),
+                                                                                                line_count)
+            features.setdefault(chrom, []).append((start, stop, feature_id))
+    return dict((chrom, sorted(features[chrom], key=lambda feature: feature[:2])) for chrom in features)
+
+def get_parsed_features(my_parser):
+    """Return the features of a parser on the same form as get_line_features."""
+    return dict((chrom, list(zip(*[[value.item() if hasattr(value, 'item') else value for value in column] 
+                    for column in my_parser.features[chrom]]))) for chrom in my_parser.features)
+
+def test_feature_parsers():
+    """The chromosome, the positions and the gene of a line in each format."""
+    assert annotation_parser.bed_feature(BED_LINES[0].rstrip(), 0) == ('1', 100, 200, 'ADK')
+    assert annotation_parser.bed_feature('chr1\t100\t200', 7) == ('1', 100, 200, '7')
+    assert annotation_parser.gtf_feature(GTF_LINES[1].rstrip(), 1) == ('1', 100, 200, 'ENSG01')
+    assert annotation_parser.gtf_feature(GTF_LINES[3].rstrip(), 3) == ('2', 50, 80, 'ENSG02')
+    assert annotation_parser.ref_gene_feature(REF_GENE_LINES[1].rstrip(), 1) == ('1', 150, 400, 'POT1')
+    assert annotation_parser.ccds_feature(CCDS_LINES[1].rstrip(), 1) == ('1', 100, 200, 'ADK')
+    assert annotation_parser.ccds_feature(CCDS_LINES[2].rstrip(), 2) == ('1', 0, 0, 'POT1')
+
+def test_formats(tmpdir, monkeypatch):
+    """The blocks should give the same features as parsing one line at the time, also with processes and gzip."""
+    monkeypatch.setattr(annotation_parser, 'BLOCK_SIZE', 64)
+    for annotation_type, lines in [('bed', BED_LINES + ['chr1\t100\t200\n'] * 3), ('gtf', GTF_LINES), 
+                                    ('ref_gene', REF_GENE_LINES), ('ccds', CCDS_LINES)]:
+        annotation_file = tmpdir.join('annotations.%s' % annotation_type)
+        annotation_file.write(''.join(lines))
+        zipped_file = str(annotation_file) + '.gz'
+        with gzip.open(zipped_file, 'wt') as f:
+            f.write(''.join(lines))
+        expected = get_line_features(str(annotation_file), annotation_type)
+        for infile, zipped, processes in [(str(annotation_file), False, 1), (str(annotation_file), False, 2),
+                                            (zipped_file, True, 1)]:
+            my_parser = annotation_parser.AnnotationParser(infile, annotation_type, zipped = zipped, 
+                                                            processes = processes)
+            assert get_parsed_features(my_parser) == expected
+
+def test_read_blocks(tmpdir):
+    """The blocks should hold complete lines and the right line numbers."""
+    lines = ['line_%s\n' % i for i in range(100)] + ['last']
+    infile = tmpdir.join('lines.txt')
+    infile.write(''.join(lines))
+    block_lines = []
+    for first_line, block in annotation_parser.read_blocks(str(infile), block_size = 50):
+        assert first_line == len(block_lines)
+        block_lines.extend(block.decode().splitlines(True))
+    assert block_lines == lines
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_batch_runner.py
+
+Test that the jobs of a batch are kept apart by the consumers and the printer.
+"""
+
+import sys
+import os
+import queue
+import multiprocessing
+from queue import Queue
+
+from Mip_Family_Analysis.Utils import batch_runner, header_parser
+from Mip_Family_Analysis.Utils.analysis import add_cmms_metadata
+from tests.test_variant_consumer import get_family, get_envelope
+from tests.test_variant_file_parser import make_variant_file
+
+def test_read_manifest(tmpdir):
+    """Comments and empty lines are skipped."""
+    manifest = tmpdir.join('manifest.txt')
+    manifest.write('#pedigree\tvariants\toutfile\n1.ped\t1.vcf\t1.txt\n\n2.ped\t2.vcf\t2.txt\n')
+    assert batch_runner.read_manifest(str(manifest)) == [('1.ped', '1.vcf', '1.txt'), ('2.ped', '2.vcf', '2.txt')]
+
+def test_job_queue():
+    """The envelopes are sent with the job id and the families."""
+    task_queue = Queue()
+    families = [get_family()]
+    job_queue = batch_runner.JobQueue(task_queue, 3, families)
+    job_queue.put(['first'])
+    job_queue.put(['second'])
+    assert job_queue.envelopes == 2
+    assert task_queue.get() == (3, families, ['first'])
+
+def test_job_consumer():
+    """The envelopes are checked with the families of their job."""
+    task_queue = Queue()
+    results = Queue()
+    my_family = get_family()
+    task_queue.put((7, [my_family], get_envelope()))
+    task_queue.put((8, [my_family], [{'ADK':{0:{'Chromosome':'1'}}}]))
+    task_queue.put(None)
+    consumer = batch_runner.JobConsumer(task_queue, results, None)
+    consumer.run()
+    kind, job_id, variants = results.get()
+    assert (kind, job_id) == ('variants', 7)
+    assert variants['1'][0]['Inheritance_model'] == 'AR_comp'
+    # A job that can not be checked fails without stopping the consumer:
+    assert results.get()[:2] == ('failed', 8)
+
+class TestJobPrinter(object):
+    """Test that the results of a job are printed when all envelopes has arrived."""
+
+    def setup_class(self):
+        """Make a variant file to get a header from."""
+        self.variant_file = make_variant_file([])
+        self.head = header_parser.HeaderParser(self.variant_file)
+        add_cmms_metadata(self.head)
+
+    def get_results(self, rank_score):
+        """Return the results of an envelope with one variant."""
+        variant = {'Chromosome':'1', 'Variant_start':str(rank_score), 'Rank_score':str(rank_score)}
+        return {'1':{rank_score:variant}}
+
+    def test_finish_job(self, tmpdir):
+        """Results that comes before the job is started are kept."""
+        finished = Queue()
+        printer = batch_runner.JobPrinter(None, finished)
+        outfile = str(tmpdir.join('results.txt'))
+        printer.handle(('variants', 0, self.get_results(5)))
+        printer.handle(('start', 0, self.head, {'1':outfile}))
+        printer.handle(('done', 0, 2))
+        assert finished.empty()
+        printer.handle(('variants', 0, self.get_results(10)))
+        assert finished.get() == (0, None, {'1':outfile})
+        with open(outfile) as f:
+            lines = [line for line in f if not line.startswith('#')]
+        assert [line.split('\t')[1] for line in lines] == ['10', '5']
+        assert printer.jobs == {}
+
+    def test_failed_job(self, tmpdir):
+        """Nothing is printed for a job that failed."""
+        finished = Queue()
+        printer = batch_runner.JobPrinter(None, finished)
+        outfile = str(tmpdir.join('results.txt'))
+        printer.handle(('start', 1, self.head, {'1':outfile}))
+        printer.handle(('failed', 1, 'ValueError: bad line'))
+        printer.handle(('variants', 1, self.get_results(5)))
+        printer.handle(('done', 1, 1))
+        assert finished.get() == (1, 'ValueError: bad line', {})
+        assert finished.empty()
+        assert not os.path.exists(outfile)
+
+    def test_unwritable_outfile(self, tmpdir):
+        """A job that can not be printed fails without stopping the printer."""
+        results = Queue()
+        finished = Queue()
+        printer = batch_runner.JobPrinter(results, finished)
+        results.put(('start', 2, self.head, {'1':str(tmpdir.join('missing', 'results.txt'))}))
+        results.put(('variants', 2, self.get_results(5)))
+        results.put(('done', 2, 1))
+        results.put(('start', 3, self.head, {'1':str(tmpdir.join('results.txt'))}))
+        results.put(('done', 3, 0))
+        results.put(None)
+        printer.run()
+        job_id, error, outfiles = finished.get()
+        assert (job_id, outfiles) == (2, {})
+        assert error.startswith('FileNotFoundError')
+        assert finished.get() == (3, None, {'1':str(tmpdir.join('results.txt'))})
+        assert printer.jobs == {}
+
+    def teardown_class(self):
+        """Remove the variant file"""
+        os.remove(self.variant_file)
+
+def test_stopped_worker():
+    """A worker that has stopped is an error when a job is running, instead of waiting forever."""
+    runner = batch_runner.BatchRunner(consumers = 1)
+    runner.job_queue = Queue()
+    runner.finished_queue = multiprocessing.Queue()
+    runner.printer = multiprocessing.Process(target=os.getpid)
+    runner.printer.start()
+    runner.printer.join()
+    runner.workers = [runner.printer]
+    try:
+        runner.get_finished(timeout = 0.1)
+    except queue.Empty:
+        pass
+    else:
+        assert False
+    runner.submit('family.ped', 'variants.txt', 'results.txt')
+    try:
+        runner.get_finished()
+    except RuntimeError:
+        pass
+    else:
+        assert False
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_checkpoint.py
+
+Test that the results of finished chromosomes are kept and only used with the same input and settings.
+"""
+
+import sys
+import os
+
+from Mip_Family_Analysis.Utils import checkpoint
+from tests.test_variant_file_parser import make_variant_file, get_envelopes
+
+def get_checkpoints(tmpdir, resume = True, settings = None):
+    """Return checkpoints for two families in the work directory tmpdir/work."""
+    return checkpoint.Checkpoints(str(tmpdir.join('work')), str(tmpdir.join('variants.txt')),
+                                    str(tmpdir.join('family.ped')), ['1', '2'], settings, resume)
+
+def finish_chromosome(checkpoints, chromosome):
+    """Write one line for each family and finish the chromosome."""
+    outfiles = checkpoints.open_files()
+    for family_id in outfiles:
+        outfiles[family_id].write(('%s\t%s\n' % (chromosome, family_id)).encode('utf-8'))
+    checkpoints.close(checkpoints.finish(chromosome, outfiles))
+
+class TestCheckpoints(object):
+    """Test to finish, resume and merge chromosomes."""
+
+    def prepare(self, tmpdir):
+        """Write a variant file and a pedigree and finish chromosome 1."""
+        tmpdir.join('variants.txt').write('1\t10\n2\t10\n')
+        tmpdir.join('family.ped').write('1\t1\n')
+        checkpoints = get_checkpoints(tmpdir, resume = False)
+        finish_chromosome(checkpoints, '1')
+        return checkpoints
+
+    def test_merge(self, tmpdir):
+        """The results of the families are merged in the order of the chromosomes."""
+        checkpoints = self.prepare(tmpdir)
+        finish_chromosome(checkpoints, '2')
+        merged_file = checkpoints.merge('2')
+        assert open(merged_file.name).read() == '1\t2\n2\t2\n'
+        assert not os.path.exists(checkpoints.get_part_file('1'))
+
+    def test_resume(self, tmpdir):
+        """The finished chromosomes are kept when the run is resumed."""
+        self.prepare(tmpdir)
+        assert get_checkpoints(tmpdir).finished == ['1']
+
+    def test_no_resume(self, tmpdir):
+        """Without resume the run starts from the beginning."""
+        checkpoints = self.prepare(tmpdir)
+        assert get_checkpoints(tmpdir, resume = False).finished == []
+        assert not os.path.exists(checkpoints.get_results_file('1', '1'))
+
+    def test_changed_pedigree(self, tmpdir):
+        """The finished chromosomes are not used if the pedigree has changed."""
+        self.prepare(tmpdir)
+        tmpdir.join('family.ped').write('1\t2\n')
+        assert get_checkpoints(tmpdir).finished == []
+
+    def test_changed_variant_file(self, tmpdir):
+        """The finished chromosomes are not used if the variant file has changed."""
+        self.prepare(tmpdir)
+        tmpdir.join('variants.txt').write('1\t11\n2\t10\n')
+        assert get_checkpoints(tmpdir).finished == []
+
+    def test_touched_variant_file(self, tmpdir):
+        """A variant file with a new modification time but the same content is the same input."""
+        self.prepare(tmpdir)
+        tmpdir.join('variants.txt').setmtime(0)
+        assert get_checkpoints(tmpdir).finished == ['1']
+
+    def test_changed_settings(self, tmpdir):
+        """The finished chromosomes are not used if the settings has changed."""
+        self.prepare(tmpdir)
+        assert get_checkpoints(tmpdir, settings = {'treshold':10}).finished == []
+
+    def test_missing_results(self, tmpdir):
+        """A chromosome without results for all families is not finished."""
+        checkpoints = self.prepare(tmpdir)
+        os.remove(checkpoints.get_results_file('2', '1'))
+        assert get_checkpoints(tmpdir).finished == []
+
+class TestCheckpointEnvelopes(object):
+    """Test that the chromosomes are finished when all their envelopes are yielded."""
+
+    def setup_class(self):
+        """Setup a file with an intergenic region that goes over two chromosomes."""
+        variants = [('1', pos, '-', ['0/1', '0/1', '0/0']) for pos in range(1, 4)]
+        variants += [('2', pos, '-', ['0/1', '0/1', '0/0']) for pos in range(1, 4)]
+        variants += [('3', pos, 'ADK', ['0/1', '0/1', '0/0']) for pos in range(1, 4)]
+        self.variant_file = make_variant_file(variants)
+
+    def test_split_chromosomes(self):
+        """No envelope holds variants from more than one chromosome."""
+        assert len(get_envelopes(self.variant_file, envelope_size = 100)) == 1
+        envelopes = get_envelopes(self.variant_file, envelope_size = 100, split_chromosomes = True)
+        assert [checkpoint.get_chromosome(envelope) for envelope in envelopes] == ['1', '2', '3']
+
+    def test_skip_chromosomes(self):
+        """The variants on the skipped chromosomes are not parsed."""
+        envelopes = get_envelopes(self.variant_file, split_chromosomes = True, skip_chromosomes = ['1', '3'])
+        assert [checkpoint.get_chromosome(envelope) for envelope in envelopes] == ['2']
+
+    def test_finish_chromosome(self):
+        """A chromosome is finished before the first envelope of the next chromosome is yielded."""
+        events = []
+        envelopes = get_envelopes(self.variant_file, envelope_size = 2, split_chromosomes = True)
+        for envelope in checkpoint.checkpoint_envelopes(envelopes, events.append):
+            events.append(checkpoint.get_chromosome(envelope))
+        assert events == ['1', '1', '2', '2', '3', '3']
+
+    def test_chromosomes_not_together(self):
+        """The variants of a chromosome must be together in the file."""
+        envelopes = get_envelopes(self.variant_file, split_chromosomes = True)
+        try:
+            list(checkpoint.checkpoint_envelopes(envelopes + envelopes, lambda chromosome: None))
+        except ValueError:
+            pass
+        else:
+            assert False
+
+    def teardown_class(self):
+        os.remove(self.variant_file)
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
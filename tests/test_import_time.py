@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_import_time.py
+
+Test that importing the package and starting the analysis script does not import the modules that are only
+used by some of the options, and that the imports of the script are within a budget.
+"""
+
+import sys
+import os
+import subprocess
+
+import Mip_Family_Analysis
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts',
+                        'run_mip_family_analysis.py')
+RUN_SCRIPT = "import runpy; runpy.run_path(%r, run_name='run_mip_family_analysis')"
+
+# The modules that are imported when they are used and not when the script starts:
+LAZY_MODULES = ['pkg_resources', 'numpy', 'ped_parser', 'Mip_Family_Analysis.Utils.annotation_parser']
+# The package itself does not start any workers:
+PACKAGE_LAZY_MODULES = LAZY_MODULES + ['multiprocessing']
+
+# The imports of the script may take this many times as long as the imports of the interpreter when it runs an
+# empty script. The budget follows the speed of the machine, numpy alone takes more than the whole budget.
+IMPORT_TIME_FACTOR = 4
+# The fastest run is used, the first run is often slow since the files are not cached
+IMPORT_TIME_RUNS = 3
+
+def get_imported_modules(code):
+    """Run the code in a new interpreter and return the names of the modules in sys.modules afterwards."""
+    code += "; import sys; print('\\n'.join(sys.modules))"
+    process = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                universal_newlines=True)
+    assert process.returncode == 0, process.stderr
+    return set(process.stdout.split())
+
+def get_import_times(script):
+    """Run a script with -X importtime and return {module:cumulative_microseconds} for the top level modules.
+
+    The nested imports are indented in the output and are included in the time of the module that imports them.
+    """
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', RUN_SCRIPT % script],
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    assert process.returncode == 0, process.stderr
+    import_times = {}
+    for line in process.stderr.splitlines():
+        if line.startswith('import time:'):
+            self_time, cumulative, module = line[len('import time:'):].split('|')
+            if cumulative.strip().isdigit() and not module[1:].startswith(' '):
+                import_times[module.strip()] = int(cumulative)
+    return import_times
+
+def test_lazy_imports():
+    """The heavy modules are not imported when the script starts."""
+    modules = get_imported_modules(RUN_SCRIPT % SCRIPT)
+    assert 'Mip_Family_Analysis.Variants.variant_parser' in modules
+    for module in LAZY_MODULES:
+        assert module not in modules
+
+def test_import_time(tmpdir):
+    """The imports of the script are within the budget, relative to the imports of an empty script."""
+    empty_script = tmpdir.join('empty.py')
+    empty_script.write('')
+    baseline_times = [get_import_times(str(empty_script)) for i in range(IMPORT_TIME_RUNS)]
+    baseline = min(sum(import_times.values()) for import_times in baseline_times)
+    baseline_modules = set(module for import_times in baseline_times for module in import_times)
+    script_times = [get_import_times(SCRIPT) for i in range(IMPORT_TIME_RUNS)]
+    assert 'Mip_Family_Analysis.Variants.variant_parser' in script_times[0]
+    # The modules that are imported to run any script are not counted
+    script_time = min(sum(import_times[module] for module in import_times if module not in baseline_modules)
+                        for import_times in script_times)
+    assert script_time < IMPORT_TIME_FACTOR * baseline, ('The script imports in %s microseconds, the budget is %s'
+                                                            % (script_time, IMPORT_TIME_FACTOR * baseline))
+
+def test_package_imports():
+    """Importing the package and looking up the version does not import numpy or multiprocessing."""
+    modules = get_imported_modules("import Mip_Family_Analysis; Mip_Family_Analysis.get_version()")
+    assert 'Mip_Family_Analysis' in modules
+    for module in PACKAGE_LAZY_MODULES:
+        assert module not in modules
+
+def test_version():
+    """The version is looked up once."""
+    version = Mip_Family_Analysis.get_version()
+    assert version
+    assert Mip_Family_Analysis.get_version() is version
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
@@ -34,6 +34,22 @@ class TestPairGenerator(object):
         with pytest.raises(StopIteration):
             next(my_pairs)
     
+    def test_rows(self):
+        """Test that only the pairs of the given rows are generated"""
+        my_pairs = list(self.my_pair_generator.generate_pairs(1, 2))
+        assert my_pairs == [('2', '3'), ('2', 'f')]
+
+def test_row_tiles():
+    """The tiles should cover all pairs once with at most max_pairs in each tile"""
+    objects = list(range(20))
+    tiles = pair_generator.get_row_tiles(len(objects), 30)
+    my_pair_generator = pair_generator.Pair_Generator(objects)
+    tile_pairs = [list(my_pair_generator.generate_pairs(first_row, last_row)) for first_row, last_row in tiles]
+    assert [pair for pairs in tile_pairs for pair in pairs] == list(my_pair_generator.generate_pairs())
+    assert max(len(pairs) for pairs in tile_pairs) <= 30
+    # A row that is bigger than max_pairs is a tile of its own
+    assert pair_generator.get_row_tiles(4, 2) == [(0, 1), (1, 2), (2, 3)]
+    assert pair_generator.get_row_tiles(1, 2) == []
 
 def main():
     pass
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_run_mip_family_analysis.py
+
+Test that the analysis script prints the same results when the variants are checked in one process and with
+workers.
+"""
+
+import sys
+import os
+import importlib.util
+
+from tests.test_variant_consumer import get_family
+from tests.test_variant_file_parser import make_variant_file
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts',
+                        'run_mip_family_analysis.py')
+
+def get_script(monkeypatch):
+    """Load the script as a module, the pedigree file is read as the family of get_family."""
+    spec = importlib.util.spec_from_file_location('run_mip_family_analysis', SCRIPT)
+    script = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(script)
+    monkeypatch.setattr(script, 'get_families', lambda family_file, family_type = 'mip': [get_family()])
+    return script
+
+def run_script(monkeypatch, variant_file, outfile, options):
+    """Run the script with the options and return the bytes of the results file."""
+    monkeypatch.setattr(sys, 'argv', ['run_mip_family_analysis.py', 'family.ped', variant_file, '-o', outfile,
+                                        '-v'] + options)
+    get_script(monkeypatch).main()
+    with open(outfile, 'rb') as f:
+        return f.read()
+
+class TestInline(object):
+    """Run the script on a small file in one process and with workers."""
+
+    def setup_class(self):
+        """Setup a file with compound pairs in two genes and some intergenic variants on two chromosomes."""
+        variants = []
+        for chrom in ['1', '2']:
+            variants += [(chrom, 10, 'ADK', ['0/1', '0/1', '0/0']), (chrom, 20, 'ADK', ['0/1', '0/0', '0/1']),
+                            (chrom, 30, 'POT1', ['0/1', '0/1', '0/0']), (chrom, 40, 'POT1', ['0/1', '0/0', '0/1']),
+                            (chrom, 500, '-', ['1/1', '0/1', '0/1']), (chrom, 600, '-', ['0/1', '0/0', '0/0'])]
+        self.variant_file = make_variant_file(variants)
+
+    def test_same_output(self, tmpdir, monkeypatch, capsys):
+        """The results files are the same, byte for byte."""
+        inline_results = run_script(monkeypatch, self.variant_file, str(tmpdir.join('inline.txt')),
+                                        ['--inline', '-e', '1'])
+        assert 'Checking the variants in one process' in capsys.readouterr().out
+        worker_results = run_script(monkeypatch, self.variant_file, str(tmpdir.join('workers.txt')),
+                                        ['-w', '1', '-e', '1'])
+        assert 'Checking the variants in one process' not in capsys.readouterr().out
+        assert inline_results == worker_results
+        assert inline_results.count(b'\n1\t') == 6
+
+    def test_small_file(self, tmpdir, monkeypatch, capsys):
+        """A file smaller than INLINE_FILE_SIZE is checked in one process if the number of workers is not given."""
+        assert os.path.getsize(self.variant_file) < get_script(monkeypatch).INLINE_FILE_SIZE
+        run_script(monkeypatch, self.variant_file, str(tmpdir.join('results.txt')), [])
+        assert 'Checking the variants in one process' in capsys.readouterr().out
+
+    def teardown_class(self):
+        os.remove(self.variant_file)
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
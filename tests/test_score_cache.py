@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_score_cache.py
+
+Test that the annotation scores are stored and used again.
+"""
+
+import sys
+import os
+
+from Mip_Family_Analysis.Models import score_variants
+from Mip_Family_Analysis.Utils import score_cache, variant_consumer
+from tests.test_score_variants import get_variants
+from tests.test_variant_consumer import get_family, get_envelope
+
+def add_positions(variants):
+    """Give all variants a unique position."""
+    for variant_id in variants:
+        variants[variant_id].update({'Chromosome':'1', 'Variant_start':str(variant_id),
+                                        'Reference_allele':'A', 'Alternative_allele':'T'})
+    return variants
+
+def test_roundtrip(tmpdir):
+    """Scores that are added should be found by a new connection."""
+    database = str(tmpdir.join('scores.db'))
+    variants = add_positions(get_variants())
+    my_cache = score_cache.ScoreCache(database)
+    keys = my_cache.get_keys(variants)
+    assert my_cache.get_scores(keys) == {}
+    annotation_scores = {}
+    score_variants.score_batch(variants, [], annotation_scores = annotation_scores)
+    my_cache.add_scores(keys, annotation_scores)
+    my_cache.close()
+    my_cache = score_cache.ScoreCache(database)
+    assert len(my_cache) == len(variants)
+    assert my_cache.get_scores(my_cache.get_keys(variants)) == annotation_scores
+    my_cache.close()
+
+def test_new_version(tmpdir):
+    """Scores from another rank model should not be used."""
+    database = str(tmpdir.join('scores.db'))
+    variants = add_positions({0:get_variants()[0]})
+    my_cache = score_cache.ScoreCache(database)
+    my_cache.add_scores(my_cache.get_keys(variants), {0:100})
+    assert my_cache.get_scores(my_cache.get_keys(variants)) == {0:100}
+    other_cache = score_cache.ScoreCache(database, 'other:0123456789')
+    assert other_cache.get_scores(other_cache.get_keys(variants)) == {}
+    variants[0]['GT_call_filter'] = 'PASS'
+    assert my_cache.get_scores(my_cache.get_keys(variants)) == {}
+
+def test_consumer_scores(tmpdir):
+    """The consumer should give the same scores with and without the cache, both on the first and second run."""
+    database = str(tmpdir.join('scores.db'))
+    results = []
+    for score_cache_file in [None, database, database]:
+        consumer = variant_consumer.VariantConsumer(None, None, get_family(), score_cache_file = score_cache_file)
+        variants = {}
+        for batch in get_envelope():
+            variants.update(consumer.process_batch(batch))
+        results.append(variants)
+    assert results[0] == results[1] == results[2]
+
+def test_cached_score_is_used(tmpdir):
+    """A score in the cache is used instead of scoring the annotations."""
+    database = str(tmpdir.join('scores.db'))
+    envelope = get_envelope()
+    my_cache = score_cache.ScoreCache(database)
+    my_cache.add_scores(my_cache.get_keys(envelope[1]['-']), {2:100})
+    my_cache.close()
+    consumer = variant_consumer.VariantConsumer(None, None, get_family(), score_cache_file = database)
+    variants = consumer.process_batch(envelope[1])
+    # The intergenic variant is AR_hom which is not a prefered model
+    assert variants[2]['Individual_rank_score'] == '101'
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
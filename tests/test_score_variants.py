@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_score_variants.py
+
+Test that the batch scoring gives the same scores as when the variants are scored one by one.
+"""
+
+import sys
+import os
+import copy
+import itertools
+
+from Mip_Family_Analysis.Models import score_variants, rank_model
+
+RANK_MODEL_CONFIG = os.path.join(os.path.dirname(rank_model.__file__), 'rank_model.ini')
+
+def get_variants():
+    """Return a dictionary with variants that covers the different values of the score columns."""
+    variants = {}
+    numbers = [None, '-', '0', '0.005', '0.01', '0.02', '0.5', '0.95', '0.999', '2', '4', 'nan']
+    strings = [None, '-', 'PASS', 'PRES', 'yes']
+    models = [{}, {'AD':True, 'AR_comp':False}, {'AR_comp':True, 'AD':False}]
+    annotations = [None, 'ADK:missense_variant', 'ADK:intron_variant,POT1:stop_gained', 'ADK', 'ADK:unknown']
+    for i, values in enumerate(itertools.product(numbers, numbers[::-1], strings, models, annotations)):
+        number, other_number, string, model, annotation = values
+        variant = {'SIFT':number, 'Mutation_taster':other_number, 'Poly_phen':number, '1000G':number,
+                    'Dbsnp129':other_number, 'HBVDB':number, 'Dbsnp_nonflagged':string, 'GT_call_filter':string,
+                    'GERP':other_number, 'Phylo_p':number, 'Phast_cons_lements':string, 'GERP_elements':string,
+                    'Genomic_super_dups':string, 'HGMD':string, 'Inheritance_model':model}
+        if annotation:
+            variant['Functional_annotation'] = annotation
+        if i % 2:
+            variant['Poly_phen_hdiv'] = other_number
+        variants[i] = variant
+    return variants
+
+def test_score_batch():
+    """The scores should be the same as with score_variant."""
+    variants = get_variants()
+    batch_variants = copy.deepcopy(variants)
+    score_variants.score_variant(variants, ['AR_comp'])
+    score_variants.score_batch(batch_variants, ['AR_comp'])
+    for variant_id in variants:
+        assert (type(batch_variants[variant_id]['Individual_rank_score']) ==
+                    type(variants[variant_id]['Individual_rank_score']))
+        assert batch_variants[variant_id]['Individual_rank_score'] == variants[variant_id]['Individual_rank_score']
+
+def test_default_config():
+    """The config that comes with the package should compile to the default model."""
+    compiled_model = rank_model.RankModel.from_config(RANK_MODEL_CONFIG)
+    assert compiled_model.version == rank_model.default_rank_model.version
+
+def test_custom_config(tmpdir):
+    """Scores from a changed config should be used by both scoring functions."""
+    config = open(RANK_MODEL_CONFIG).read()
+    config = config.replace('name = default', 'name = strict').replace('PASS = 3', 'PASS = 10')
+    config_file = tmpdir.join('strict.ini')
+    config_file.write(config)
+    strict_model = rank_model.RankModel.from_config(str(config_file))
+    assert strict_model.version != rank_model.default_rank_model.version
+    variants = get_variants()
+    strict_variants = copy.deepcopy(variants)
+    batch_variants = copy.deepcopy(variants)
+    score_variants.score_variant(variants, [])
+    score_variants.score_variant(strict_variants, [], strict_model)
+    score_variants.score_batch(batch_variants, [], strict_model)
+    for variant_id in variants:
+        extra_score = 0
+        if variants[variant_id]['GT_call_filter'] == 'PASS':
+            extra_score = 7
+        assert (strict_variants[variant_id]['Individual_rank_score'] == 
+                    variants[variant_id]['Individual_rank_score'] + extra_score)
+        assert (batch_variants[variant_id]['Individual_rank_score'] == 
+                    strict_variants[variant_id]['Individual_rank_score'])
+
+def test_annotation_cache():
+    """The same annotation should only be parsed once."""
+    annotation = 'CACHE_TEST:missense_variant,CACHE_TEST_2:stop_gained'
+    misses = score_variants.annotation_cache_info()['score']['misses']
+    hits = score_variants.annotation_cache_info()['score']['hits']
+    assert score_variants.get_functional_annotation_score(annotation) == 5
+    assert score_variants.get_functional_annotation_score(annotation) == 5
+    assert score_variants.annotation_cache_info()['score']['misses'] == misses + 1
+    assert score_variants.annotation_cache_info()['score']['hits'] == hits + 1
+    assert score_variants.get_functional_annotation({'Functional_annotation':annotation}) == {
+                'CACHE_TEST':'missense_variant', 'CACHE_TEST_2':'stop_gained'}
+
+def test_score_empty_batch():
+    """An empty batch should not fail."""
+    score_variants.score_batch({})
+
+def test_get_number():
+    """get_number should behave like is_number followed by float."""
+    assert score_variants.get_number('0.5') == 0.5
+    assert score_variants.get_number(1) == 1.0
+    assert score_variants.get_number('-') is None
+    assert score_variants.get_number(None) is None
+
+def test_frequency_score_is_integer():
+    """An odd sum of frequency scores is rounded down, the rank scores are parsed with int when they are printed."""
+    frequencies = {'1000G':'0.001', 'Dbsnp129':'0.001', 'HBVDB':'0.01'}
+    score = score_variants.check_frequency_score(frequencies['1000G'], frequencies['Dbsnp129'], frequencies['HBVDB'])
+    assert score == 2
+    assert isinstance(score, int)
+    variants = {0:frequencies}
+    score_variants.score_variant(variants)
+    assert int(str(variants[0]['Individual_rank_score'])) == variants[0]['Individual_rank_score']
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
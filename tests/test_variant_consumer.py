@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_variant_consumer.py
+
+Test that the VariantConsumer checks, scores and prepares the batches for printing.
+"""
+
+import sys
+import os
+import multiprocessing
+from multiprocessing import JoinableQueue
+from queue import Queue
+from ped_parser import family, individual
+
+from Mip_Family_Analysis.Utils import variant_consumer
+from Mip_Family_Analysis.Variants import genotype
+
+def get_family():
+    """Return a family with a sick son and two healthy parents."""
+    my_family = family.Family(family_id='1', individuals={}, models_of_inheritance=['AR_comp'])
+    my_family.add_individual(individual.Individual(ind='1', family='1', mother='3', father='2', sex=1, phenotype=2))
+    my_family.add_individual(individual.Individual(ind='2', family='1', mother='0', father='0', sex=1, phenotype=1))
+    my_family.add_individual(individual.Individual(ind='3', family='1', mother='0', father='0', sex=2, phenotype=1))
+    return my_family
+
+def get_variant(chrom, pos, genotypes):
+    """Return a variant dictionary with the given genotypes for individuals 1, 2 and 3."""
+    variant = {'Chromosome':chrom, 'Variant_start':pos, 'Reference_allele':'A', 'Alternative_allele':'T',
+                'GT_call_filter':'PASS', 'Functional_annotation':'ADK:missense_variant'}
+    variant['Genotypes'] = dict((ind, genotype.Genotype(GT=gt)) for ind, gt in zip(['1', '2', '3'], genotypes))
+    return variant
+
+def get_envelope():
+    """Return an envelope with one gene batch with a compound pair and one intergenic batch."""
+    gene_batch = {'ADK':{0:get_variant('1', '10', ['0/1', '0/1', '0/0']),
+                         1:get_variant('1', '20', ['0/1', '0/0', '0/1'])}}
+    intergenic_batch = {'-':{2:get_variant('1', '500', ['1/1', '0/1', '0/1'])}}
+    return [gene_batch, intergenic_batch]
+
+class TestVariantConsumer(object):
+    """Test how the consumer handle envelopes."""
+
+    def setup_class(self):
+        """Process all batches of an envelope."""
+        self.consumer = variant_consumer.VariantConsumer(None, None, get_family())
+        self.variants = {}
+        for batch in get_envelope():
+            self.variants.update(self.consumer.process_batch(batch))
+
+    def test_all_variants(self):
+        """All variants of the envelope should be returned."""
+        assert len(self.variants) == 3
+
+    def test_compounds(self):
+        """The variants in the gene are a compound pair."""
+        assert self.variants[0]['Inheritance_model'] == 'AR_comp'
+        assert self.variants[0]['Compounds'].startswith('1_20_A_T=')
+        assert self.variants[1]['Compounds'].startswith('1_10_A_T=')
+
+    def test_recessive(self):
+        """The intergenic variant is homozygote in the sick son."""
+        assert self.variants[2]['Inheritance_model'] == 'AR_hom'
+        assert self.variants[2]['Compounds'] == '-'
+
+    def test_no_compounds(self):
+        """If compounds are not checked no pairs should be found."""
+        consumer = variant_consumer.VariantConsumer(None, None, get_family(), compounds=False)
+        variants = consumer.process_batch(get_envelope()[0])
+        assert variants[0]['Inheritance_model'] == 'NA'
+        assert variants[0]['Compounds'] == '-'
+
+class TestPrefilter(object):
+    """Test that the common variants are filtered without changing the other variants."""
+
+    def setup_class(self):
+        """Make the first variant of the compound pair and the intergenic variant common."""
+        self.batches = get_envelope()
+        self.batches[0]['ADK'][0]['1000G'] = '0.5'
+        self.batches[1]['-'][2]['1000G'] = '0.5'
+        consumer = variant_consumer.VariantConsumer(None, None, get_family(), treshold = 0, prefilter = True)
+        self.variants = {}
+        for batch in self.batches:
+            self.variants.update(consumer.process_batch(batch))
+
+    def test_skip_models(self):
+        """The common variants that are not compound candidates should not get any models."""
+        assert self.batches[0]['ADK'][0]['Inheritance_model'] == 'AR_comp'
+        assert self.batches[1]['-'][2]['Inheritance_model'] == 'NA'
+
+    def test_treshold(self):
+        """Only the rare variant should reach the treshold."""
+        assert list(self.variants) == [1]
+
+    def test_same_as_without_prefilter(self):
+        """The variants that are left should be the same as without the prefilter."""
+        batches = get_envelope()
+        batches[0]['ADK'][0]['1000G'] = '0.5'
+        batches[1]['-'][2]['1000G'] = '0.5'
+        consumer = variant_consumer.VariantConsumer(None, None, get_family(), treshold = 0)
+        variants = {}
+        for batch in batches:
+            variants.update(consumer.process_batch(batch))
+        assert variants == self.variants
+        assert variants[1]['Compounds'].startswith('1_10_A_T=')
+
+class TestPrefilterCompoundPartner(object):
+    """Test that a common compound candidate keeps its models when the father is sick."""
+
+    def get_variants(self, prefilter):
+        """Return the variants of a compound pair where the common variant also follows AD.
+
+        AD is the prefered model and the common variant is also the only variant of a second gene."""
+        my_family = get_family()
+        my_family.models_of_inheritance = ['AD']
+        my_family.individuals['2'] = individual.Individual(ind='2', family='1', mother='0', father='0', sex=1,
+                                                            phenotype=2)
+        common_variant = get_variant('1', '10', ['0/1', '0/1', '0/0'])
+        common_variant['1000G'] = '0.5'
+        gene_batch = {'ADK':{0:common_variant, 1:get_variant('1', '20', ['0/1', '0/1', '0/0'])},
+                        'POT1':{0:common_variant}}
+        consumer = variant_consumer.VariantConsumer(None, None, my_family, treshold = 0, prefilter = prefilter)
+        return consumer.process_batch(gene_batch)
+
+    def test_partner_models(self):
+        """The common variant follows AD and is a compound with the rare variant."""
+        variants = self.get_variants(True)
+        assert variants[1]['Compounds'].startswith('1_10_A_T=')
+        assert variants[1]['Compounds'] == self.get_variants(False)[1]['Compounds']
+
+    def test_same_as_without_prefilter(self):
+        """The variants that reach the treshold are the same as without the prefilter."""
+        assert self.get_variants(True) == self.get_variants(False)
+
+class TestPhased(object):
+    """Test the compounds when the sick son is phased."""
+
+    def get_variants(self, son_genotypes, son_haploblocks):
+        """Return the variants of the compound pair with phased genotypes for the son."""
+        gene_batch = get_envelope()[0]
+        for variant_id, gt, haploblock in zip([0, 1], son_genotypes, son_haploblocks):
+            gene_batch['ADK'][variant_id]['Genotypes']['1'] = genotype.Genotype(GT=gt)
+            gene_batch['ADK'][variant_id]['Haploblocks'] = {'1':haploblock}
+        consumer = variant_consumer.VariantConsumer(None, None, get_family(), phased = True)
+        return consumer.process_batch(gene_batch)
+
+    def test_trans(self):
+        """Variants on different alleles are compounds."""
+        variants = self.get_variants(['0|1', '1|0'], [1, 1])
+        assert variants[0]['Inheritance_model'] == 'AR_comp'
+
+    def test_cis(self):
+        """Variants on the same allele are not compounds."""
+        variants = self.get_variants(['0|1', '0|1'], [1, 1])
+        assert variants[0]['Inheritance_model'] == 'NA'
+
+    def test_different_haploblocks(self):
+        """If the variants are not phased together the parents decide."""
+        variants = self.get_variants(['0|1', '0|1'], [1, 2])
+        assert variants[0]['Inheritance_model'] == 'AR_comp'
+
+def test_several_families():
+    """All families should be checked in one pass, without changing the results of each other."""
+    single_family = family.Family(family_id='2', individuals={}, models_of_inheritance=['AR_hom'])
+    single_family.add_individual(individual.Individual(ind='1', family='2', mother='0', father='0', sex=1, 
+                                                        phenotype=2))
+    task_queue = JoinableQueue()
+    results_queue = Queue()
+    task_queue.put(get_envelope())
+    task_queue.put(None)
+    consumer = variant_consumer.VariantConsumer(task_queue, results_queue, None, 
+                                                    families = [get_family(), single_family])
+    consumer.run()
+    results = results_queue.get()
+    assert sorted(results) == ['1', '2']
+    expected = {}
+    for batch in get_envelope():
+        expected.update(variant_consumer.VariantConsumer(None, None, get_family()).process_batch(batch))
+    assert results['1'] == expected
+    # Without parents the homozygote variant is also de novo:
+    assert results['2'][2]['Inheritance_model'] == 'AR_hom:AR_hom_dn'
+    assert results['2'][2]['Rank_score'] != results['1'][2]['Rank_score']
+
+class TestTiles(object):
+    """Test that the compound pairs of a big gene are the same when the gene is split in tiles."""
+
+    def get_gene(self):
+        """Return a gene where the variants from the father are compounds with the variants from the mother."""
+        genotypes = [['0/1', '0/1', '0/0'], ['0/1', '0/0', '0/1']]
+        return {'ADK':dict((i, get_variant('1', str(i), genotypes[i % 2])) for i in range(10))}
+
+    def test_split(self):
+        """The consumer checks its own tiles if no one else does."""
+        expected = variant_consumer.VariantConsumer(None, None, get_family()).process_batch(self.get_gene())
+        consumer = variant_consumer.VariantConsumer(None, None, get_family(), tile_queue = multiprocessing.Queue())
+        consumer.tile_size = 10
+        variants = consumer.process_batch(self.get_gene())
+        assert consumer.split_genes == 1
+        assert variants == expected
+        assert variants[0]['Compounds'].count('=') == 5
+
+    def test_help_with_tile(self):
+        """The pairs of a tile from another consumer are sent back to it."""
+        variants = self.get_gene()['ADK']
+        reader, writer = multiprocessing.Pipe(duplex=False)
+        tile = (('other', 1), writer, 3, variants, sorted(variants), get_family(), False, 0, 2)
+        variant_consumer.VariantConsumer(None, None, get_family()).help_with_tile(tile)
+        tile_number, pairs = reader.recv()
+        assert tile_number == 3
+        assert pairs == [(0, 1), (0, 3), (0, 5), (0, 7), (0, 9), (1, 2), (1, 4), (1, 6), (1, 8)]
+
+def test_copy_batch():
+    """A variant in several features is the same dictionary in the copy."""
+    variant = {'Chromosome':'1'}
+    batch_copy = variant_consumer.copy_batch({'ADK':{0:variant}, 'POT1':{0:variant}})
+    assert batch_copy['ADK'][0] is batch_copy['POT1'][0]
+    assert batch_copy['ADK'][0] is not variant
+    assert batch_copy['ADK'][0] == variant
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
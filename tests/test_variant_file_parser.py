@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_variant_file_parser.py
+
+Test how the VariantFileParser split the variants into batches.
+"""
+
+import sys
+import os
+from queue import Queue
+from tempfile import NamedTemporaryFile
+
+from Mip_Family_Analysis.Variants import variant_parser
+from Mip_Family_Analysis.Utils import header_parser, mmap_reader, annotation_parser, variant_consumer
+from tests.test_variant_consumer import get_family
+
+HEADER_COLUMNS = ['Chromosome', 'Variant_start', 'Variant_stop', 'Reference_allele', 'Alternative_allele',
+                    'HGNC_symbol']
+INDIVIDUALS = ['1', '2', '3']
+
+def make_variant_file(variants):
+    """Write a cmms file with the given variants on the form (chrom, pos, gene, [genotypes])."""
+    variant_file = NamedTemporaryFile(mode='w', suffix='.txt', delete=False)
+    for column in HEADER_COLUMNS:
+        variant_file.write('##COLUMNNAME="%s"\n' % column)
+    variant_file.write('#' + '\t'.join(HEADER_COLUMNS + ['IDN:' + ind for ind in INDIVIDUALS]) + '\n')
+    for chrom, pos, gene, genotypes in variants:
+        line = [chrom, str(pos), str(pos), 'A', 'T', gene]
+        line += ['%s:GT=%s' % (ind, gt) for ind, gt in zip(INDIVIDUALS, genotypes)]
+        variant_file.write('\t'.join(line) + '\n')
+    variant_file.close()
+    return variant_file.name
+
+def get_envelopes(variant_file, **kwargs):
+    """Parse the file and return all envelopes that was put on the queue."""
+    batch_queue = Queue()
+    head = header_parser.HeaderParser(variant_file)
+    my_parser = variant_parser.VariantFileParser(variant_file, batch_queue, head, **kwargs)
+    my_parser.parse()
+    envelopes = []
+    while not batch_queue.empty():
+        envelopes.append(batch_queue.get())
+    return envelopes
+
+def get_batches(variant_file, **kwargs):
+    """Parse the file and return all batches in the order they where put on the queue."""
+    return [batch for envelope in get_envelopes(variant_file, **kwargs) for batch in envelope]
+
+class TestBatchSize(object):
+    """Test that the batches are split correctly."""
+
+    def setup_class(self):
+        """Setup a file with five intergenic variants followed by four variants in one gene."""
+        variants = [('1', pos, 'dist=1000', ['0/1', '0/1', '0/0']) for pos in range(1, 6)]
+        variants += [('1', pos, 'ADK', ['0/1', '0/1', '0/0']) for pos in range(10, 14)]
+        self.variant_file = make_variant_file(variants)
+
+    def test_no_max_size(self):
+        """Without a max size there is one intergenic batch and one gene batch."""
+        batches = get_batches(self.variant_file)
+        assert len(batches) == 2
+        assert len(batches[0]['-']) == 5
+        assert len(batches[1]['ADK']) == 4
+
+    def test_split_intergenic(self):
+        """Intergenic batches are split but the gene is kept together."""
+        batches = get_batches(self.variant_file, max_batch_size=2)
+        assert [len(batch.get('-', {})) for batch in batches] == [2, 2, 1, 0]
+        assert len(batches[-1]['ADK']) == 4
+
+    def test_split_genes(self):
+        """Gene batches are split if we say so."""
+        batches = get_batches(self.variant_file, max_batch_size=2, split_genes=True)
+        assert [len(batch.get('ADK', {})) for batch in batches] == [0, 0, 0, 2, 2]
+
+    def test_one_batch_per_envelope(self):
+        """By default each batch is sent in its own envelope."""
+        envelopes = get_envelopes(self.variant_file, max_batch_size=2)
+        assert [len(envelope) for envelope in envelopes] == [1, 1, 1, 1]
+
+    def test_envelopes(self):
+        """Small batches are packed together until the envelope is big enough."""
+        envelopes = get_envelopes(self.variant_file, max_batch_size=2, envelope_size=4)
+        assert [len(envelope) for envelope in envelopes] == [2, 2]
+        assert len(envelopes[1][1]['ADK']) == 4
+
+    def test_mmap_reader(self):
+        """The mmap reader should give the same batches as the text reader."""
+        text_batches = get_batches(self.variant_file)
+        mmap_batches = get_batches(self.variant_file, reader='mmap')
+        assert [sorted(batch) for batch in text_batches] == [sorted(batch) for batch in mmap_batches]
+        for text_batch, mmap_batch in zip(text_batches, mmap_batches):
+            for feature in text_batch:
+                for variant_id in text_batch[feature]:
+                    text_variant = text_batch[feature][variant_id]
+                    mmap_variant = mmap_batch[feature][variant_id]
+                    assert mmap_variant['Chromosome'] == text_variant['Chromosome']
+                    assert mmap_variant['Variant_stop'] == text_variant['Variant_stop'].encode('utf-8')
+                    for individual in INDIVIDUALS:
+                        assert (mmap_variant['Genotypes'][individual].genotype == 
+                                    text_variant['Genotypes'][individual].genotype)
+
+    def teardown_class(self):
+        """Remove the variant file"""
+        os.remove(self.variant_file)
+
+class TestVcf(object):
+    """Test that variants in the vcf format are parsed like cmms variants."""
+
+    def setup_class(self):
+        """Setup a small vcf file with two variants in one gene and one without genes."""
+        vcf_lines = [
+            '##fileformat=VCFv4.1',
+            '##INFO=<ID=HGNC_symbol,Number=.,Type=String,Description="Gene">',
+            '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t1\t2\t3',
+            'chr1\t10\t.\tA\tT\t100\tPASS\tHGNC_symbol=ADK;DB\tGT:AD\t0/1:10,10\t0/1:10,10\t0/0:20,0',
+            'chr1\t20\t.\tA\tT\t100\tPASS\tHGNC_symbol=ADK\tAD:DP:GT\t10,10:20:0/1\t20,0:20:0/0\t.',
+            'chr1\t500\t.\tA\tT\t100\tPASS\t.\tGT\t1/1\t0/1\t0/1',
+        ]
+        with NamedTemporaryFile(mode='w', suffix='.vcf', delete=False) as f:
+            f.write('\n'.join(vcf_lines) + '\n')
+        self.vcf_file = f.name
+
+    def test_header(self):
+        """The individuals are the columns after FORMAT."""
+        head = header_parser.HeaderParser(self.vcf_file)
+        assert head.file_type == 'vcf'
+        assert head.individuals == ['1', '2', '3']
+        assert head.get_headers_for_print()[0] == '##fileformat=VCFv4.1'
+
+    def test_batches(self):
+        """The gene variants should be in one batch."""
+        for reader in ['text', 'mmap']:
+            batches = get_batches(self.vcf_file, reader=reader)
+            assert len(batches) == 2
+            assert sorted(batches[0]['ADK']) == [0, 1]
+            variant = batches[0]['ADK'][1]
+            assert variant_parser.get_variant_id(variant) == 'chr1_20_A_T'
+            assert variant['Chromosome'] == '1'
+            assert variant['Genotypes']['1'].genotype == '0/1'
+            assert variant['Genotypes']['2'].genotype == '0/0'
+            assert variant['Genotypes']['3'].genotype == './.'
+            assert batches[1]['-'][2]['Genotypes']['1'].homo_alt
+
+    def test_compound_ids(self):
+        """The compounds are printed with the chromosome of the vcf."""
+        batches = get_batches(self.vcf_file)
+        variants = variant_consumer.VariantConsumer(None, None, get_family()).process_batch(batches[0])
+        assert variants[0]['CHROM'] == 'chr1'
+        assert variants[0]['Compounds'].startswith('chr1_20_A_T=')
+        assert variants[1]['Compounds'].startswith('chr1_10_A_T=')
+
+    def test_format_value(self):
+        """Get values from a sample field."""
+        assert variant_parser.get_format_value('0/1:10,10:20', 0) == '0/1'
+        assert variant_parser.get_format_value('10,10:20:0/1', 2) == '0/1'
+        assert variant_parser.get_format_value('0/1', 1) is None
+
+    def teardown_class(self):
+        """Remove the vcf file"""
+        os.remove(self.vcf_file)
+
+def test_haploblocks(tmpdir):
+    """Phased genotypes in the same phase set should get the same haploblock."""
+    vcf_lines = [
+        '##fileformat=VCFv4.1',
+        '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t1\t2\t3',
+        '1\t10\t.\tA\tT\t100\tPASS\tHGNC_symbol=ADK\tGT:PS\t0|1:10\t0|1\t0/1',
+        '1\t20\t.\tA\tT\t100\tPASS\tHGNC_symbol=ADK\tGT:PS\t1|0:10\t1|0:.\t0/1',
+        '1\t30\t.\tA\tT\t100\tPASS\tHGNC_symbol=ADK\tGT:PS\t1|0:30\t0/1\t0/1',
+        '2\t30\t.\tA\tT\t100\tPASS\tHGNC_symbol=ADK\tGT:PS\t1|0:10\t1|0\t0/1',
+    ]
+    vcf_file = tmpdir.join('phased.vcf')
+    vcf_file.write('\n'.join(vcf_lines) + '\n')
+    for reader in ['text', 'mmap']:
+        variants = get_batches(str(vcf_file), reader = reader, phased = True)[0]['ADK']
+        haploblocks = [variants[variant_id]['Haploblocks'] for variant_id in sorted(variants)]
+        assert haploblocks[0]['1'] == haploblocks[1]['1'] != haploblocks[2]['1']
+        assert haploblocks[0]['2'] == haploblocks[1]['2']
+        assert '2' not in haploblocks[2]
+        assert '3' not in haploblocks[0]
+        # Phase sets are only valid within a chromosome:
+        assert haploblocks[3]['1'] != haploblocks[0]['1']
+        assert haploblocks[3]['2'] != haploblocks[0]['2']
+    assert 'Haploblocks' not in get_batches(str(vcf_file))[0]['ADK'][0]
+
+def test_mmap_lines():
+    """Lines that are splitted between blocks should be put together."""
+    with NamedTemporaryFile(mode='wb', delete=False) as f:
+        f.write(b'first line\nsecond\tline\n\nlast line')
+    lines = list(mmap_reader.mmap_lines(f.name, block_size=4))
+    os.remove(f.name)
+    assert lines == [b'first line', b'second\tline', b'', b'last line']
+
+def test_annotations(tmpdir):
+    """Variants without a gene should get the genes from the annotations."""
+    annotation_file = tmpdir.join('genes.bed')
+    annotation_file.write('1\t10\t20\tADK\n1\t15\t30\tPOT1\n')
+    annotations = annotation_parser.AnnotationParser(str(annotation_file), 'bed')
+    variant_file = make_variant_file([('1', pos, gene, ['0/1', '0/1', '0/0']) for pos, gene in 
+                                        [(5, '-'), (12, '-'), (16, '-'), (25, '-'), (28, 'OR4F5')]])
+    batches = get_batches(variant_file, annotations = annotations)
+    assert sorted(batches[0]) == ['-']
+    assert sorted(batches[1]) == ['ADK', 'POT1']
+    assert sorted(batches[1]['ADK']) == [1, 2]
+    assert sorted(batches[1]['POT1']) == [2, 3]
+    assert batches[1]['POT1'][2]['HGNC_symbol'] == 'ADK,POT1'
+    # Variants with a gene are not annotated again:
+    assert sorted(batches[2]) == ['OR4F5']
+    os.remove(variant_file)
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
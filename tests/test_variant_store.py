@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_variant_store.py
+
+Test that the variants from a variant store are checked in the same way as the variants from the parser.
+"""
+
+import sys
+import os
+
+from ped_parser import individual
+
+from Mip_Family_Analysis.Models import rank_model
+from Mip_Family_Analysis.Utils import variant_store, variant_consumer, checkpoint
+from tests.test_variant_consumer import get_family
+from tests.test_variant_file_parser import make_variant_file, get_envelopes
+
+SETTINGS = {'phased':False}
+
+def write_store(variant_file, store_file, envelopes):
+    """Write the envelopes to a store and return the envelopes that was yielded."""
+    writer = variant_store.VariantStoreWriter(store_file, variant_file, ['1', '2', '3'], settings = SETTINGS)
+    return list(writer.write_envelopes(envelopes))
+
+def check_envelopes(envelopes, family):
+    """Return the results of all envelopes for a family."""
+    consumer = variant_consumer.VariantConsumer(None, None, family)
+    results = {}
+    for envelope in envelopes:
+        results.update(consumer.process_envelope(envelope)[family.family_id])
+    # The annotation scores from the store are not printed
+    for variant_id in results:
+        results[variant_id].pop(variant_store.ANNOTATION_SCORE, None)
+    return results
+
+def get_sick_father_family():
+    """Return the family with an updated pedigree where the father is sick."""
+    my_family = get_family()
+    my_family.individuals['2'] = individual.Individual(ind='2', family='1', mother='0', father='0', sex=1,
+                                                        phenotype=2)
+    return my_family
+
+class TestVariantStore(object):
+    """Write the variants of two chromosomes to a store and read them back."""
+
+    def setup_class(self):
+        """Setup a file with a compound pair and an intergenic variant on two chromosomes."""
+        variants = []
+        for chrom in ['1', '2']:
+            variants += [(chrom, 10, 'ADK', ['0/1', '0/1', '0/0']), (chrom, 20, 'ADK', ['0/1', '0/0', '0/1']),
+                            (chrom, 500, '-', ['1/1', '0/1', '0|1'])]
+        self.variant_file = make_variant_file(variants)
+
+    def setup_method(self, method):
+        self.store_file = self.variant_file + '.store'
+        write_store(self.variant_file, self.store_file, get_envelopes(self.variant_file, split_chromosomes = True))
+
+    def test_same_results(self):
+        """The results from the store are the same as from the parser, for the old and a new pedigree."""
+        store = variant_store.VariantStore(self.store_file)
+        for family in [get_family(), get_sick_father_family()]:
+            results = check_envelopes(get_envelopes(self.variant_file), family)
+            assert check_envelopes(store.get_envelopes(), family) == results
+        assert store.head.individuals == ['1', '2', '3']
+
+    def test_new_pedigree(self):
+        """A new pedigree gives new models."""
+        store = variant_store.VariantStore(self.store_file)
+        results = check_envelopes(store.get_envelopes(), get_sick_father_family())
+        assert results[0]['Inheritance_model'] == 'AD'
+
+    def test_annotation_scores(self):
+        """The annotation scores from the store are used, unless they are from another rank model."""
+        store = variant_store.VariantStore(self.store_file)
+        envelopes = list(store.get_envelopes())
+        assert envelopes[0][0]['ADK'][0][variant_store.ANNOTATION_SCORE] is not None
+        envelopes[0][0]['ADK'][0][variant_store.ANNOTATION_SCORE] = 100
+        assert int(check_envelopes(envelopes, get_family())[0]['Individual_rank_score']) > 100
+        for envelope in store.get_envelopes(rank_model_version = 'other'):
+            assert variant_store.get_annotation_scores(envelope[0]) == {}
+        for envelope in store.get_envelopes(rank_model_version = rank_model.default_rank_model.version):
+            assert variant_store.get_annotation_scores(envelope[0]) != {}
+
+    def test_skip_chromosomes(self):
+        """The finished chromosomes are skipped."""
+        store = variant_store.VariantStore(self.store_file)
+        envelopes = store.get_envelopes(skip_chromosomes = ['1'])
+        assert set(checkpoint.get_chromosome(envelope) for envelope in envelopes) == set(['2'])
+
+    def test_matches(self):
+        """The store only matches the variant file and the settings that it was written with."""
+        store = variant_store.VariantStore(self.store_file)
+        assert store.matches(self.variant_file, SETTINGS)
+        assert not store.matches(self.variant_file, {'phased':True})
+        os.utime(self.variant_file, (0, 0))
+        assert store.matches(self.variant_file, SETTINGS)
+        with open(self.variant_file, 'a') as f:
+            f.write('\t'.join(['2', '600', '600', 'A', 'T', '-', '1:GT=0/1', '2:GT=0/1', '3:GT=0/1']) + '\n')
+        assert not store.matches(self.variant_file, SETTINGS)
+
+    def test_unfinished_store(self):
+        """A store is only in place when all envelopes are written."""
+        os.remove(self.store_file)
+        writer = variant_store.VariantStoreWriter(self.store_file, self.variant_file, ['1', '2', '3'])
+        envelopes = writer.write_envelopes(get_envelopes(self.variant_file))
+        next(envelopes)
+        assert not os.path.exists(self.store_file)
+        list(envelopes)
+        assert os.path.exists(self.store_file)
+
+    def test_aborted_store(self):
+        """The temporary file is removed and the old store is kept if the envelopes are not all written."""
+        def failing_envelopes():
+            for envelope in get_envelopes(self.variant_file):
+                yield envelope
+                raise IOError('The parser died')
+        writer = variant_store.VariantStoreWriter(self.store_file, self.variant_file, ['1', '2', '3'])
+        try:
+            list(writer.write_envelopes(failing_envelopes()))
+        except IOError:
+            pass
+        else:
+            assert False
+        assert not os.path.exists(writer.temp_file)
+        assert variant_store.VariantStore(self.store_file).matches(self.variant_file, SETTINGS)
+        writer = variant_store.VariantStoreWriter(self.store_file, self.variant_file, ['1', '2', '3'])
+        envelopes = writer.write_envelopes(get_envelopes(self.variant_file))
+        next(envelopes)
+        envelopes.close()
+        assert not os.path.exists(writer.temp_file)
+
+    def teardown_method(self, method):
+        os.remove(self.store_file)
+
+    def teardown_class(self):
+        os.remove(self.variant_file)
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_worker_pool.py
+
+Test that the number of workers follows the available cpus and the depth of the queue.
+"""
+
+import sys
+import os
+from queue import Queue
+
+from Mip_Family_Analysis.Utils import worker_pool
+
+class Worker(object):
+    """A worker that is only counted"""
+    def __init__(self):
+        self.started = False
+
+    def start(self):
+        self.started = True
+
+def test_cgroup_v2(tmpdir):
+    """The quota is rounded up to whole cpus."""
+    cpu_max = tmpdir.join('cpu.max')
+    cpu_max.write('150000 100000\n')
+    assert worker_pool.get_cgroup_cpu_limit(str(tmpdir)) == 2
+    cpu_max.write('max 100000\n')
+    assert worker_pool.get_cgroup_cpu_limit(str(tmpdir)) is None
+
+def test_cgroup_v1(tmpdir):
+    """A quota of -1 is no limit."""
+    tmpdir.mkdir('cpu')
+    tmpdir.join('cpu', 'cpu.cfs_period_us').write('100000\n')
+    tmpdir.join('cpu', 'cpu.cfs_quota_us').write('50000\n')
+    assert worker_pool.get_cgroup_cpu_limit(str(tmpdir)) == 1
+    tmpdir.join('cpu', 'cpu.cfs_quota_us').write('-1\n')
+    assert worker_pool.get_cgroup_cpu_limit(str(tmpdir)) is None
+
+def test_no_cgroup(tmpdir):
+    """Without cgroup files there is no limit."""
+    assert worker_pool.get_cgroup_cpu_limit(str(tmpdir)) is None
+    assert worker_pool.get_available_cpus() >= 1
+
+def test_queue_size():
+    """The queue size follows the number of workers if it is not given."""
+    assert worker_pool.get_queue_size(3) == 3 * worker_pool.ENVELOPES_PER_WORKER
+    assert worker_pool.get_queue_size(3, 10) == 10
+
+def test_all_workers():
+    """Without adaptive all workers are started at once."""
+    pool = worker_pool.WorkerPool(Queue(8), Worker, 4, 8)
+    pool.start()
+    assert len(pool.workers) == 4
+    assert all(worker.started for worker in pool.workers)
+
+def test_adaptive():
+    """Workers are added when the queue is filling up, but not more than max_workers."""
+    task_queue = Queue(8)
+    pool = worker_pool.WorkerPool(task_queue, Worker, 3, 8, adaptive = True)
+    pool.start()
+    assert len(pool.workers) == 1
+    for i in range(3):
+        pool.put([])
+    assert len(pool.workers) == 1
+    pool.put([])
+    assert len(pool.workers) == 2
+    # The queue is emptied by the workers, then no workers are added:
+    while not task_queue.empty():
+        task_queue.get()
+        task_queue.task_done()
+    for i in range(3):
+        pool.put([])
+        task_queue.get()
+        task_queue.task_done()
+    assert len(pool.workers) == 2
+    for i in range(8):
+        pool.put([])
+    assert len(pool.workers) == 3
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()